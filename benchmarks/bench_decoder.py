@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+"""Micro benchmarks of the ajax answers decoding on the recorded payloads of fixtures/.
+
+Compares py_hydrocapt.decoder to the previous decoding (parse of the decoded text, then one
+XPath per command or consign), run with the package installed:
+
+    python benchmarks/bench_decoder.py [--number N]
+"""
+import argparse
+import os
+import timeit
+
+from lxml import etree
+
+from py_hydrocapt import decoder
+from py_hydrocapt.const import HYDROCAPT_INTERNAL_TO_EXTERNAL_COMMANDS
+from py_hydrocapt.const import HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+
+def load_fixture(name: str) -> bytes:
+    with open(os.path.join(FIXTURES_DIR, name), "rb") as f:
+        return f.read()
+
+
+def _xpath_check_status(tree):
+    r = tree.xpath("/root/status")
+    if r is not None and len(r) > 0:
+        if "You are not authenticated" in r[0].text:
+            raise ValueError
+        if "OK" not in r[0].text:
+            raise ValueError
+
+
+def xpath_decode_commands(text: str):
+    tree = etree.fromstring(text)
+    _xpath_check_status(tree)
+    states = {}
+    for state in HYDROCAPT_INTERNAL_TO_EXTERNAL_COMMANDS:
+        try:
+            states[state] = int(tree.xpath(f"/root/datas/{state}")[0].text)
+        except:
+            pass
+    return states
+
+
+def xpath_decode_consigns(text: str):
+    tree = etree.fromstring(text)
+    _xpath_check_status(tree)
+    consigns = {}
+    for state in HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS:
+        for path in [f"/root/datas/select/{state}", f"/root/datas/timer/{state}"]:
+            try:
+                consigns[state] = tree.xpath(path)[0].text
+            except:
+                pass
+    return consigns
+
+
+def xpath_decode_alarms(text: str):
+    tree = etree.fromstring(text)
+    _xpath_check_status(tree)
+    alarms = {}
+    for alrm in tree.iter(tag="alarm"):
+        alarms[alrm.attrib.get("name")] = {c.tag: float(c.text) if c.tag != "enable" else bool(c.text) for c in alrm}
+    return alarms
+
+
+def _strip_declaration(content: bytes) -> str:
+    # lxml refuses a str with an encoding declaration, the previous code got answers without one
+    text = content.decode("utf-8")
+    if text.startswith("<?xml"):
+        text = text[text.index("?>") + 2:]
+    return text
+
+
+def run(number: int) -> None:
+    cases = [
+        ("commands", "commands.xml", xpath_decode_commands, decoder.decode_commands),
+        ("consigns", "consigns.xml", xpath_decode_consigns, decoder.decode_consigns),
+        ("alarms", "alarms.xml", xpath_decode_alarms, decoder.decode_alarms),
+    ]
+
+    print(f"{'payload':<12}{'xpath us':>12}{'decoder us':>12}{'speedup':>10}")
+    for name, fixture, xpath_func, decoder_func in cases:
+        content = load_fixture(fixture)
+        # the previous decoding went through response.text, include the bytes to str decoding
+        t_xpath = timeit.timeit(lambda: xpath_func(_strip_declaration(content)), number=number) / number
+        t_decoder = timeit.timeit(lambda: decoder_func(content), number=number) / number
+        assert xpath_func(_strip_declaration(content)) == decoder_func(content)
+        print(f"{name:<12}{t_xpath * 1e6:>12.1f}{t_decoder * 1e6:>12.1f}{t_xpath / t_decoder:>9.1f}x")
+
+    content = load_fixture("save_no_change.xml")
+    t_save = timeit.timeit(lambda: decoder.decode_save_status(content), number=number) / number
+    print(f"{'save':<12}{'':>12}{t_save * 1e6:>12.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--number", type=int, default=20000, help="decodings per payload")
+    args = parser.parse_args()
+    run(args.number)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""End to end benchmarks of the clients against a local HydrocaptFakeServer.
+
+Measures the latency, throughput and number of round trips (HTTP requests received by the
+server) of fetch_all_data, set_command_state, a history backfill and a fleet refresh for
+several pool counts. Run with the package installed:
+
+    python benchmarks/bench_e2e.py [--latency 0.05] [--pools 1,10,50] [--json results.json]
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import date
+from datetime import timedelta
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt import HydrocaptFleet
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+
+
+USERNAME = "bench"
+PASSWORD = "bench"
+FIRST_SERIAL = 1000
+
+
+def _measure(server: HydrocaptFakeServer, name: str, func: Callable[[int], Any], iterations: int, units_per_call: int = 1) -> Dict[str, Any]:
+    server.reset_round_trips()
+    durations = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        t = time.perf_counter()
+        func(i)
+        durations.append(time.perf_counter() - t)
+    total = time.perf_counter() - start
+
+    round_trips = server.get_round_trips()
+    durations.sort()
+    return {
+        "operation": name,
+        "calls": iterations,
+        "p50_ms": statistics.median(durations) * 1000,
+        "p95_ms": durations[min(len(durations) - 1, int(len(durations) * 0.95))] * 1000,
+        "throughput_per_s": iterations * units_per_call / total if total > 0 else float("inf"),
+        "round_trips_per_call": sum(round_trips.values()) / iterations,
+        "round_trips": round_trips,
+    }
+
+
+def bench_client(server: HydrocaptFakeServer, iterations: int, days: int, parallel: bool) -> List[Dict[str, Any]]:
+    client = HydrocaptClient(USERNAME, PASSWORD, FIRST_SERIAL, parallel=parallel, base_url=server.base_url)
+    # log in outside of the measures
+    client.get_commands_current_states()
+
+    results = [_measure(server, f"fetch_all_data(parallel={parallel})",
+                        lambda i: client.fetch_all_data(force_refresh=True), iterations)]
+
+    states = ["Pool Light ON", "Pool Light OFF"]
+    results.append(_measure(server, "set_command_state",
+                            lambda i: client.set_command_state("Light", states[i % 2]), iterations))
+
+    end = date.today() - timedelta(days=1)
+    results.append(_measure(server, f"iter_history({days} days)",
+                            lambda i: sum(1 for _ in client.iter_history(end - timedelta(days=days - 1), end)),
+                            max(1, iterations // 5), units_per_call=days))
+
+    return results
+
+
+def bench_fleet(server: HydrocaptFakeServer, pool_counts: List[int], iterations: int) -> List[Dict[str, Any]]:
+    results = []
+    for count in pool_counts:
+        entries = [(USERNAME, PASSWORD, FIRST_SERIAL + i) for i in range(count)]
+        with HydrocaptFleet(entries, base_url=server.base_url) as fleet:
+            fleet.refresh_all()
+            res = _measure(server, f"fleet.refresh_all({count} pools)", lambda i: fleet.refresh_all(), iterations, units_per_call=count)
+        res["round_trips_per_pool"] = res["round_trips_per_call"] / count
+        results.append(res)
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency", type=float, default=0.05, help="server latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.0, help="max random latency added, in seconds")
+    parser.add_argument("--apply-delay", type=float, default=0.2, help="seconds before a save is applied by the fake pool")
+    parser.add_argument("--pools", default="1,10,50", help="comma separated pool counts of the fleet benchmark")
+    parser.add_argument("--iterations", type=int, default=10)
+    parser.add_argument("--days", type=int, default=30, help="days of the history backfill")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    pool_counts = [int(p) for p in args.pools.split(",")]
+
+    server = HydrocaptFakeServer(latency=args.latency, jitter=args.jitter, apply_delay=args.apply_delay, seed=0)
+    for i in range(max(pool_counts)):
+        server.add_pool(USERNAME, PASSWORD, FIRST_SERIAL + i)
+
+    with server:
+        results = bench_client(server, args.iterations, args.days, parallel=False)
+        results += bench_client(server, args.iterations, args.days, parallel=True)[:1]
+        results += bench_fleet(server, pool_counts, args.iterations)
+
+    print(f"{'operation':<36}{'p50 ms':>10}{'p95 ms':>10}{'per s':>10}{'round trips':>13}")
+    for r in results:
+        print(f"{r['operation']:<36}{r['p50_ms']:>10.1f}{r['p95_ms']:>10.1f}{r['throughput_per_s']:>10.1f}{r['round_trips_per_call']:>13.1f}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
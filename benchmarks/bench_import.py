@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Import time of the package and per call cost of the measures decoding.
+
+Each import is timed in a new interpreter, run with the package installed:
+
+    python benchmarks/bench_import.py [--runs N] [--number N]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import timeit
+
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+
+IMPORTS = [
+    ("import py_hydrocapt", "import py_hydrocapt"),
+    ("import py_hydrocapt.const", "import py_hydrocapt.const"),
+    ("HydrocaptClient", "from py_hydrocapt import HydrocaptClient"),
+    ("AsyncHydrocaptClient", "from py_hydrocapt import AsyncHydrocaptClient"),
+    ("HydrocaptFleet", "from py_hydrocapt import HydrocaptFleet"),
+]
+
+
+def time_import(statement: str, runs: int) -> float:
+    """Median seconds spent in statement in a fresh interpreter, the interpreter startup excluded."""
+    code = (
+        "import time\n"
+        "t = time.perf_counter()\n"
+        f"{statement}\n"
+        "print(time.perf_counter() - t)\n"
+    )
+    durations = []
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+        durations.append(float(out))
+    return statistics.median(durations)
+
+
+def run(runs: int, number: int) -> None:
+    print(f"{'import':<28}{'ms':>10}")
+    for name, statement in IMPORTS:
+        print(f"{name:<28}{time_import(statement, runs) * 1000:>10.1f}")
+
+    from dateutil.parser import parse
+    from py_hydrocapt.client import HydrocaptClientBase
+    from py_hydrocapt.history import parse_date
+    from py_hydrocapt.history import parse_day_series
+    from py_hydrocapt.history import parse_history_day
+    from py_hydrocapt.history import to_date
+
+    with open(os.path.join(FIXTURES_DIR, "values_day.json"), "r", encoding="utf-8") as f:
+        content = json.load(f)
+    day = to_date("2026-10-17")
+    client = HydrocaptClientBase("user", "password", 1234)
+
+    cases = [
+        ("dateutil parse", lambda: parse("2026-10-17")),
+        ("parse_date", lambda: parse_date("2026-10-17")),
+        ("latest measures decoding", lambda: client._parse_pool_measure(content, "2026-10-17")),
+        ("history day decoding", lambda: parse_history_day(content, day)),
+        ("day series decoding", lambda: parse_day_series(content, day)),
+    ]
+
+    print()
+    print(f"{'call':<28}{'us':>10}")
+    for name, func in cases:
+        print(f"{name:<28}{timeit.timeit(func, number=number) / number * 1e6:>10.2f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="interpreters started per import")
+    parser.add_argument("--number", type=int, default=20000, help="calls per decoding benchmark")
+    args = parser.parse_args()
+    run(args.runs, args.number)
+
+
+if __name__ == "__main__":
+    main()
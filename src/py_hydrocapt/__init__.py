@@ -1,5 +1,48 @@
+"""Diffazur Hydrocapt REST Client.
 
-"""Diffazur Hydrocapt REST Client."""
-from .client import HydrocaptClient
+The classes are imported on first use, so importing the package (or only its const module)
+doesn't load requests, lxml or aiohttp.
+"""
+import importlib
+from typing import TYPE_CHECKING
 
-__all__ = ["HydrocaptClient"]
+if TYPE_CHECKING:
+    from .client import HydrocaptClient
+    from .async_client import AsyncHydrocaptClient
+    from .confirmation import HydrocaptConfirmation
+    from .fleet import HydrocaptFleet
+    from .fleet import HydrocaptFleetResult
+    from .metrics import HydrocaptMetrics
+    from .poller import HydrocaptPoller
+    from .poller import AsyncHydrocaptPoller
+    from .snapshot import PoolSnapshot
+    from .snapshot import HydrocaptTimer
+
+_EXPORTS = {
+    "HydrocaptClient": ".client",
+    "AsyncHydrocaptClient": ".async_client",
+    "HydrocaptConfirmation": ".confirmation",
+    "HydrocaptFleet": ".fleet",
+    "HydrocaptFleetResult": ".fleet",
+    "HydrocaptMetrics": ".metrics",
+    "HydrocaptPoller": ".poller",
+    "AsyncHydrocaptPoller": ".poller",
+    "PoolSnapshot": ".snapshot",
+    "HydrocaptTimer": ".snapshot",
+}
+
+__all__ = ["HydrocaptClient", "AsyncHydrocaptClient", "HydrocaptConfirmation", "HydrocaptFleet", "HydrocaptFleetResult", "HydrocaptMetrics",
+           "HydrocaptPoller", "AsyncHydrocaptPoller", "PoolSnapshot", "HydrocaptTimer"]
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
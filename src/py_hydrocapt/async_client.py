@@ -0,0 +1,443 @@
+# -*- coding: utf-8 -*-
+"""Asyncio client for the Diffazur Hydrocapt API."""
+import asyncio
+import copy
+import json
+from collections import deque
+from typing import Any
+from typing import AsyncIterator
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from datetime import date
+from datetime import datetime
+
+from .client import HydrocaptClientBase
+from .async_session import AsyncHydrocaptClientSession
+from .exceptions import HydrocaptError
+from .exceptions import HydrocaptCircuitOpenError
+from .metrics import HydrocaptMetrics
+from .singleflight import AsyncHydrocaptSingleFlight
+from .retry import HydrocaptRetryPolicy
+from .transport import HydrocaptHttpSettings
+from .deadline import deadline_scope
+from .deadline import with_deadline
+from .throttle import HydrocaptRateLimiter
+from .throttle import HydrocaptCircuitBreaker
+from .history import HydrocaptHistoryRecord
+from .history import plan_history_requests
+from .history import HydrocaptHistoryRequest
+from .history import to_date
+from .history import HydrocaptDaySeries
+from .history_cache import HydrocaptHistoryCache
+from .session_store import HydrocaptSessionStore
+from .changes import HydrocaptDelta
+from .confirmation import HydrocaptConfirmation
+
+from .const import HYDROCAPT_GET_POOL_COMMAND_URL
+from .const import HYDROCAPT_GET_ALARMS_URL
+from .const import HYDROCAPT_GET_POOL_CONSIGN_URL
+from .const import HYDROCAPT_RESOURCE_COMMANDS
+from .const import HYDROCAPT_RESOURCE_CONSIGNS
+from .const import HYDROCAPT_RESOURCE_MEASURES
+from .const import HYDROCAPT_RESOURCE_ALARMS
+from .const import HYDROCAPT_RESOLUTION_HOUR
+from .const import HYDROCAPT_TYPE_DATE_DAY
+from .const import HYDROCAPT_HISTORY_MAX_IN_FLIGHT
+
+
+class AsyncHydrocaptClient(HydrocaptClientBase):
+    """Asyncio proxy to the Hydrocapt REST API.
+
+    Same public surface as HydrocaptClient, all the network methods are coroutines.
+    Use it as an async context manager or call close() to release the HTTP session.
+    """
+
+    def __init__(self, username: str, password: str, pool_internal_id: Optional[int] = -1, http_session=None,
+                 cache_ttl: Optional[Dict[str, float]] = None, history_cache: Optional[HydrocaptHistoryCache] = None,
+                 confirmation: Optional[HydrocaptConfirmation] = None, base_url: Optional[str] = None,
+                 metrics: Optional[HydrocaptMetrics] = None, retry_policy: Optional[HydrocaptRetryPolicy] = None,
+                 rate_limiter: Optional[HydrocaptRateLimiter] = None, circuit_breaker: Optional[HydrocaptCircuitBreaker] = None,
+                 serve_stale: bool = False, http_settings: Optional[HydrocaptHttpSettings] = None,
+                 session_store: Optional[HydrocaptSessionStore] = None) -> None:
+        """Initialize the API, the authentication is done on first request.
+
+        Args:
+            username: string containing your Hydrocapt's app username
+            password: string containing your Hydrocapt's app password
+            pool_internal_id: the pool serial if already known, -1 to discover it at login
+            http_session: an optional aiohttp.ClientSession dedicated to this account
+            cache_ttl: per resource time in seconds a read can be answered from the last values
+            history_cache: an optional cache of the history days, see HydrocaptHistoryCache
+            confirmation: how the saves wait for the pool to apply them, see HydrocaptConfirmation
+            base_url: an optional server to use instead of www.hydrocapt.fr, e.g. a local HydrocaptFakeServer
+            metrics: an optional HydrocaptMetrics recording the requests, logins, confirmations and decoding time
+            retry_policy: caps and backoff of the retries, see HydrocaptRetryPolicy
+            rate_limiter: an optional HydrocaptRateLimiter, shared by the sessions toward the same host
+            circuit_breaker: an optional HydrocaptCircuitBreaker, shared by the sessions toward the same host
+            serve_stale: return the last read values while the circuit breaker is open, see stale_resources
+            http_settings: timeout, connection pool, keep alive and compression, see HydrocaptHttpSettings
+            session_store: an optional store to reuse the session of a previous process, see HydrocaptSessionStore
+        """
+        super().__init__(username, password, pool_internal_id, cache_ttl, history_cache, confirmation, metrics, serve_stale)
+        self.session = AsyncHydrocaptClientSession(self.username, self.password, self.pool_internal_id, http_session=http_session,
+                                                   base_url=base_url, metrics=metrics, retry_policy=retry_policy,
+                                                   rate_limiter=rate_limiter, circuit_breaker=circuit_breaker,
+                                                   http_settings=http_settings, session_store=session_store)
+        # concurrent reads of the same resource share one request
+        self._flights = AsyncHydrocaptSingleFlight(self._record_coalesced)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self) -> None:
+        await self.session.close()
+
+    async def _get_pool_internal_id(self):
+        if self.pool_internal_id < 0:
+            self.pool_internal_id = await self.session.get_internal_pool_id()
+        return self.pool_internal_id
+
+    @with_deadline
+    async def is_connection_ok(self):
+        pool_id = await self._get_pool_internal_id()
+        return pool_id >= 0
+
+    async def _get_pool_measure_values(self, pool_id, today):
+
+        get_pool_data_url = self._get_pool_measure_url(pool_id, today)
+
+        a = json.loads(await self.session.get(get_pool_data_url))
+        self._check_measures_content(a)
+
+        return self._parse_pool_measure_day(a, today)
+
+    async def _get_alarm_thresholds(self) -> Dict[str, Any]:
+
+        pool_id = await self._get_pool_internal_id()
+
+        get_alarms_data, headers = self._get_alarms_request(pool_id)
+
+        result_get_alarms = await self.session.post(
+            HYDROCAPT_GET_ALARMS_URL,
+            data=get_alarms_data,
+            headers=headers
+        )
+
+        return self._parse_alarms(result_get_alarms)
+
+    @with_deadline
+    async def get_alarm_thresholds(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
+        """Get the alarms limits, see HydrocaptClient.get_alarm_thresholds."""
+
+        cached = self._get_cached(HYDROCAPT_RESOURCE_ALARMS, max_age, force_refresh)
+        if cached is not None:
+            return cached
+
+        async def read():
+            alarms = await self._get_alarm_thresholds()
+            self._keep_read(HYDROCAPT_RESOURCE_ALARMS, alarms)
+            return alarms
+
+        try:
+            alarms = await self._flights.do(HYDROCAPT_RESOURCE_ALARMS, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_ALARMS, e)
+
+        return copy.deepcopy(alarms)
+
+    @with_deadline
+    async def refresh_alarm_thresholds(self) -> Dict[str, Any]:
+        return await self.get_alarm_thresholds(force_refresh=True)
+
+    async def _get_pool_measure_latest(self) -> Dict[str, Any]:
+        """Retrieve most recents measures, see HydrocaptClient._get_pool_measure_latest."""
+
+        pool_id = await self._get_pool_internal_id()
+        if pool_id < 0:
+            raise HydrocaptError("can't get pool id in measure")
+
+        today = datetime.today().strftime('%Y-%m-%d')
+
+        # the limits are cached, when they are not ask for them along with the values
+        series, alarms = await asyncio.gather(
+            self._get_pool_measure_values(pool_id, today),
+            self.get_alarm_thresholds()
+        )
+
+        cur_data = self._apply_alarms_status(dict(series.latest), alarms)
+        self._set_measures_series(series, cur_data)
+        return cur_data
+
+    @with_deadline
+    async def get_pool_measure_latest(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
+
+        cached = self._get_cached(HYDROCAPT_RESOURCE_MEASURES, max_age, force_refresh)
+        if cached is not None:
+            return cached
+
+        async def read():
+            read_data = await self._get_pool_measure_latest()
+            self._keep_read(HYDROCAPT_RESOURCE_MEASURES, read_data)
+            return read_data
+
+        try:
+            read_data = await self._flights.do(HYDROCAPT_RESOURCE_MEASURES, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_MEASURES, e)
+
+        return copy.deepcopy(read_data)
+
+    @with_deadline
+    async def get_pool_measure_day(self, day=None, max_age: Optional[float] = None, force_refresh: bool = False) -> HydrocaptDaySeries:
+        """Get the hourly measures of a day with the latest valid measures, see HydrocaptClient.get_pool_measure_day."""
+
+        day = to_date(day) if day is not None else date.today()
+        if day != date.today():
+            a = await self._get_history_content(day)
+            self._check_measures_content(a)
+            return self._parse_pool_measure_day(a, day)
+
+        await self.get_pool_measure_latest(max_age, force_refresh)
+        series = self._get_measures_series(day)
+        if series is None:
+            await self.get_pool_measure_latest(force_refresh=True)
+            series = self._get_measures_series(day)
+            if series is None:
+                raise HydrocaptError("Cannot get pool measures")
+        return series
+
+    async def _get_history_content(self, day, type_date=HYDROCAPT_TYPE_DATE_DAY) -> Dict[str, Any]:
+
+        pool_id = await self._get_pool_internal_id()
+
+        a = self._get_history_from_cache(pool_id, day, type_date)
+        if a is not None:
+            return a
+
+        get_pool_data_url = self._get_pool_measure_url(pool_id, day.strftime('%Y-%m-%d'), type_date)
+
+        a = json.loads(await self.session.get(get_pool_data_url))
+
+        self._put_history_in_cache(pool_id, day, type_date, a)
+
+        return a
+
+    @with_deadline
+    async def _get_history_period(self, request: HydrocaptHistoryRequest, resolution) -> List[HydrocaptHistoryRecord]:
+        return self._parse_history(await self._get_history_content(request.start, request.type_date), request, resolution)
+
+    async def iter_history(self, start, end, max_in_flight: int = HYDROCAPT_HISTORY_MAX_IN_FLIGHT,
+                           resolution: str = HYDROCAPT_RESOLUTION_HOUR, deadline: Optional[float] = None) -> AsyncIterator[HydrocaptHistoryRecord]:
+        """Yield the hourly, or daily, measures between two days, see HydrocaptClient.iter_history."""
+
+        # log in first so the concurrent requests below don't all try to
+        end_time = self._get_history_end_time(deadline)
+        with deadline_scope(self._get_time_left(end_time)):
+            await self._get_pool_internal_id()
+
+        start = to_date(start)
+        end = to_date(end)
+        clip = self._get_history_clipper(start, end)
+        pending = deque()
+        try:
+            for request in plan_history_requests(start, end, resolution):
+                pending.append(asyncio.ensure_future(self._get_history_period(request, resolution, deadline=self._get_time_left(end_time))))
+                if len(pending) >= max_in_flight:
+                    for record in clip(await pending.popleft()):
+                        yield record
+
+            while len(pending) > 0:
+                for record in clip(await pending.popleft()):
+                    yield record
+        finally:
+            # the caller may stop iterating before the end
+            for task in pending:
+                task.cancel()
+
+    async def _get_commands_current_states(self) -> Dict[str, Any]:
+
+        pool_id = await self._get_pool_internal_id()
+
+        commands_state = await self.session.get(f"{HYDROCAPT_GET_POOL_COMMAND_URL}?serial={pool_id}")
+
+        return self._parse_commands_current_states(commands_state)
+
+    @with_deadline
+    async def get_commands_current_states(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
+
+        cached = self._get_cached(HYDROCAPT_RESOURCE_COMMANDS, max_age, force_refresh)
+        if cached is not None:
+            return cached
+
+        async def read():
+            version = self._get_write_version(HYDROCAPT_RESOURCE_COMMANDS)
+            states = await self._get_commands_current_states()
+            self._keep_read(HYDROCAPT_RESOURCE_COMMANDS, states, version)
+            return states
+
+        try:
+            states = await self._flights.do(HYDROCAPT_RESOURCE_COMMANDS, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_COMMANDS, e)
+
+        return copy.deepcopy(states)
+
+    async def _wait_confirmation(self, resource, values, confirmation: HydrocaptConfirmation) -> None:
+        """Read resource back, following the confirmation delays, until it includes the saved values."""
+
+        if resource == HYDROCAPT_RESOURCE_COMMANDS:
+            read = self.get_commands_current_states
+        else:
+            read = self.get_current_consigns
+
+        steps = self._iter_confirmation(resource, values, confirmation)
+        try:
+            delay = next(steps)
+            while True:
+                await asyncio.sleep(delay)
+                delay = steps.send(await read(force_refresh=True))
+        except StopIteration:
+            pass
+
+    async def _save(self, resource, values, confirmation: Optional[HydrocaptConfirmation] = None) -> None:
+        """Save commands or consigns in a single request and wait for the pool to apply them."""
+
+        url, data, headers = self._begin_save(resource, values, await self._get_pool_internal_id())
+        result_save = await self.session.post(url, data=data, headers=headers)
+
+        confirmation = self._get_save_confirmation(resource, values, result_save, confirmation)
+        if confirmation is not None:
+            await self._wait_confirmation(resource, values, confirmation)
+
+    @with_deadline
+    async def set_command_state(self, command, state, get_prev=False, confirmation: Optional[HydrocaptConfirmation] = None):
+
+        prev_state = None
+
+        if get_prev is True:
+            curr_states = await self.get_commands_current_states()
+            prev_state = curr_states.get(command)
+
+        await self._save(HYDROCAPT_RESOURCE_COMMANDS, {command:state}, confirmation)
+
+        return prev_state
+
+    @with_deadline
+    async def set_commands(self, commands: Dict[str, str], confirmation: Optional[HydrocaptConfirmation] = None) -> Dict[str, Any]:
+        """Change several commands at once, see HydrocaptClient.set_commands."""
+
+        self._check_known_commands(commands)
+
+        prev_states = await self.get_commands_current_states(force_refresh=True)
+
+        changed = self._get_changed(commands, prev_states)
+        if len(changed) > 0:
+            await self._save(HYDROCAPT_RESOURCE_COMMANDS, changed, confirmation)
+
+        return {k: prev_states.get(k) for k in commands}
+
+    @with_deadline
+    async def set_consign(self, consign, value, get_prev=False, confirmation: Optional[HydrocaptConfirmation] = None):
+
+        consigns = self._normalize_consigns({consign:value})
+
+        prev_value = None
+
+        if get_prev is True:
+            cur_consigns = await self.get_current_consigns()
+            # by its external name, the one of the returned consigns
+            prev_value = cur_consigns.get(next(iter(consigns)))
+
+        await self._save(HYDROCAPT_RESOURCE_CONSIGNS, consigns, confirmation)
+
+        return prev_value
+
+    @with_deadline
+    async def set_consigns(self, consigns: Dict[str, Any], confirmation: Optional[HydrocaptConfirmation] = None) -> Dict[str, Any]:
+        """Change several consigns at once, see HydrocaptClient.set_consigns."""
+
+        consigns = self._normalize_consigns(consigns)
+
+        prev_consigns = await self.get_current_consigns(force_refresh=True)
+
+        changed = self._get_changed(consigns, prev_consigns)
+        if len(changed) > 0:
+            await self._save(HYDROCAPT_RESOURCE_CONSIGNS, changed, confirmation)
+
+        return {k: prev_consigns.get(k) for k in consigns}
+
+    @with_deadline
+    async def set_consign_timer_hours(self, consign, hours: Dict[int, bool], confirmation: Optional[HydrocaptConfirmation] = None):
+        """Change several hours of a timer with a single save, see HydrocaptClient.set_consign_timer_hours."""
+
+        consign = self._check_timer_hours(consign, hours)
+
+        prev_timer = (await self.get_current_consigns(force_refresh=True)).get(consign)
+
+        timer = self._get_changed_timer(consign, prev_timer, hours)
+        if timer is not None:
+            await self._save(HYDROCAPT_RESOURCE_CONSIGNS, {consign:timer}, confirmation)
+
+        return prev_timer
+
+    @with_deadline
+    async def set_consign_timer_range(self, consign, start_hour: int, end_hour: int, value: bool, confirmation: Optional[HydrocaptConfirmation] = None):
+        """Set the hours from start_hour to end_hour (excluded) of a timer, see HydrocaptClient.set_consign_timer_range."""
+        return await self.set_consign_timer_hours(consign, self._get_timer_range_hours(start_hour, end_hour, value), confirmation)
+
+    @with_deadline
+    async def set_consign_timer_hour(self, consign, hour_idx, value, confirmation: Optional[HydrocaptConfirmation] = None):
+        """Change one hour of a timer, see HydrocaptClient.set_consign_timer_hour."""
+        return await self.set_consign_timer_hours(consign, {hour_idx:value}, confirmation)
+
+    async def _get_current_consigns(self) -> Dict[str, Any]:
+
+        pool_id = await self._get_pool_internal_id()
+
+        consigns_state = await self.session.get(f"{HYDROCAPT_GET_POOL_CONSIGN_URL}?serial={pool_id}")
+
+        return self._parse_current_consigns(consigns_state)
+
+    @with_deadline
+    async def get_current_consigns(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
+
+        cached = self._get_cached(HYDROCAPT_RESOURCE_CONSIGNS, max_age, force_refresh)
+        if cached is not None:
+            return cached
+
+        async def read():
+            version = self._get_write_version(HYDROCAPT_RESOURCE_CONSIGNS)
+            states = await self._get_current_consigns()
+            self._keep_read(HYDROCAPT_RESOURCE_CONSIGNS, states, version)
+            return states
+
+        try:
+            states = await self._flights.do(HYDROCAPT_RESOURCE_CONSIGNS, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_CONSIGNS, e)
+
+        return copy.deepcopy(states)
+
+    @with_deadline
+    async def fetch_all_data(self, force_refresh: bool = False):
+        # log in first so the concurrent reads below don't all try to
+        await self._get_pool_internal_id()
+
+        await asyncio.gather(
+            self.get_commands_current_states(force_refresh=force_refresh),
+            self.get_pool_measure_latest(force_refresh=force_refresh),
+            self.get_current_consigns(force_refresh=force_refresh)
+        )
+        return self.get_packaged_data()
+
+    @with_deadline
+    async def refresh_changes(self, force_refresh: bool = False) -> List[HydrocaptDelta]:
+        """Refresh like fetch_all_data but only return what changed, see HydrocaptClient.refresh_changes."""
+        version = self.changes.version
+        await self.fetch_all_data(force_refresh=force_refresh)
+        return self.changes.since(version)
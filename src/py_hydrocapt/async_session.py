@@ -0,0 +1,357 @@
+# -*- coding: utf-8 -*-
+"""Asyncio session manager for the hydrocapt API in order to maintain authentication between calls."""
+import asyncio
+from email.utils import parsedate_to_datetime
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode
+from urllib.parse import urlparse
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .exceptions import HydrocaptError
+from .exceptions import HydrocaptAuthenticationError
+from .exceptions import HydrocaptTransportError
+from .exceptions import HydrocaptCircuitOpenError
+from .session_store import HydrocaptSessionStore
+from .metrics import HydrocaptMetrics
+from .metrics import get_endpoint
+from .retry import HydrocaptRetryPolicy
+from .retry import HYDROCAPT_DEFAULT_RETRY_POLICY
+from .retry import is_session_expired
+from .throttle import HydrocaptRateLimiter
+from .throttle import HydrocaptCircuitBreaker
+from .transport import HydrocaptHttpSettings
+from .transport import HYDROCAPT_DEFAULT_HTTP_SETTINGS
+from .deadline import check_wait
+from .deadline import get_timeout
+
+from .const import HYDROCAPT_BASE_URL
+from .const import HYDROCAPT_LOGIN_URL
+from .const import HYDROCAPT_DISCONNECT_URL
+from .const import HYDROCAPT_EDIT_POOL_OWN_URL
+from .const import HYDROCAPT_RETRY_STATUS
+
+
+class AsyncHydrocaptClientSession(object):
+    """Asyncio HTTP session manager for Hydrocapt api.
+    Same role as HydrocaptClientSession but built on aiohttp, the login is shared
+    between all the coroutines using this session, and done again only when an
+    answer shows that the session expired.
+    """
+
+    def __init__(self, username: str, password: str, pool_internal_id: int = -1, http_session=None, base_url: Optional[str] = None,
+                 metrics: Optional[HydrocaptMetrics] = None, retry_policy: Optional[HydrocaptRetryPolicy] = None,
+                 rate_limiter: Optional[HydrocaptRateLimiter] = None, circuit_breaker: Optional[HydrocaptCircuitBreaker] = None,
+                 http_settings: Optional[HydrocaptHttpSettings] = None, session_store: Optional[HydrocaptSessionStore] = None) -> None:
+        """Initialize, the authentication is done on first request.
+
+        Args:
+            username: the hydrocapt registered user
+            password: the hydrocapt user's password
+            pool_internal_id: the pool serial if already known, -1 to discover it at login
+            http_session: an optional aiohttp.ClientSession to use, dedicated to this account, it won't be closed by this object
+            base_url: an optional server to use instead of www.hydrocapt.fr, e.g. a local HydrocaptFakeServer
+            metrics: an optional HydrocaptMetrics recording the requests and logins of this session
+            retry_policy: caps and backoff of the retries, defaults to HydrocaptRetryPolicy()
+            rate_limiter: an optional HydrocaptRateLimiter, shared by the sessions toward the same host
+            circuit_breaker: an optional HydrocaptCircuitBreaker, shared by the sessions toward the same host
+            http_settings: timeout, connection pool, keep alive and compression, see HydrocaptHttpSettings
+            session_store: an optional store to reuse the session of a previous process instead of logging in,
+                shared with the sync sessions
+        """
+
+        self.username = username
+        self.password = password
+        self._pool_internal_id = pool_internal_id
+        self._session = http_session
+        self._own_session = http_session is None
+        self._logged_in = False
+        self._generation = 0
+        self._session_store = session_store
+        # login generation of a session restored from the session store, None if not restored
+        self._restored_generation: Optional[int] = None
+        self._login_lock = asyncio.Lock()
+        self.base_url = base_url.rstrip("/") if base_url is not None else None
+        self.metrics = metrics
+        self.retry_policy = retry_policy if retry_policy is not None else HYDROCAPT_DEFAULT_RETRY_POLICY
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.http_settings = http_settings if http_settings is not None else HYDROCAPT_DEFAULT_HTTP_SETTINGS
+
+    def _url(self, url: str) -> str:
+        if self.base_url is None or not url.startswith(HYDROCAPT_BASE_URL):
+            return url
+        return self.base_url + url[len(HYDROCAPT_BASE_URL):]
+
+    def _create_http_session(self):
+        try:
+            import aiohttp
+        except ImportError as err:
+            raise HydrocaptError("aiohttp is required for the asyncio client, install py-hydrocapt[async]") from err
+
+        settings = self.http_settings
+        connector = aiohttp.TCPConnector(limit_per_host=settings.pool_maxsize, force_close=not settings.keep_alive,
+                                         keepalive_timeout=settings.keepalive_timeout if settings.keep_alive else None)
+        return aiohttp.ClientSession(cookie_jar=aiohttp.CookieJar(unsafe=True), connector=connector, headers=settings.get_headers())
+
+    def _get_cookies(self) -> List[Dict[str, Any]]:
+        """The cookies of the session, in the format of the session store."""
+        cookies = []
+        for morsel in self._session.cookie_jar:
+            expires = None
+            if morsel["expires"]:
+                try:
+                    expires = parsedate_to_datetime(morsel["expires"]).timestamp()
+                except (TypeError, ValueError):
+                    pass
+            cookies.append({"name": morsel.key, "value": morsel.value, "domain": morsel["domain"], "path": morsel["path"] or "/",
+                            "expires": expires, "secure": bool(morsel["secure"])})
+        return cookies
+
+    def _restore_session(self) -> bool:
+
+        stored = self._session_store.load_cookies(self.username, self.base_url)
+        if stored is None:
+            return False
+
+        cookies, pool_id = stored
+        if self._pool_internal_id < 0:
+            if pool_id < 0:
+                return False
+            self._pool_internal_id = pool_id
+
+        from yarl import URL
+        if self._session is None:
+            self._session = self._create_http_session()
+            self._own_session = True
+        jar = SimpleCookie()
+        for c in cookies:
+            jar[c["name"]] = c["value"]
+            jar[c["name"]]["path"] = c["path"]
+            if c["domain"]:
+                jar[c["name"]]["domain"] = c["domain"]
+        self._session.cookie_jar.update_cookies(jar, response_url=URL(self._url(HYDROCAPT_BASE_URL)))
+
+        return True
+
+    async def _new_session(self) -> None:
+
+        if self._session is None:
+            self._session = self._create_http_session()
+            self._own_session = True
+        else:
+            self._session.cookie_jar.clear()
+
+        payload = {
+            "login": self.username,
+            "pass": self.password,
+        }
+
+        status, _, _ = await self._send_retrying("POST", HYDROCAPT_LOGIN_URL, data=payload, headers=dict(referer=HYDROCAPT_DISCONNECT_URL))
+        self._check_status(HYDROCAPT_LOGIN_URL, status)
+
+        if self._pool_internal_id < 0:
+
+            # only needed to discover the pool id, not imported with the package
+            from lxml import html
+            status, _, content = await self._send_retrying("GET", HYDROCAPT_EDIT_POOL_OWN_URL)
+            self._check_status(HYDROCAPT_EDIT_POOL_OWN_URL, status)
+            tree = html.fromstring(content)
+
+            try:
+                pool_id = int(list(set(tree.xpath("//input[@name='serial']/@value")))[0])
+
+            except:
+                raise HydrocaptError("Hydrocapt Diffazur: Can't get pool id")
+
+            self._pool_internal_id = pool_id
+
+        if self._session_store is not None:
+            self._session_store.save_cookies(self.username, self._get_cookies(), self._pool_internal_id, self.base_url)
+
+        self._logged_in = True
+
+    async def _login(self, failed_generation: Optional[int] = None) -> None:
+        """Log in once even if several coroutines ask for it at the same time.
+
+        Args:
+            failed_generation: the login generation a request failed with, None for a first login
+        """
+
+        async with self._login_lock:
+            # an other coroutine may have already renewed the session while we were waiting
+            if self._logged_in and (failed_generation is None or failed_generation != self._generation):
+                return
+
+            if self._generation == 0 and self._session_store is not None:
+                # reuse the session of a previous run, we will log in again if the server rejects it
+                if self._restore_session():
+                    self._logged_in = True
+                    self._generation += 1
+                    self._restored_generation = self._generation
+                    return
+
+            if failed_generation is not None and failed_generation == self._restored_generation:
+                # the server rejected the session of the previous run, don't restore it again
+                self._session_store.invalidate(self.username, self.base_url)
+                self._restored_generation = None
+
+            self._logged_in = False
+            await self._new_session()
+            self._generation += 1
+            if self.metrics is not None:
+                self.metrics.record_login(relogin=failed_generation is not None)
+
+    @property
+    def generation(self) -> int:
+        """Counter incremented on each login, used to detect an already renewed session."""
+        return self._generation
+
+    async def get_login_generation(self) -> int:
+        """Log in if not done yet and return the current login generation."""
+        if self._logged_in is False:
+            await self._login()
+        return self._generation
+
+    async def reconnect(self, failed_generation: Optional[int] = None) -> None:
+        """Force a new login, unless the session was renewed since failed_generation."""
+        if failed_generation is None:
+            failed_generation = self._generation
+        await self._login(failed_generation=failed_generation)
+
+    async def get_internal_pool_id(self):
+
+        if self._pool_internal_id < 0 or self._logged_in is False:
+            await self._login()
+
+        return self._pool_internal_id
+
+    async def _send(self, method, url, **kwargs) -> Tuple[int, str, bytes]:
+        url = self._url(url)
+        if self.metrics is None:
+            async with self._session.request(method, url, **kwargs) as ret:
+                return ret.status, str(ret.url), await ret.read()
+
+        data = kwargs.get("data")
+        event = self.metrics.request_started(method, url, len(urlencode(data)) if data else 0)
+        try:
+            async with self._session.request(method, url, **kwargs) as ret:
+                body = await ret.read()
+        except BaseException as e:
+            self.metrics.request_ended(event, error=e)
+            raise
+        self.metrics.request_ended(event, status=ret.status, bytes_received=len(body))
+        return ret.status, str(ret.url), body
+
+    async def _throttle(self, host: str) -> None:
+        """Check the circuit breaker then wait for the rate limiter, before sending a request to host.
+
+        A half open breaker lets this request through as its probe: it is given back if the wait fails,
+        like the rate limiter reservation.
+        """
+        if self.circuit_breaker is not None:
+            try:
+                self.circuit_breaker.before_request(host)
+            except HydrocaptCircuitOpenError:
+                if self.metrics is not None:
+                    self.metrics.record_circuit_rejection()
+                raise
+
+        if self.rate_limiter is not None:
+            delay = self.rate_limiter.reserve(host, self.username)
+            if delay > 0:
+                if self.metrics is not None:
+                    self.metrics.record_rate_limited(delay)
+                try:
+                    await asyncio.sleep(check_wait(delay, "rate limited"))
+                except BaseException:
+                    self.rate_limiter.cancel(host, self.username)
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.record_cancelled(host)
+                    raise
+
+    async def _send_retrying(self, method, url, **kwargs) -> Tuple[int, str, bytes]:
+        """Send a request, again after a transport or server error, following the retry policy."""
+        import aiohttp
+
+        host = urlparse(self._url(url)).netloc
+        breaker = self.circuit_breaker
+        failures = 0
+        while True:
+            await self._throttle(host)
+            try:
+                kwargs["timeout"] = aiohttp.ClientTimeout(total=get_timeout(self.http_settings.timeout, get_endpoint(url)))
+                res = await self._send(method, url, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                error = e
+            except BaseException:
+                if breaker is not None:
+                    breaker.record_cancelled(host)
+                raise
+            else:
+                if res[0] not in HYDROCAPT_RETRY_STATUS:
+                    if breaker is not None:
+                        breaker.record_success(host)
+                    return res
+                error = HydrocaptTransportError(f"{get_endpoint(url)} answered {res[0]}")
+
+            if breaker is not None:
+                breaker.record_failure(host)
+            failures += 1
+            delay = self.retry_policy.get_transport_delay(failures)
+            if delay is None:
+                raise HydrocaptTransportError(f"{get_endpoint(url)} failed {failures} times") from error
+            if self.metrics is not None:
+                self.metrics.record_retry(url)
+            await asyncio.sleep(check_wait(delay, f"retrying {get_endpoint(url)}"))
+
+    def _check_status(self, url, status) -> None:
+        if status >= 400:
+            raise HydrocaptError(f"{get_endpoint(url)} answered {status}")
+
+    async def _request(self, method, url, **kwargs) -> bytes:
+        """Send a request, logging in again only if its answer shows an expired session."""
+
+        relogins = 0
+        while True:
+            if self._logged_in is False:
+                await self._login()
+            generation = self._generation
+
+            status, final_url, content = await self._send_retrying(method, url, **kwargs)
+            if not is_session_expired(status, final_url, content):
+                self._check_status(url, status)
+                return content
+
+            relogins += 1
+            if relogins > self.retry_policy.max_relogins:
+                if self._session_store is not None:
+                    # the session saved by the last login is rejected too
+                    self._session_store.invalidate(self.username, self.base_url)
+                raise HydrocaptAuthenticationError(f"Session still expired after {relogins - 1} login(s) for {get_endpoint(url)}")
+            if self.metrics is not None:
+                self.metrics.record_retry(url)
+            await self._login(failed_generation=generation)
+
+    async def post(self, url, data, headers=None) -> bytes:
+
+        if headers is None:
+            headers = {}
+
+        if headers.get("referer") is None:
+            headers["referer"] = url
+
+        return await self._request("POST", url, data=data, headers=headers)
+
+    async def get(self, url) -> bytes:
+        return await self._request("GET", url)
+
+    async def close(self) -> None:
+        if self._session is not None and self._own_session:
+            await self._session.close()
+        self._session = None
+        self._logged_in = False
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""Change feed of the values read by a client: what changed at each refresh instead of the whole state."""
+import copy
+import threading
+from collections import deque
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from .const import HYDROCAPT_CHANGE_FEED_HISTORY
+
+
+class HydrocaptChange(NamedTuple):
+    """One value that changed, old is None for a new key and new is None for a removed one."""
+
+    key: str
+    old: Any
+    new: Any
+
+
+class HydrocaptDelta(NamedTuple):
+    """The values of a resource (commands, consigns, measures, alarms) changed by one refresh or save."""
+
+    version: int
+    resource: str
+    changes: Tuple[HydrocaptChange, ...]
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The new value of each changed key."""
+        return {c.key: c.new for c in self.changes}
+
+
+class HydrocaptChangeFeed(object):
+    """Compare each new state of a resource to the previous one and publish the differences.
+
+    The version is incremented only when something changed, so a consumer can skip a refresh
+    when it is the same as the last version it processed.
+    """
+
+    def __init__(self, history: int = HYDROCAPT_CHANGE_FEED_HISTORY) -> None:
+        """Initialize the feed.
+
+        Args:
+            history: number of deltas kept for since()
+        """
+        self._lock = threading.Lock()
+        self._version = 0
+        self._deltas = deque(maxlen=history)
+        self._subscribers: List[Tuple[Optional[frozenset], Optional[frozenset], Callable[[HydrocaptDelta], None]]] = []
+
+    @property
+    def version(self) -> int:
+        """Incremented by each delta, 0 until a first value is read."""
+        return self._version
+
+    def update(self, resource: str, old_values: Dict[str, Any], new_values: Dict[str, Any]) -> Optional[HydrocaptDelta]:
+        """Publish the differences between two states of a resource.
+
+        Returns:
+            The delta, None if nothing changed
+        """
+        delta = self.record(resource, old_values, new_values)
+        self.publish(delta)
+        return delta
+
+    def record(self, resource: str, old_values: Dict[str, Any], new_values: Dict[str, Any]) -> Optional[HydrocaptDelta]:
+        """Add the differences between two states of a resource to the feed, without calling the subscribers.
+
+        The clients record under the lock of their values, so the versions follow the order of the states,
+        and publish the delta once it is released.
+
+        Returns:
+            The delta, None if nothing changed
+        """
+        changes = []
+        for key, new in new_values.items():
+            old = old_values.get(key)
+            if key not in old_values or old != new:
+                changes.append(HydrocaptChange(key, copy.deepcopy(old), copy.deepcopy(new)))
+        for key, old in old_values.items():
+            if key not in new_values:
+                changes.append(HydrocaptChange(key, copy.deepcopy(old), None))
+
+        if len(changes) == 0:
+            return None
+
+        with self._lock:
+            self._version += 1
+            delta = HydrocaptDelta(self._version, resource, tuple(changes))
+            self._deltas.append(delta)
+
+        return delta
+
+    def publish(self, delta: Optional[HydrocaptDelta]) -> None:
+        """Call the subscribers of a recorded delta, nothing is done for None."""
+        if delta is None:
+            return
+
+        for keys, resources, callback in self._subscribers:
+            if resources is not None and delta.resource not in resources:
+                continue
+            if keys is None:
+                self._notify(callback, delta)
+                continue
+            filtered = tuple(c for c in delta.changes if c.key in keys)
+            if len(filtered) > 0:
+                self._notify(callback, delta._replace(changes=filtered))
+
+    def _notify(self, callback: Callable[[HydrocaptDelta], None], delta: HydrocaptDelta) -> None:
+        try:
+            callback(delta)
+        except Exception:
+            # a broken subscriber must neither break the reads nor deprive the other subscribers
+            pass
+
+    def since(self, version: int) -> List[HydrocaptDelta]:
+        """The deltas published after version, oldest first.
+
+        Only the last deltas are kept: if some after version were dropped, a consumer should read the whole state again,
+        see get_packaged_data, this is the case when the first returned delta version is not version + 1.
+        """
+        with self._lock:
+            return [d for d in self._deltas if d.version > version]
+
+    def subscribe(self, callback: Callable[[HydrocaptDelta], None], keys: Optional[Iterable[str]] = None,
+                  resources: Optional[Iterable[str]] = None) -> Callable[[], None]:
+        """Call callback with each delta, only for the changes of the given keys and resources if set.
+
+        The callback runs in the thread (or coroutine) that read the new values, after the client released
+        its lock, so it can call the client. Deltas from concurrent reads may arrive out of order, see their version.
+        Its exceptions are ignored.
+
+        Returns:
+            a function removing the subscription
+        """
+        entry = (frozenset(keys) if keys is not None else None, frozenset(resources) if resources is not None else None, callback)
+        with self._lock:
+            self._subscribers = self._subscribers + [entry]
+
+        def unsubscribe():
+            with self._lock:
+                self._subscribers = [s for s in self._subscribers if s is not entry]
+
+        return unsubscribe
@@ -1,30 +1,59 @@
 # -*- coding: utf-8 -*-
 """Client for the Diffazur Hydrocapt API."""
 import copy
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import FrozenSet
+from typing import Generator
+from typing import Iterator
+from typing import List
 from typing import Optional
+from typing import Tuple
 
-
-from lxml import etree
-from dateutil.parser import parse
-
-
+from datetime import date
 from datetime import datetime
 from datetime import timedelta
 
-#if issues with .maymodule relative imports
-if __package__ is None or len(__package__) <= 1:
-    import sys
-    from pathlib import Path
-    DIR = Path(__file__).resolve().parent
-    sys.path.insert(0, str(DIR.parent))
-    __package__ = DIR.name
-
 
 from .session import HydrocaptClientSession
+from .session_store import HydrocaptSessionStore
+from .history import HydrocaptHistoryRecord
+from .history import parse_history_period
+from .history import plan_history_requests
+from .history import HydrocaptHistoryRequest
+from .history import parse_history_day
+from .history import parse_day_series
+from .history import to_date
+from .history import HydrocaptDaySeries
+from .history_cache import HydrocaptHistoryCache
+from .changes import HydrocaptChangeFeed
+from .changes import HydrocaptDelta
+from .confirmation import HydrocaptConfirmation
+from .confirmation import HydrocaptConfirmationResult
+from .decoder import check_status
+from .decoder import decode_alarms
+from .decoder import decode_commands
+from .decoder import decode_consigns
+from .decoder import decode_save_status
 from .exceptions import HydrocaptError
+from .exceptions import HydrocaptCircuitOpenError
+from .exceptions import HydrocaptDeadlineExceeded
+from .metrics import HydrocaptMetrics
+from .snapshot import HydrocaptTimer
+from .snapshot import PoolSnapshot
+from .singleflight import HydrocaptSingleFlight
+from .retry import HydrocaptRetryPolicy
+from .transport import HydrocaptHttpSettings
+from .deadline import deadline_scope
+from .deadline import get_remaining
+from .deadline import with_deadline
+from .throttle import HydrocaptRateLimiter
+from .throttle import HydrocaptCircuitBreaker
 
 from .const import HYDROCAPT_AJAX_VALUES_HISTORY
 from .const import HYDROCAPT_GET_POOL_COMMAND_URL
@@ -43,173 +72,395 @@ from .const import HYDROCAPT_GET_POOL_CONSIGN_URL
 from .const import HYDROCAPT_SAVE_POOL_CONSIGN_URL
 
 from .const import HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS, HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS, HYDROCAPT_TIMER, HYDROCAPT_TIMERS
-class HydrocaptClient(object):
-    """Proxy to the Hydrocapt REST API."""
+from .const import HYDROCAPT_PARALLEL_MAX_WORKERS
+from .const import HYDROCAPT_HISTORY_MAX_IN_FLIGHT
+from .const import HYDROCAPT_DEFAULT_CACHE_TTL
+from .const import HYDROCAPT_RESOURCE_COMMANDS
+from .const import HYDROCAPT_RESOURCE_CONSIGNS
+from .const import HYDROCAPT_RESOURCE_MEASURES
+from .const import HYDROCAPT_RESOURCE_ALARMS
+from .const import HYDROCAPT_RESOURCE_HISTORY
+from .const import HYDROCAPT_TYPE_DATE_DAY
+from .const import HYDROCAPT_RESOLUTION_HOUR
+
+
+_shared_executor: Optional[ThreadPoolExecutor] = None
+_shared_executor_lock = threading.Lock()
+
+
+def _get_shared_executor() -> ThreadPoolExecutor:
+    """Executor shared by all the clients running their reads in parallel."""
+    global _shared_executor
+    with _shared_executor_lock:
+        if _shared_executor is None:
+            _shared_executor = ThreadPoolExecutor(max_workers=HYDROCAPT_PARALLEL_MAX_WORKERS, thread_name_prefix="hydrocapt")
+        return _shared_executor
+
+
+#error raised when a read of these resources returns nothing
+_EMPTY_READ_ERRORS = {
+    HYDROCAPT_RESOURCE_COMMANDS: "Cannot get commands state",
+    HYDROCAPT_RESOURCE_CONSIGNS: "Cannot get current consigns",
+    HYDROCAPT_RESOURCE_MEASURES: "Cannot get pool measures",
+}
 
-    def __init__(self, username: str, password: str, pool_internal_id: Optional[int] = -1) -> None:
-        """Initialize the API and authenticate so we can make requests.
+
+class HydrocaptClientBase(object):
+    """Transport independent part of the Hydrocapt clients.
+
+    It holds the last read values and knows how to build requests payloads and
+    decode the Hydrocapt responses, the sync and async clients only add the I/O.
+    """
+
+    def __init__(self, username: str, password: str, pool_internal_id: Optional[int] = -1, cache_ttl: Optional[Dict[str, float]] = None,
+                 history_cache: Optional[HydrocaptHistoryCache] = None, confirmation: Optional[HydrocaptConfirmation] = None,
+                 metrics: Optional[HydrocaptMetrics] = None, serve_stale: bool = False) -> None:
+        """Initialize the common client state.
 
         Args:
             username: string containing your Hydrocapt's app username
             password: string containing your Hydrocapt's app password
+            pool_internal_id: the pool serial if already known, -1 to discover it at login
+            cache_ttl: time in seconds a read is answered from the last values, per resource
+                (HYDROCAPT_RESOURCE_COMMANDS, HYDROCAPT_RESOURCE_CONSIGNS, HYDROCAPT_RESOURCE_MEASURES,
+                HYDROCAPT_RESOURCE_ALARMS), 0 to always read
+            history_cache: an optional cache of the history days, so finished days are only fetched once
+            confirmation: how the saves wait for the pool to apply them, defaults to HydrocaptConfirmation()
+            metrics: an optional HydrocaptMetrics recording the confirmations and the decoding time of the answers
+            serve_stale: when the circuit breaker is open, return the last read values instead of failing,
+                the resources served this way are listed in stale_resources
         """
         self.username = username
         self.password = password
-        self.session: Optional[HydrocaptClientSession] = None
         self.pool_internal_id = pool_internal_id
         self._saved_states = {}
         self._saved_consigns = {}
         self._saved_read_values = {}
+        self._saved_alarms = {}
+        self._saved_times = {}
+        self.cache_ttl = dict(HYDROCAPT_DEFAULT_CACHE_TTL)
+        if cache_ttl is not None:
+            self.cache_ttl.update(cache_ttl)
+        self.history_cache = history_cache
+        self.confirmation = confirmation if confirmation is not None else HydrocaptConfirmation()
+        self.last_confirmation: Optional[HydrocaptConfirmationResult] = None
+        self.metrics = metrics
+        self.changes = HydrocaptChangeFeed()
+        # guard the last values of each resource, the clients can be shared by threads
+        self._saved_locks = {r: threading.RLock() for r in HYDROCAPT_DEFAULT_CACHE_TTL}
+        self.serve_stale = serve_stale
+        self._stale_resources = set()
+        # incremented by each save of the resource, a read started before it may return the old values
+        self._write_versions = {r: 0 for r in HYDROCAPT_DEFAULT_CACHE_TTL}
+        # the day series of the last measures read, they come from the same answer
+        self._measures_series: Optional[HydrocaptDaySeries] = None
+
+    def _get_saved(self, resource) -> Dict[str, Any]:
+        if resource == HYDROCAPT_RESOURCE_COMMANDS:
+            return self._saved_states
+        if resource == HYDROCAPT_RESOURCE_CONSIGNS:
+            return self._saved_consigns
+        if resource == HYDROCAPT_RESOURCE_ALARMS:
+            return self._saved_alarms
+        return self._saved_read_values
+
+    def _store_saved(self, resource, values) -> Optional[HydrocaptDelta]:
+        """Replace the last values of resource, the caller holds its lock and publishes the returned delta once released."""
+        old_values = self._get_saved(resource)
+        if resource == HYDROCAPT_RESOURCE_COMMANDS:
+            self._saved_states = values
+        elif resource == HYDROCAPT_RESOURCE_CONSIGNS:
+            self._saved_consigns = values
+        elif resource == HYDROCAPT_RESOURCE_ALARMS:
+            self._saved_alarms = values
+        else:
+            self._saved_read_values = values
+        self._saved_times[resource] = time.monotonic()
+        self._stale_resources.discard(resource)
+        return self.changes.record(resource, old_values, values)
+
+    def _set_saved(self, resource, values) -> None:
+        with self._saved_locks[resource]:
+            delta = self._store_saved(resource, values)
+        self.changes.publish(delta)
+
+    def _get_write_version(self, resource) -> int:
+        return self._write_versions[resource]
+
+    def _begin_write(self, resource) -> None:
+        with self._saved_locks[resource]:
+            self._write_versions[resource] += 1
+
+    def _set_read(self, resource, values, version) -> None:
+        """Keep values read by a request started at the write version, unless a save was sent since."""
+        delta = None
+        with self._saved_locks[resource]:
+            if self._write_versions[resource] == version:
+                delta = self._store_saved(resource, values)
+        self.changes.publish(delta)
+
+    def _keep_read(self, resource, values, version: Optional[int] = None) -> None:
+        """Check the values read from the server and keep them as the last values of resource.
 
-    def _get_session(self, force_reconnect=False) -> HydrocaptClientSession:
-        if self.session is None or force_reconnect is True:
-            self.session = HydrocaptClientSession(self.username, self.password, self.pool_internal_id)
-
-        return self.session
-
-    def _get_pool_internal_id(self):
-        if self.pool_internal_id < 0:
-            session = self._get_session()
-            self.pool_internal_id = session.get_internal_pool_id()
-        return self.pool_internal_id
-
-    def is_connection_ok(self):
-        pool_id = self._get_pool_internal_id()
-        return  pool_id >= 0
-
-    def _check_xml_not_authenticated(self, rTree):
-        r = rTree.xpath("/root/status")
-        if r is not None and len(r) > 0:
-            if "You are not authenticated" in r[0].text:
-                raise HydrocaptError
-            if "OK" in r[0].text:
-                pass
-            else:
-                raise HydrocaptError
-
-    def _get_pool_measure_latest(self) -> Dict[str, Any]:
-        """Retrieve most recents measures.
-
+        Args:
+            version: the write version when the read started, see _set_read, None to always keep them
+        """
+        if resource in _EMPTY_READ_ERRORS and (values is None or len(values) == 0):
+            raise HydrocaptError(_EMPTY_READ_ERRORS[resource])
+        if version is None:
+            self._set_saved(resource, values)
+        else:
+            self._set_read(resource, values, version)
+
+    def _get_history_end_time(self, deadline: Optional[float]) -> Optional[float]:
+        """time.monotonic() at which a history export must be done, the generators run outside of the call deadline."""
+        remaining = get_remaining()
+        if deadline is not None and (remaining is None or deadline < remaining):
+            remaining = deadline
+        return time.monotonic() + remaining if remaining is not None else None
+
+    @staticmethod
+    def _get_time_left(end_time: Optional[float]) -> Optional[float]:
+        return end_time - time.monotonic() if end_time is not None else None
+
+    def _get_cached(self, resource, max_age: Optional[float] = None, force_refresh: bool = False) -> Optional[Dict[str, Any]]:
+        """Return a copy of the last values of resource if they are recent enough, None otherwise."""
+
+        if force_refresh is True:
+            return None
+
+        if max_age is None:
+            max_age = self.cache_ttl.get(resource, 0)
+
+        with self._saved_locks[resource]:
+            saved_time = self._saved_times.get(resource)
+            if max_age <= 0 or saved_time is None or time.monotonic() - saved_time > max_age:
+                return None
 
-        Raises:
-            HydrocaptError: when hydrocapt API returns an incorrect response
+            return copy.deepcopy(self._get_saved(resource))
+
+    def _get_stale(self, resource, error: HydrocaptCircuitOpenError) -> Dict[str, Any]:
+        """The last values of resource when the server can't be asked, raise error if there are none or serve_stale is off."""
+        with self._saved_locks[resource]:
+            if self.serve_stale is False or resource not in self._saved_times:
+                raise error
+            self._stale_resources.add(resource)
+            return copy.deepcopy(self._get_saved(resource))
+
+    @property
+    def stale_resources(self) -> FrozenSet[str]:
+        """The resources whose last returned values are old ones served while the circuit breaker is open."""
+        return frozenset(self._stale_resources)
+
+    def _update_saved_value(self, resource, key, value) -> None:
+        """Write through a value the server has accepted, or already had, into the last values."""
+        delta = None
+        with self._saved_locks[resource]:
+            saved = self._get_saved(resource)
+            if key in saved:
+                old_value = saved[key]
+                saved[key] = copy.deepcopy(value)
+                delta = self.changes.record(resource, {key: old_value}, {key: value})
+        self.changes.publish(delta)
+
+    def _get_confirmation(self, confirmation: Optional[HydrocaptConfirmation]) -> HydrocaptConfirmation:
+        if confirmation is None:
+            return self.confirmation
+        return confirmation
+
+    def _skip_confirmation(self, resource) -> None:
+        """Fire and forget save: nothing is read back, the next read of resource goes to the server."""
+        self.invalidate_cache(resource)
+        self.last_confirmation = HydrocaptConfirmationResult(False, 0, 0.0)
+
+    def _begin_save(self, resource, values, pool_id) -> Tuple[str, Dict[str, Any], Dict[str, str]]:
+        """Build the save request of commands or consigns given by external name, it is to be sent right after.
 
         Returns:
-            A dict whose keys are :
-                water_temperature: A float representing the temperature of the pool.
-                technical_room_temperature: A float representing the temperature of the pool technical room.
-                ph: A float representing the ph of the pool.
-                conductivity: A float representing the conductivity of the pool.
-                redox: A float representing the oxydo reduction level of the pool.
-                date_time: The date time when the measure was taken.
-                ph_status : Alert status for PH value in : TooLow, OK, TooHigh
-                conductivity_status : Alert status for conductivity value in : TooLow, OK, TooHigh
-                redox_status : Alert status for redox in : TooLow, OK, TooHigh
+            the url, data and headers of the request
         """
-        pool_id = self._get_pool_internal_id()
-        if pool_id < 0:
-            raise HydrocaptError("can't get pool id in measure")
-
-        today = datetime.today().strftime('%Y-%m-%d')
-        get_pool_data_url = f"{HYDROCAPT_AJAX_VALUES_HISTORY}?serial={pool_id}&date={today}&type_date=day"
-
-        pool_data = self._get_session().get(get_pool_data_url)
-        a = pool_data.json()
-        records = a.get("records", [])
-
-
-        if a.get("error") is not None or a.get("errors") is not None or len(records) == 0:
-            pool_data = self._get_session(force_reconnect=True).get(get_pool_data_url)
-            a = pool_data.json()
+        if pool_id is None or pool_id < 0:
+            raise HydrocaptError("Can't get pool id")
 
-        #a = json.loads(pool_data.content)
-        records = a.get("records", [])
+        if resource == HYDROCAPT_RESOURCE_COMMANDS:
+            url = HYDROCAPT_SAVE_POOL_COMMAND_URL
+            data = self._get_hydrocapt_internal_command_states_from_external(values)
+        else:
+            url = HYDROCAPT_SAVE_POOL_CONSIGN_URL
+            data = self._get_hydrocapt_internal_consigns_from_external(values)
+        data["serial"] = pool_id
 
+        # the reads already running may return the values from before the save
+        self._begin_write(resource)
+        return url, data, dict(referer=HYDROCAPT_POOL_LIST_OWN_URL)
 
-        if len(records) == 0:
-            raise HydrocaptError("No data records from pool")
+    def _get_save_confirmation(self, resource, values, content, confirmation: Optional[HydrocaptConfirmation]) -> Optional[HydrocaptConfirmation]:
+        """Handle the answer of a save request.
 
-        vals = {"WATER_TEMP":"water_temperature", "AIR_TEMP":"technical_room_temperature", "PH":"ph", "CONDUCTIVITY":"conductivity", "ORP":"redox"} #redox is ORP
+        Returns:
+            the confirmation to wait for, None when there is nothing to wait for
+        """
+        if self._check_xml_save_status(content) is False:
+            #nothing to confirm, the pool already had these values
+            self.last_confirmation = HydrocaptConfirmationResult(True, 0, 0.0)
+            for key, value in values.items():
+                self._update_saved_value(resource, key, value)
+            return None
+
+        confirmation = self._get_confirmation(confirmation)
+        if confirmation.enabled is False:
+            # fire and forget, the values are neither cached nor published until they are read back
+            self._skip_confirmation(resource)
+            return None
+
+        return confirmation
+
+    def _iter_confirmation(self, resource, values, confirmation: HydrocaptConfirmation) -> Generator[float, Dict[str, Any], None]:
+        """The steps of a save confirmation, the clients only do the waits and the reads.
+
+        Yields the delay to wait before each read back of resource and is sent the values read,
+        until they include all the saved values.
+        """
+        start = time.monotonic()
+        attempts = 0
+        for delay in confirmation.iter_delays(start):
+            remaining = get_remaining()
+            if remaining is not None and delay >= remaining:
+                # the call deadline comes before the confirmation one
+                self._set_confirmation_result(False, attempts, time.monotonic() - start)
+                raise HydrocaptDeadlineExceeded("Deadline exceeded before the change was confirmed by the pool")
+            current = yield delay
+            attempts += 1
+            if all(current.get(k) == v for k, v in values.items()):
+                self._set_confirmation_result(True, attempts, time.monotonic() - start)
+                self._set_saved(resource, current)
+                return
+
+        self._set_confirmation_result(False, attempts, time.monotonic() - start)
+        raise HydrocaptError("Change not confirmed by the pool")
+
+    def _get_changed(self, values, prev_values) -> Dict[str, Any]:
+        """The values differing from the current ones, when there are none the change is already confirmed."""
+        changed = {k: v for k, v in values.items() if prev_values.get(k) != v}
+        if len(changed) == 0:
+            self.last_confirmation = HydrocaptConfirmationResult(True, 0, 0.0)
+        return changed
+
+    def _get_changed_timer(self, consign, prev_timer, hours) -> Optional[List[bool]]:
+        """The timer with the hours changed, None when it already has these values."""
+        if prev_timer is None:
+            raise HydrocaptError(f"Cannot get timer {consign}")
+
+        timer = list(prev_timer)
+        for hour_idx, value in hours.items():
+            timer[hour_idx] = bool(value)
+
+        if timer == prev_timer:
+            self.last_confirmation = HydrocaptConfirmationResult(True, 0, 0.0)
+            return None
+        return timer
+
+    def invalidate_cache(self, resource: Optional[str] = None) -> None:
+        """Make the next read of resource, or of all resources if None, go to the server."""
+        if resource is None:
+            self._saved_times.clear()
+        else:
+            self._saved_times.pop(resource, None)
+
+    def _record_coalesced(self, resource) -> None:
+        if self.metrics is not None:
+            self.metrics.record_coalesced(resource)
+
+    def _timed_parse(self, kind, func, *args):
+        if self.metrics is None:
+            return func(*args)
+        start = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            self.metrics.record_parse(kind, time.perf_counter() - start)
 
-        bad_vals = {"--.-", "--", "-.-", "---" }
+    def _set_confirmation_result(self, confirmed, attempts, elapsed) -> None:
+        self.last_confirmation = HydrocaptConfirmationResult(confirmed, attempts, elapsed)
+        if self.metrics is not None:
+            self.metrics.record_confirmation(confirmed, attempts, elapsed)
 
-        cur_data = {}
+    def _check_xml_not_authenticated(self, rTree):
+        check_status(rTree)
 
-        num_hours = 0 #in the records tab : the list of measure fpr pH, watertemps, etc are per hour ... so th elast one from midnoight to it is the time the measure has been performed
+    def _check_xml_save_status(self, content):
+        """Check the answer of a save request, given as the raw response content.
 
-        dates = [today]*25
+        Returns:
+            False if the server reported that nothing changed, True otherwise
+        """
+        return decode_save_status(content)
 
-        for r in records:
+    def _get_pool_measure_url(self, pool_id, day, type_date=HYDROCAPT_TYPE_DATE_DAY):
+        return f"{HYDROCAPT_AJAX_VALUES_HISTORY}?serial={pool_id}&date={day}&type_date={type_date}"
 
-            cur_c = r.get("typeInfo", "NOT A VALUE")
-            if cur_c in vals:
-                r_vals = r.get("values", ["--"]*25)
-                do_count_hours = False
-                if cur_c == "PH":
-                    do_count_hours = True
+    def _parse_history(self, content, request: HydrocaptHistoryRequest, resolution) -> List[HydrocaptHistoryRecord]:
+        if resolution == HYDROCAPT_RESOLUTION_HOUR:
+            return self._timed_parse(HYDROCAPT_RESOURCE_HISTORY, parse_history_day, content, request.start)
+        return self._timed_parse(HYDROCAPT_RESOURCE_HISTORY, parse_history_period, content, request)
 
-                cd = -1
-                for i in range(len(r_vals)-1, -1 , -1):
-                    if r_vals[i] in bad_vals:
-                        continue
+    def _get_history_clipper(self, start: date, end: date) -> Callable[[List[HydrocaptHistoryRecord]], List[HydrocaptHistoryRecord]]:
+        """A function keeping, of the records of each period in order, those from start to end not kept yet.
 
-                    if do_count_hours:
-                        num_hours = i
+        The weeks and months may cover other days, and overlap when a week is across two months.
+        """
+        first = datetime(start.year, start.month, start.day)
+        stop = datetime(end.year, end.month, end.day) + timedelta(days=1)
+        last = [first - timedelta(hours=1)]
 
-                    cd = r_vals[i]
-                    break
+        def clip(records):
+            records = [r for r in records if first <= r.date_time < stop and r.date_time > last[0]]
+            if len(records) > 0:
+                last[0] = records[-1].date_time
+            return records
 
-                cur_data[vals[cur_c]] = float(cd)
-            elif cur_c == "DATE":
-                dates = r.get("values", [today]*25)
+        return clip
 
+    def _get_history_from_cache(self, pool_id, day, type_date) -> Optional[Dict[str, Any]]:
+        if self.history_cache is None:
+            return None
+        return self.history_cache.get(pool_id, day, type_date)
 
-        #ok num_hours is the index of the measure in the hour based values array
-        measure_date = dates[num_hours]
-        measure_date = parse(measure_date) + timedelta(hours=num_hours)
-        cur_data["date_time"] = measure_date
+    def _put_history_in_cache(self, pool_id, day, type_date, content) -> None:
+        if self.history_cache is not None and content.get("error") is None and content.get("errors") is None:
+            self.history_cache.put(pool_id, day, content, type_date=type_date)
 
-        #now time to get the limits!
+    def _check_measures_content(self, content) -> None:
+        if content.get("errors") is not None:
+            raise HydrocaptError(f"Cannot get pool measures: {content.get('errors')}")
 
+    def _get_alarms_request(self, pool_id):
         get_alarms_data = {"serial":pool_id}
+        headers = dict(referer=f"{HYDROCAPT_AJAX_POOL_HISTORIC}?serial={pool_id}")
+        return get_alarms_data, headers
 
-        result_get_alarms = self._get_session().post(
-            HYDROCAPT_GET_ALARMS_URL,
-            data=get_alarms_data,
-            headers=dict(referer=f"{HYDROCAPT_AJAX_POOL_HISTORIC}?serial={pool_id}")
-        )
-
-        result_get_alarms.raise_for_status()
-
-        tree_alarms = etree.fromstring(result_get_alarms.text)
-
-        self._check_xml_not_authenticated(tree_alarms)
+    def _parse_pool_measure_day(self, a, day) -> HydrocaptDaySeries:
+        """Decode the getJsonValues answer into the hourly series and latest valid measures, without alarm status."""
+        return self._timed_parse(HYDROCAPT_RESOURCE_MEASURES, parse_day_series, a, to_date(day))
 
+    def _parse_pool_measure(self, a, today) -> Dict[str, Any]:
+        """Decode the getJsonValues answer into the latest valid measures, without alarm status."""
+        return self._parse_pool_measure_day(a, today).latest
 
-        alarms = {}
-        for alrm in tree_alarms.iter(tag="alarm"):
-            alarm = {}
-            do_stop = False
-            for c in alrm:
-                if c.tag == "max" or c.tag == "min":
-                    try:
-                        alarm[c.tag] = float(c.text)
-                    except:
-                        do_stop = True
-                        break
-                elif c.tag == "enable":
-                    try:
-                        alarm[c.tag] = bool(c.text)
-                    except:
-                        do_stop = True
-                        break
+    def _set_measures_series(self, series: HydrocaptDaySeries, measures: Dict[str, Any]) -> None:
+        self._measures_series = series._replace(latest=dict(measures))
 
+    def _get_measures_series(self, day: date) -> Optional[HydrocaptDaySeries]:
+        """A copy of the series of the last measures read, None if they are not for day."""
+        series = self._measures_series
+        if series is None or series.day != day:
+            return None
+        return copy.deepcopy(series)
 
-            if do_stop is False:
-                name = alrm.attrib.get("name")
-                if name is not None:
-                    alarms[name] = alarm
+    def _parse_alarms(self, content) -> Dict[str, Any]:
+        return self._timed_parse(HYDROCAPT_RESOURCE_ALARMS, decode_alarms, content)
 
+    def _apply_alarms_status(self, cur_data, alarms):
 
         #now check the alarms:
 
@@ -226,28 +477,6 @@ class HydrocaptClient(object):
 
         return cur_data
 
-
-    def get_pool_measure_latest(self) -> Dict[str, Any]:
-
-        try:
-            read_data = self._get_pool_measure_latest()
-        except:
-            read_data = {}
-
-        if read_data is None or len(read_data) == 0:
-            self._get_session(force_reconnect=True)
-            read_data = self._get_pool_measure_latest()
-
-        if read_data is None or len(read_data) == 0:
-            raise HydrocaptError("Cannot get pool measures")
-
-        self._saved_read_values = read_data
-
-        return read_data
-
-
-
-
     def _get_hydrocapt_internal_command_states_from_external(self, external_commands):
 
         internal_commands = {}
@@ -261,6 +490,11 @@ class HydrocaptClient(object):
 
         return internal_commands
 
+    def _check_known_commands(self, external_commands):
+        for k_ext in external_commands:
+            if k_ext not in HYDROCAPT_EXTERNAL_TO_INTERNAL_COMMANDS:
+                raise HydrocaptError(f"Unknown command {k_ext}")
+
     def _get_hydrocapt_external_command_states_from_internal(self, internal_commands):
 
         external_commands = {}
@@ -273,353 +507,685 @@ class HydrocaptClient(object):
 
         return external_commands
 
+    def _parse_commands_current_states(self, content) -> Dict[str, Any]:
+        return self._get_hydrocapt_external_command_states_from_internal(
+            self._timed_parse(HYDROCAPT_RESOURCE_COMMANDS, decode_commands, content))
 
+    def _get_hydrocapt_internal_consigns_from_external(self, external_consigns):
 
-    def _get_commands_current_states(self) -> Dict[str, Any]:
-
-        pool_id = self._get_pool_internal_id()
+        internal_consigns = {}
 
-        get_pool_command_url = f"{HYDROCAPT_GET_POOL_COMMAND_URL}?serial={pool_id}"
+        for k_ext, v_ext in external_consigns.items():
+            k_int_trad = HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS.get(k_ext)
+            if k_int_trad is not None:
 
-        commands_state = self._get_session().get(get_pool_command_url)
+                if k_int_trad[1] == HYDROCAPT_TIMER:
 
-        tree_cmd_state = etree.fromstring(commands_state.text)
+                    if v_ext is None or len(v_ext) != 24:
+                        continue
 
-        self._check_xml_not_authenticated(tree_cmd_state)
+                    val_int = HydrocaptTimer.from_hours(v_ext).to_internal()
+                elif k_int_trad[1] == "integer":
+                    val_int = int(v_ext)
+                elif k_int_trad[1] == "float":
+                    val_int = float(v_ext)
+                else:
+                    val_int = v_ext
 
-        internal_states = {}
+                internal_consigns[k_int_trad[0]] = val_int
 
-        for state in HYDROCAPT_INTERNAL_TO_EXTERNAL_COMMANDS:
-            try:
-                r = tree_cmd_state.xpath(f"/root/datas/{state}")
-                state_val = int(r[0].text)
-                internal_states[state] = state_val
-            except:
-                pass
+        return internal_consigns
 
-        return self._get_hydrocapt_external_command_states_from_internal(internal_states)
 
-    def get_commands_current_states(self) -> Dict[str, Any]:
+    def _normalize_consigns(self, external_consigns) -> Dict[str, Any]:
+        """Check and convert consigns given by external or internal name to their external name and type."""
 
-        try:
-            states = self._get_commands_current_states()
-        except:
-            states = {}
+        consigns = {}
 
-        if len(states) == 0:
-            self._get_session(force_reconnect=True)
-            states = self._get_commands_current_states()
+        for k, v in external_consigns.items():
+            if k not in HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS:
+                k_ext_trad = HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS.get(k)
+                if k_ext_trad is None:
+                    raise HydrocaptError(f"Unknown consign {k}")
+                k = k_ext_trad[0]
 
-        if len(states) == 0:
-            raise HydrocaptError("Cannot get commands state")
+            kind = HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS[k][1]
+            if kind == HYDROCAPT_TIMER:
+                if v is None or len(v) != 24:
+                    raise HydrocaptError(f"{k} needs 24 values")
+                if isinstance(v, str):
+                    # the server format, "0" or "1" for each hour
+                    if v.strip("01") != "":
+                        raise HydrocaptError(f"{k} needs 24 values of 0 or 1")
+                    v = HydrocaptTimer.from_internal(v).to_hours()
+                else:
+                    v = [bool(h) for h in v]
+            elif kind == "integer":
+                v = int(v)
+            elif kind == "float":
+                v = float(v)
 
-        self._saved_states = states
+            consigns[k] = v
 
-        return states
+        return consigns
 
+    def _check_timer_hours(self, consign, hours) -> str:
+        """Check a timer hours change and return the external name of the timer."""
 
-    def _set_command_state(self, command, state):
+        if consign not in HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS:
+            consign = HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS.get(consign, [consign])[0]
 
-        pool_id = self._get_pool_internal_id()
-        if pool_id is None or pool_id < 0:
-            raise HydrocaptError("Can't get pool id")
+        if HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS.get(consign, [consign, "integer"])[1] != HYDROCAPT_TIMER:
+            raise HydrocaptError(f"{consign} is not a timer")
 
-        external_commands = {command:state}
-        save_internal_commands = self._get_hydrocapt_internal_command_states_from_external(external_commands)
-        save_internal_commands["serial"] = pool_id
-        #save_internal_commands["type_aux1"] = 0
+        for hour_idx in hours:
+            if hour_idx < 0 or hour_idx >= 24:
+                raise HydrocaptError(f"Invalid hour {hour_idx}")
 
-        result_save = self._get_session().post(
-            HYDROCAPT_SAVE_POOL_COMMAND_URL,
-            data=save_internal_commands,
-            headers=dict(referer=HYDROCAPT_POOL_LIST_OWN_URL)
-        )
+        return consign
 
-        result_save.raise_for_status()
+    def _get_timer_range_hours(self, start_hour, end_hour, value) -> Dict[int, bool]:
+        if end_hour < start_hour:
+            end_hour += 24
+        return {h % 24: value for h in range(start_hour, end_hour)}
 
-        tree_save_state = etree.fromstring(result_save.text)
-        r = tree_save_state.xpath(f"/root/status")
-        if r is not None:
-            if "Pas de modification" in r[0].text:
-                #ok no modification
-                return None
-            elif "You are not authenticated" in r[0].text:
-                raise HydrocaptError
+    def _get_hydrocapt_external_consign_from_internal(self, internal_consigns):
 
+        external_consigns = {}
 
-        # wait for change to happen
-        saved_states = {}
-        for i in range(5):
-            cur_states = self.get_commands_current_states()
-            if cur_states.get(command) == state:
-                return cur_states
-            time.sleep(2)
+        for k_int, v_int in internal_consigns.items():
+            k_ext_trad = HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS.get(k_int)
+            if k_ext_trad is not None:
+                if k_ext_trad[1] == HYDROCAPT_TIMER:
 
-        raise HydrocaptError
+                    if v_int is None or len(v_int) != 24:
+                        continue
 
+                    val_ext = HydrocaptTimer.from_internal(v_int).to_hours()
+                elif k_ext_trad[1] == "integer":
+                    val_ext = int(v_int)
+                elif k_ext_trad[1] == "float":
+                    val_ext = float(v_int)
+                else:
+                    val_ext = v_int
 
-    def set_command_state(self, command, state, get_prev=False):
+                external_consigns[k_ext_trad[0]] = val_ext
 
-        prev_state = None
+        return external_consigns
 
-        if get_prev is True:
-            curr_states = self.get_commands_current_states()
-            prev_state = curr_states.get(command)
+    def _parse_current_consigns(self, content) -> Dict[str, Any]:
+        return self._get_hydrocapt_external_consign_from_internal(
+            self._timed_parse(HYDROCAPT_RESOURCE_CONSIGNS, decode_consigns, content))
 
-        try:
-            saved_states = self._set_command_state(command, state)
-            if saved_states is None:
-                #No change
-                return prev_state
-        except:
-            saved_states = {}
+    def get_commands_and_options(self):
+        return HYDROCAPT_EXTERNAL_COMMANDS
 
-        if len(saved_states) == 0:
-            self._get_session(force_reconnect=True)
-            saved_states = self._set_command_state(command, state)
-            if saved_states is None:
-                #No change
-                return prev_state
 
-        if len(saved_states) == 0:
-            raise HydrocaptError("Cannot save command state")
+    def get_timers(self):
+        return HYDROCAPT_TIMERS
 
-        self._saved_states = saved_states
+    def get_packaged_data(self):
 
-        return prev_state
+        res = {}
 
+        for k,v in self._saved_states.items():
+            res[k] = v
 
+        for k,v in self._saved_read_values.items():
+            res[k] = v
 
-    def get_commands_and_options(self):
-        return HYDROCAPT_EXTERNAL_COMMANDS
+        for k,v in self._saved_consigns.items():
+            res[k] = v
 
+        return res
 
-    def get_timers(self):
-        return HYDROCAPT_TIMERS
-    def _get_hydrocapt_internal_consigns_from_external(self, external_consigns):
+    def get_snapshot(self) -> PoolSnapshot:
+        """The last read values as a typed PoolSnapshot, see get_packaged_data."""
+        return PoolSnapshot.from_dict(self.get_packaged_data())
 
-        internal_consigns = {}
 
-        for k_ext, v_ext in external_consigns.items():
-            k_int_trad = HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS.get(k_ext)
-            if k_int_trad is not None:
+class HydrocaptClient(HydrocaptClientBase):
+    """Proxy to the Hydrocapt REST API."""
 
-                if k_int_trad[1] == HYDROCAPT_TIMER:
+    def __init__(self, username: str, password: str, pool_internal_id: Optional[int] = -1, parallel: bool = False, session: Optional[HydrocaptClientSession] = None,
+                 session_store: Optional[HydrocaptSessionStore] = None, cache_ttl: Optional[Dict[str, float]] = None,
+                 history_cache: Optional[HydrocaptHistoryCache] = None, confirmation: Optional[HydrocaptConfirmation] = None,
+                 base_url: Optional[str] = None, metrics: Optional[HydrocaptMetrics] = None,
+                 retry_policy: Optional[HydrocaptRetryPolicy] = None, rate_limiter: Optional[HydrocaptRateLimiter] = None,
+                 circuit_breaker: Optional[HydrocaptCircuitBreaker] = None, serve_stale: bool = False,
+                 http_settings: Optional[HydrocaptHttpSettings] = None) -> None:
+        """Initialize the API and authenticate so we can make requests.
 
-                    if v_ext is None or len(v_ext) != 24:
-                        continue
+        Args:
+            username: string containing your Hydrocapt's app username
+            password: string containing your Hydrocapt's app password
+            pool_internal_id: the pool serial if already known, -1 to discover it at login
+            parallel: if True fetch_all_data runs its independent reads on a shared thread pool
+            session: an optional session of the same account, shared with other clients
+            session_store: an optional store to reuse the session of a previous process, see HydrocaptSessionStore
+            cache_ttl: per resource time in seconds a read can be answered from the last values
+            history_cache: an optional cache of the history days, see HydrocaptHistoryCache
+            confirmation: how the saves wait for the pool to apply them, see HydrocaptConfirmation
+            base_url: an optional server to use instead of www.hydrocapt.fr, e.g. a local HydrocaptFakeServer,
+                ignored when a session is given
+            metrics: an optional HydrocaptMetrics, also given to the session created by the client
+            retry_policy: caps and backoff of the retries of the session created by the client, see HydrocaptRetryPolicy
+            rate_limiter: an optional HydrocaptRateLimiter for the session created by the client
+            circuit_breaker: an optional HydrocaptCircuitBreaker for the session created by the client
+            serve_stale: return the last read values while the circuit breaker is open, see stale_resources
+            http_settings: timeout, connection pool, keep alive and compression of the session created by the client
+        """
+        super().__init__(username, password, pool_internal_id, cache_ttl, history_cache, confirmation, metrics, serve_stale)
+        self.session: Optional[HydrocaptClientSession] = session
+        self.base_url = base_url
+        self.retry_policy = retry_policy
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.http_settings = http_settings
+        self.parallel = parallel
+        self.session_store = session_store
+        self._session_lock = threading.Lock()
+        # concurrent reads of the same resource share one request
+        self._flights = HydrocaptSingleFlight(self._record_coalesced)
+
+    def _get_session(self, force_reconnect=False, failed_generation=None) -> HydrocaptClientSession:
+        with self._session_lock:
+            if self.session is None:
+                self.session = HydrocaptClientSession(self.username, self.password, self.pool_internal_id, session_store=self.session_store,
+                                                      base_url=self.base_url, metrics=self.metrics, retry_policy=self.retry_policy,
+                                                      rate_limiter=self.rate_limiter, circuit_breaker=self.circuit_breaker,
+                                                      http_settings=self.http_settings)
+                return self.session
+
+        if force_reconnect is True:
+            self.session.reconnect(failed_generation)
 
-                    val_int = ""
-                    for v in v_ext:
-                        if v:
-                            val_int += "1"
-                        else:
-                            val_int += "0"
-                elif k_int_trad[1] == "integer":
-                    val_int = int(v_ext)
-                elif k_int_trad[1] == "float":
-                    val_int = float(v_ext)
-                else:
-                    val_int = v_ext
+        return self.session
 
-                internal_consigns[k_int_trad[0]] = val_int
+    def _get_pool_internal_id(self):
+        if self.pool_internal_id < 0:
+            session = self._get_session()
+            self.pool_internal_id = session.get_internal_pool_id()
+        return self.pool_internal_id
 
-        return internal_consigns
+    @with_deadline
+    def is_connection_ok(self):
+        pool_id = self._get_pool_internal_id()
+        return  pool_id >= 0
 
+    def _get_pool_measure_latest(self) -> Dict[str, Any]:
+        """Retrieve most recents measures.
 
-    def _get_hydrocapt_external_consign_from_internal(self, internal_consigns):
 
-        external_consigns = {}
+        Raises:
+            HydrocaptError: when hydrocapt API returns an incorrect response
 
-        for k_int, v_int in internal_consigns.items():
-            k_ext_trad = HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS.get(k_int)
-            if k_ext_trad is not None:
-                if k_ext_trad[1] == HYDROCAPT_TIMER:
+        Returns:
+            A dict whose keys are :
+                water_temperature: A float representing the temperature of the pool.
+                technical_room_temperature: A float representing the temperature of the pool technical room.
+                ph: A float representing the ph of the pool.
+                conductivity: A float representing the conductivity of the pool.
+                redox: A float representing the oxydo reduction level of the pool.
+                date_time: The date time when the measure was taken.
+                ph_status : Alert status for PH value in : TooLow, OK, TooHigh
+                conductivity_status : Alert status for conductivity value in : TooLow, OK, TooHigh
+                redox_status : Alert status for redox in : TooLow, OK, TooHigh
+        """
+        pool_id = self._get_pool_internal_id()
+        if pool_id < 0:
+            raise HydrocaptError("can't get pool id in measure")
 
-                    if v_int is None or len(v_int) != 24:
-                        continue
+        today = datetime.today().strftime('%Y-%m-%d')
+        get_pool_data_url = self._get_pool_measure_url(pool_id, today)
 
-                    val_ext = []
-                    for v in v_int:
-                        if v == "0":
-                            val_ext.append(False)
-                        else:
-                            val_ext.append(True)
-                elif k_ext_trad[1] == "integer":
-                    val_ext = int(v_int)
-                elif k_ext_trad[1] == "float":
-                    val_ext = float(v_int)
-                else:
-                    val_ext = v_int
+        a = self._get_session().get(get_pool_data_url).json()
+        self._check_measures_content(a)
 
-                external_consigns[k_ext_trad[0]] = val_ext
+        series = self._parse_pool_measure_day(a, today)
+        cur_data = dict(series.latest)
 
-        return external_consigns
+        #now time to get the limits, they rarely change so they come from their own cache
 
+        alarms = self.get_alarm_thresholds()
 
+        cur_data = self._apply_alarms_status(cur_data, alarms)
+        self._set_measures_series(series, cur_data)
+        return cur_data
 
-    def _set_consign(self, consign, value):
+    def _get_alarm_thresholds(self) -> Dict[str, Any]:
 
         pool_id = self._get_pool_internal_id()
-        if pool_id is None or pool_id < 0:
-            raise HydrocaptError("Can't get pool id")
 
-        external_consigns = {consign:value}
-        save_internal_consigns = self._get_hydrocapt_internal_consigns_from_external(external_consigns)
-        save_internal_consigns["serial"] = pool_id
-        #save_internal_commands["type_aux1"] = 0
+        get_alarms_data, headers = self._get_alarms_request(pool_id)
 
-        result_save = self._get_session().post(
-            HYDROCAPT_SAVE_POOL_CONSIGN_URL,
-            data=save_internal_consigns,
-            headers=dict(referer=HYDROCAPT_POOL_LIST_OWN_URL)
+        result_get_alarms = self._get_session().post(
+            HYDROCAPT_GET_ALARMS_URL,
+            data=get_alarms_data,
+            headers=headers
         )
 
-        result_save.raise_for_status()
+        result_get_alarms.raise_for_status()
 
-        tree_save_state = etree.fromstring(result_save.text)
-        r = tree_save_state.xpath(f"/root/status")
-        if r is not None:
-            if "Pas de modification" in r[0].text:
-                #ok no modification
-                return None
-            elif "You are not authenticated" in r[0].text:
-                raise HydrocaptError
+        return self._parse_alarms(result_get_alarms.content)
 
+    @with_deadline
+    def get_alarm_thresholds(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
+        """Get the alarms limits used to compute the measures status.
 
-        # wait for change to happen
-        saved_states = {}
-        for i in range(5):
-            cur_consigns = self.get_current_consigns()
-            if cur_consigns.get(consign) == value:
-                return cur_consigns
-            time.sleep(2)
+        Args:
+            max_age: max age in seconds of the cached limits to return, defaults to the client cache_ttl
+            force_refresh: always ask the server
 
-        raise HydrocaptError
+        Returns:
+            A dict whose keys are the alarm names (PH, ORP, CONDUCTIVITY, ...) and values dicts with min, max and enable
+        """
 
+        cached = self._get_cached(HYDROCAPT_RESOURCE_ALARMS, max_age, force_refresh)
+        if cached is not None:
+            return cached
 
-    def set_consign(self, consign, value, get_prev=False):
+        def read():
+            alarms = self._get_alarm_thresholds()
+            self._keep_read(HYDROCAPT_RESOURCE_ALARMS, alarms)
+            return alarms
 
-        prev_value = None
+        try:
+            alarms = self._flights.do(HYDROCAPT_RESOURCE_ALARMS, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_ALARMS, e)
 
-        if get_prev is True:
-            cur_consigns = self.get_current_consigns()
-            prev_value = cur_consigns.get(consign)
+        return copy.deepcopy(alarms)
+
+    @with_deadline
+    def refresh_alarm_thresholds(self) -> Dict[str, Any]:
+        """Read the alarms limits from the server, to be called after they were changed."""
+        return self.get_alarm_thresholds(force_refresh=True)
+
+
+    @with_deadline
+    def get_pool_measure_latest(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
+        """Get the latest measures, see _get_pool_measure_latest.
+
+        Args:
+            max_age: max age in seconds of the cached values to return, defaults to the client cache_ttl
+            force_refresh: always ask the server
+        """
+
+        cached = self._get_cached(HYDROCAPT_RESOURCE_MEASURES, max_age, force_refresh)
+        if cached is not None:
+            return cached
+
+        def read():
+            read_data = self._get_pool_measure_latest()
+            self._keep_read(HYDROCAPT_RESOURCE_MEASURES, read_data)
+            return read_data
 
         try:
-            saved_states = self._set_consign(consign, value)
-            if saved_states is None:
-                #No change
-                return prev_value
-        except:
-            saved_states = {}
+            read_data = self._flights.do(HYDROCAPT_RESOURCE_MEASURES, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_MEASURES, e)
 
-        if len(saved_states) == 0:
-            self._get_session(force_reconnect=True)
-            saved_states = self._set_consign(consign, value)
-            if saved_states is None:
-                #No change
-                return prev_value
+        return copy.deepcopy(read_data)
 
 
-        if len(saved_states) == 0:
-            raise HydrocaptError("Cannot save consign")
+    @with_deadline
+    def get_pool_measure_day(self, day=None, max_age: Optional[float] = None, force_refresh: bool = False) -> HydrocaptDaySeries:
+        """Get the hourly measures of a day as series aligned on their times, with the latest valid measures.
 
-        self._saved_consigns = saved_states
+        The current day comes from the request, and cache, of get_pool_measure_latest, so both can be
+        read for the price of one. The other days come from the history_cache when set.
 
-        return prev_value
+        Args:
+            day: the day (date, datetime or ISO string), defaults to today
+            max_age: max age in seconds of the cached measures of today, defaults to the client cache_ttl
+            force_refresh: always ask the server
+        """
+        day = to_date(day) if day is not None else date.today()
+        if day != date.today():
+            a = self._get_history_content(day)
+            self._check_measures_content(a)
+            return self._parse_pool_measure_day(a, day)
+
+        self.get_pool_measure_latest(max_age, force_refresh)
+        series = self._get_measures_series(day)
+        if series is None:
+            # cached measures of the day before, or served stale without a series
+            self.get_pool_measure_latest(force_refresh=True)
+            series = self._get_measures_series(day)
+            if series is None:
+                raise HydrocaptError("Cannot get pool measures")
+        return series
+
+    def _get_history_content(self, day, type_date=HYDROCAPT_TYPE_DATE_DAY) -> Dict[str, Any]:
 
-    def set_consign_timer_hour(self, consign, hour_idx, value):
+        pool_id = self._get_pool_internal_id()
 
-        if HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS.get(consign,[consign, "integer"])[1] != HYDROCAPT_TIMER:
-            return
+        a = self._get_history_from_cache(pool_id, day, type_date)
+        if a is not None:
+            return a
 
-        if hour_idx < 0 or hour_idx >= 24:
-            return
+        get_pool_data_url = self._get_pool_measure_url(pool_id, day.strftime('%Y-%m-%d'), type_date)
 
-        cur_timer = self._saved_consigns.get(consign)
+        a = self._get_session().get(get_pool_data_url).json()
 
-        if cur_timer is None:
-            self.get_current_consigns()
+        self._put_history_in_cache(pool_id, day, type_date, a)
 
-        cur_timer = self._saved_consigns.get(consign)
+        return a
 
-        if cur_timer is None:
-            return
+    @with_deadline
+    def _get_history_period(self, request: HydrocaptHistoryRequest, resolution) -> List[HydrocaptHistoryRecord]:
+        return self._parse_history(self._get_history_content(request.start, request.type_date), request, resolution)
 
-        cur_timer[hour_idx] = value
+    def iter_history(self, start, end, max_in_flight: int = HYDROCAPT_HISTORY_MAX_IN_FLIGHT,
+                     resolution: str = HYDROCAPT_RESOLUTION_HOUR, deadline: Optional[float] = None) -> Iterator[HydrocaptHistoryRecord]:
+        """Yield the hourly, or daily, measures between two days, in chronological order.
 
-        self.set_consign(consign, cur_timer)
+        The days are requested max_in_flight at a time and only their records are kept in
+        memory, so any range length can be exported. With a history_cache the finished days
+        already fetched are read from it. At a daily resolution whole months and weeks are
+        requested at once, see plan_history_requests, a year costs 12 requests instead of 365.
 
+        Args:
+            start: first day (date, datetime or ISO string)
+            end: last day, included
+            max_in_flight: max number of requests at the same time
+            resolution: "hour" for the hourly records, "day" for one record per day at midnight
+            deadline: max seconds for the whole export, defaults to the deadline of the enclosing call if any
+        """
 
-    def _get_current_consigns(self) -> Dict[str, Any]:
+        # log in first so the parallel requests below don't all try to
+        end_time = self._get_history_end_time(deadline)
+        with deadline_scope(self._get_time_left(end_time)):
+            self._get_pool_internal_id()
+
+        start = to_date(start)
+        end = to_date(end)
+        clip = self._get_history_clipper(start, end)
+        executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="hydrocapt-history")
+        pending = deque()
+        try:
+            for request in plan_history_requests(start, end, resolution):
+                pending.append(executor.submit(self._get_history_period, request, resolution, deadline=self._get_time_left(end_time)))
+                if len(pending) >= max_in_flight:
+                    yield from clip(pending.popleft().result())
+
+            while len(pending) > 0:
+                yield from clip(pending.popleft().result())
+        finally:
+            # the caller may stop iterating before the end
+            for future in pending:
+                future.cancel()
+            executor.shutdown(wait=False)
+
+    def _get_commands_current_states(self) -> Dict[str, Any]:
 
         pool_id = self._get_pool_internal_id()
 
-        get_pool_command_url = f"{HYDROCAPT_GET_POOL_CONSIGN_URL}?serial={pool_id}"
+        get_pool_command_url = f"{HYDROCAPT_GET_POOL_COMMAND_URL}?serial={pool_id}"
 
         commands_state = self._get_session().get(get_pool_command_url)
 
+        return self._parse_commands_current_states(commands_state.content)
 
-        tree_consign_state = etree.fromstring(commands_state.text)
-
-        self._check_xml_not_authenticated(tree_consign_state)
+    @with_deadline
+    def get_commands_current_states(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
 
-        internal_consigns = {}
+        cached = self._get_cached(HYDROCAPT_RESOURCE_COMMANDS, max_age, force_refresh)
+        if cached is not None:
+            return cached
 
+        def read():
+            version = self._get_write_version(HYDROCAPT_RESOURCE_COMMANDS)
+            states = self._get_commands_current_states()
+            self._keep_read(HYDROCAPT_RESOURCE_COMMANDS, states, version)
+            return states
 
+        try:
+            states = self._flights.do(HYDROCAPT_RESOURCE_COMMANDS, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_COMMANDS, e)
 
-        for state in HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS:
-            for path in [f"/root/datas/select/{state}", f"/root/datas/timer/{state}"]:
-                try:
-                    r = tree_consign_state.xpath(path)
-                    state_val = r[0].text
-                    internal_consigns[state] = state_val
-                except:
-                    pass
+        return copy.deepcopy(states)
 
 
-        return self._get_hydrocapt_external_consign_from_internal(internal_consigns)
+    def _wait_confirmation(self, resource, values, confirmation: HydrocaptConfirmation) -> None:
+        """Read resource back, following the confirmation delays, until it includes the saved values."""
 
-    def get_current_consigns(self) -> Dict[str, Any]:
+        if resource == HYDROCAPT_RESOURCE_COMMANDS:
+            read = self.get_commands_current_states
+        else:
+            read = self.get_current_consigns
 
+        steps = self._iter_confirmation(resource, values, confirmation)
         try:
-            states = self._get_current_consigns()
-        except:
-            states = {}
+            delay = next(steps)
+            while True:
+                time.sleep(delay)
+                delay = steps.send(read(force_refresh=True))
+        except StopIteration:
+            pass
 
-        if len(states) == 0:
-            self._get_session(force_reconnect=True)
-            states = self._get_current_consigns()
+    def _save(self, resource, values, confirmation: Optional[HydrocaptConfirmation] = None) -> None:
+        """Save commands or consigns in a single request and wait for the pool to apply them."""
 
-        if len(states) == 0:
-            raise HydrocaptError("Cannot get current consigns")
+        url, data, headers = self._begin_save(resource, values, self._get_pool_internal_id())
+        result_save = self._get_session().post(url, data=data, headers=headers)
 
-        self._saved_consigns = states
+        result_save.raise_for_status()
 
-        return states
+        confirmation = self._get_save_confirmation(resource, values, result_save.content, confirmation)
+        if confirmation is not None:
+            self._wait_confirmation(resource, values, confirmation)
 
+    @with_deadline
+    def set_command_state(self, command, state, get_prev=False, confirmation: Optional[HydrocaptConfirmation] = None):
+        """Change a command and wait for the pool to apply it.
 
-    def get_packaged_data(self):
+        Args:
+            command: the command name, see get_commands_and_options
+            state: the new state of the command
+            get_prev: read the current state first to return it
+            confirmation: overrides the client confirmation strategy for this call,
+                the outcome is available in last_confirmation
 
-        res = {}
+        Returns:
+            The previous state if get_prev is True, None otherwise
+        """
 
-        for k,v in self._saved_states.items():
-            res[k] = v
+        prev_state = None
 
-        for k,v in self._saved_read_values.items():
-            res[k] = v
+        if get_prev is True:
+            curr_states = self.get_commands_current_states()
+            prev_state = curr_states.get(command)
 
-        for k,v in self._saved_consigns.items():
-            res[k] = v
+        self._save(HYDROCAPT_RESOURCE_COMMANDS, {command:state}, confirmation)
 
-        return res
+        return prev_state
+
+    @with_deadline
+    def set_commands(self, commands: Dict[str, str], confirmation: Optional[HydrocaptConfirmation] = None) -> Dict[str, Any]:
+        """Change several commands with a single save request and a single confirmation.
+
+        The commands already in the requested state are not sent.
+
+        Args:
+            commands: the new state of each command to change, see get_commands_and_options
+            confirmation: overrides the client confirmation strategy for this call
+
+        Returns:
+            The previous state of every command of commands
+        """
+
+        self._check_known_commands(commands)
+
+        prev_states = self.get_commands_current_states(force_refresh=True)
+
+        changed = self._get_changed(commands, prev_states)
+        if len(changed) > 0:
+            self._save(HYDROCAPT_RESOURCE_COMMANDS, changed, confirmation)
+
+        return {k: prev_states.get(k) for k in commands}
+
+
+    @with_deadline
+    def set_consign(self, consign, value, get_prev=False, confirmation: Optional[HydrocaptConfirmation] = None):
+        """Change a consign and wait for the pool to apply it, see set_command_state."""
+
+        consigns = self._normalize_consigns({consign:value})
+
+        prev_value = None
+
+        if get_prev is True:
+            cur_consigns = self.get_current_consigns()
+            # by its external name, the one of the returned consigns
+            prev_value = cur_consigns.get(next(iter(consigns)))
+
+        self._save(HYDROCAPT_RESOURCE_CONSIGNS, consigns, confirmation)
+
+        return prev_value
+
+    @with_deadline
+    def set_consigns(self, consigns: Dict[str, Any], confirmation: Optional[HydrocaptConfirmation] = None) -> Dict[str, Any]:
+        """Change several consigns, whole timers included, with a single save request and a single confirmation.
+
+        The consigns already at the requested value are not sent.
+
+        Args:
+            consigns: the new value of each consign to change, by external or internal name
+                (setpoint_heating, Filtration Timer or timer_filtration, ...), timers as 24 booleans
+            confirmation: overrides the client confirmation strategy for this call
+
+        Returns:
+            The previous value of every consign of consigns
+        """
+
+        consigns = self._normalize_consigns(consigns)
+
+        prev_consigns = self.get_current_consigns(force_refresh=True)
 
+        changed = self._get_changed(consigns, prev_consigns)
+        if len(changed) > 0:
+            self._save(HYDROCAPT_RESOURCE_CONSIGNS, changed, confirmation)
+
+        return {k: prev_consigns.get(k) for k in consigns}
+
+    @with_deadline
+    def set_consign_timer_hours(self, consign, hours: Dict[int, bool], confirmation: Optional[HydrocaptConfirmation] = None):
+        """Change several hours of a timer with a single save, nothing is sent if they already have these values.
+
+        Args:
+            consign: the timer, see get_timers
+            hours: the new value of each hour to change, hours from 0 to 23
+
+        Returns:
+            The previous timer
+        """
+
+        consign = self._check_timer_hours(consign, hours)
+
+        prev_timer = self.get_current_consigns(force_refresh=True).get(consign)
+
+        timer = self._get_changed_timer(consign, prev_timer, hours)
+        if timer is not None:
+            self._save(HYDROCAPT_RESOURCE_CONSIGNS, {consign:timer}, confirmation)
+
+        return prev_timer
+
+    @with_deadline
+    def set_consign_timer_range(self, consign, start_hour: int, end_hour: int, value: bool, confirmation: Optional[HydrocaptConfirmation] = None):
+        """Set the hours from start_hour to end_hour (excluded) of a timer, wrapping after midnight if end_hour < start_hour.
+
+        Returns:
+            The previous timer
+        """
+        return self.set_consign_timer_hours(consign, self._get_timer_range_hours(start_hour, end_hour, value), confirmation)
+
+    @with_deadline
+    def set_consign_timer_hour(self, consign, hour_idx, value, confirmation: Optional[HydrocaptConfirmation] = None):
+        """Change one hour of a timer, see set_consign_timer_hours.
+
+        Raises:
+            HydrocaptError: when consign is not a timer or hour_idx is not from 0 to 23
+
+        Returns:
+            The previous timer
+        """
+        return self.set_consign_timer_hours(consign, {hour_idx:value}, confirmation)
+
+    def _get_current_consigns(self) -> Dict[str, Any]:
+
+        pool_id = self._get_pool_internal_id()
+
+        get_pool_command_url = f"{HYDROCAPT_GET_POOL_CONSIGN_URL}?serial={pool_id}"
+
+        commands_state = self._get_session().get(get_pool_command_url)
+
+        return self._parse_current_consigns(commands_state.content)
+
+    @with_deadline
+    def get_current_consigns(self, max_age: Optional[float] = None, force_refresh: bool = False) -> Dict[str, Any]:
+
+        cached = self._get_cached(HYDROCAPT_RESOURCE_CONSIGNS, max_age, force_refresh)
+        if cached is not None:
+            return cached
+
+        def read():
+            version = self._get_write_version(HYDROCAPT_RESOURCE_CONSIGNS)
+            states = self._get_current_consigns()
+            self._keep_read(HYDROCAPT_RESOURCE_CONSIGNS, states, version)
+            return states
+
+        try:
+            states = self._flights.do(HYDROCAPT_RESOURCE_CONSIGNS, read, join=not force_refresh)
+        except HydrocaptCircuitOpenError as e:
+            return self._get_stale(HYDROCAPT_RESOURCE_CONSIGNS, e)
+
+        return copy.deepcopy(states)
+
+
+    @with_deadline
+    def fetch_all_data(self, parallel: Optional[bool] = None, force_refresh: bool = False):
+        """Refresh commands, measures and consigns and return them packaged in one dict.
+
+        Args:
+            parallel: run the three reads at the same time on the shared thread pool,
+                defaults to the client parallel setting
+            force_refresh: ignore the cache_ttl and ask the server for everything
+        """
+        if parallel is None:
+            parallel = self.parallel
+
+        if parallel is False:
+            self.get_commands_current_states(force_refresh=force_refresh)
+            self.get_pool_measure_latest(force_refresh=force_refresh)
+            self.get_current_consigns(force_refresh=force_refresh)
+            return self.get_packaged_data()
+
+        # log in first so the parallel reads below don't all try to
+        self._get_pool_internal_id()
+
+        # the pool threads don't see the deadline of this call, give them what is left of it
+        deadline = get_remaining()
+        executor = _get_shared_executor()
+        futures = [
+            executor.submit(self.get_commands_current_states, force_refresh=force_refresh, deadline=deadline),
+            executor.submit(self.get_pool_measure_latest, force_refresh=force_refresh, deadline=deadline),
+            executor.submit(self.get_current_consigns, force_refresh=force_refresh, deadline=deadline),
+        ]
+        for future in futures:
+            future.result()
 
-    def fetch_all_data(self):
-        self.get_commands_current_states()
-        self.get_pool_measure_latest()
-        self.get_current_consigns()
         return self.get_packaged_data()
 
+    @with_deadline
+    def refresh_changes(self, parallel: Optional[bool] = None, force_refresh: bool = False) -> List[HydrocaptDelta]:
+        """Refresh like fetch_all_data but only return what changed, an empty list if nothing did.
+
+        See also changes.subscribe() to be called for the changes of some keys only.
+        """
+        version = self.changes.version
+        self.fetch_all_data(parallel=parallel, force_refresh=force_refresh)
+        return self.changes.since(version)
+
 
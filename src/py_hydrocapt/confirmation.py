@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""How the clients wait for the pool to apply a saved command or consign."""
+import time
+from typing import Iterator
+from typing import NamedTuple
+from typing import Optional
+
+from .const import HYDROCAPT_CONFIRMATION_FIRST_DELAY
+from .const import HYDROCAPT_CONFIRMATION_BACKOFF
+from .const import HYDROCAPT_CONFIRMATION_MAX_DELAY
+from .const import HYDROCAPT_CONFIRMATION_DEADLINE
+
+
+class HydrocaptConfirmationResult(NamedTuple):
+    """Outcome of the confirmation of a save."""
+
+    confirmed: bool
+    attempts: int
+    elapsed: float
+
+
+class HydrocaptConfirmation(object):
+    """Confirmation strategy: read the state back early, then back off exponentially until a deadline.
+
+    With enabled=False the saves are fire and forget: the request is sent and nothing is read back.
+    """
+
+    def __init__(self, enabled: bool = True, first_delay: float = HYDROCAPT_CONFIRMATION_FIRST_DELAY,
+                 backoff: float = HYDROCAPT_CONFIRMATION_BACKOFF, max_delay: float = HYDROCAPT_CONFIRMATION_MAX_DELAY,
+                 deadline: float = HYDROCAPT_CONFIRMATION_DEADLINE) -> None:
+        """Initialize the strategy.
+
+        Args:
+            enabled: read the state back after a save, False for fire and forget
+            first_delay: seconds to wait after the save before the first read
+            backoff: factor applied to the wait between two reads
+            max_delay: max seconds between two reads
+            deadline: max total seconds spent confirming before giving up
+        """
+        self.enabled = enabled
+        self.first_delay = first_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def iter_delays(self, start: Optional[float] = None) -> Iterator[float]:
+        """Yield the time to wait before each read, stops once the deadline is reached.
+
+        Args:
+            start: time.monotonic() of the save, defaults to now
+        """
+        if start is None:
+            start = time.monotonic()
+
+        delay = self.first_delay
+        while True:
+            remaining = self.deadline - (time.monotonic() - start)
+            if remaining <= 0:
+                return
+            yield max(0.0, min(delay, remaining))
+            delay = min(delay * self.backoff, self.max_delay)
+
+
+HYDROCAPT_FIRE_AND_FORGET = HydrocaptConfirmation(enabled=False)
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 """Consts for Hydrocapt python client API."""
+from datetime import timedelta
 
 
 
@@ -31,6 +32,13 @@ for k_ext, v_trad in HYDROCAPT_EXTERNAL_TO_INTERNAL_COMMANDS.items():
 HYDROCAPT_TIMER = "timer"
 
 
+#getJsonValues records typeInfo to measure names, redox is ORP
+HYDROCAPT_MEASURE_TYPES = {"WATER_TEMP":"water_temperature", "AIR_TEMP":"technical_room_temperature", "PH":"ph", "CONDUCTIVITY":"conductivity", "ORP":"redox"}
+
+#placeholders used by getJsonValues for the hours without a measure
+HYDROCAPT_MEASURE_BAD_VALUES = {"--.-", "--", "-.-", "---" }
+
+
 HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS = {
   "setpoint_heating": ["setpoint_heating", "integer", "Heat"],
   "Filtration Timer": ["timer_filtration", HYDROCAPT_TIMER, "Filtration"],
@@ -47,16 +55,127 @@ for k_ext, v_trad in HYDROCAPT_EXTERNAL_TO_INTERNAL_CONSIGNS.items():
         HYDROCAPT_TIMERS[v_trad[0]] = v_trad[2]
 
 
-HYDROCAPT_LOGIN_URL = "https://www.hydrocapt.fr/pool/poolLogin/login"
-HYDROCAPT_DISCONNECT_URL = "https://www.hydrocapt.fr/pool/poolLogin/disconnect"
-HYDROCAPT_EDIT_POOL_OWN_URL = "https://www.hydrocapt.fr/pool/poolEdit/own"
-HYDROCAPT_AJAX_VALUES_HISTORY = "https://www.hydrocapt.fr/pool/ajaxHistoric/getJsonValues"
-HYDROCAPT_GET_POOL_COMMAND_URL = "https://www.hydrocapt.fr/pool/ajaxCommands/get"
-HYDROCAPT_SAVE_POOL_COMMAND_URL = "https://www.hydrocapt.fr/pool/ajaxCommands/save"
-HYDROCAPT_POOL_LIST_OWN_URL = "https://www.hydrocapt.fr/pool/poolList/own"
-HYDROCAPT_CURRENT_COMMAND_STATE_URL = "https://www.hydrocapt.fr/pool/ajaxOmeoGetCurrentsOrder"
-HYDROCAPT_GET_ALARMS_URL = "https://www.hydrocapt.fr/pool/ajaxAlarms/get"
-HYDROCAPT_AJAX_POOL_HISTORIC = "https://www.hydrocapt.fr/pool/poolHistoric"
+#the urls below are rebased by the sessions when given an other base url, e.g. a local HydrocaptFakeServer
+HYDROCAPT_BASE_URL = "https://www.hydrocapt.fr"
+
+HYDROCAPT_LOGIN_URL = f"{HYDROCAPT_BASE_URL}/pool/poolLogin/login"
+HYDROCAPT_DISCONNECT_URL = f"{HYDROCAPT_BASE_URL}/pool/poolLogin/disconnect"
+HYDROCAPT_EDIT_POOL_OWN_URL = f"{HYDROCAPT_BASE_URL}/pool/poolEdit/own"
+HYDROCAPT_AJAX_VALUES_HISTORY = f"{HYDROCAPT_BASE_URL}/pool/ajaxHistoric/getJsonValues"
+HYDROCAPT_GET_POOL_COMMAND_URL = f"{HYDROCAPT_BASE_URL}/pool/ajaxCommands/get"
+HYDROCAPT_SAVE_POOL_COMMAND_URL = f"{HYDROCAPT_BASE_URL}/pool/ajaxCommands/save"
+HYDROCAPT_POOL_LIST_OWN_URL = f"{HYDROCAPT_BASE_URL}/pool/poolList/own"
+HYDROCAPT_CURRENT_COMMAND_STATE_URL = f"{HYDROCAPT_BASE_URL}/pool/ajaxOmeoGetCurrentsOrder"
+HYDROCAPT_GET_ALARMS_URL = f"{HYDROCAPT_BASE_URL}/pool/ajaxAlarms/get"
+HYDROCAPT_AJAX_POOL_HISTORIC = f"{HYDROCAPT_BASE_URL}/pool/poolHistoric"
+
+HYDROCAPT_GET_POOL_CONSIGN_URL = f"{HYDROCAPT_BASE_URL}/pool/ajaxSetpoints/get"
+HYDROCAPT_SAVE_POOL_CONSIGN_URL = f"{HYDROCAPT_BASE_URL}/pool/ajaxSetpoints/save"
+
+#status of the ajax XML answers
+HYDROCAPT_STATUS_NOT_AUTHENTICATED = "You are not authenticated"
+HYDROCAPT_STATUS_OK = "OK"
+HYDROCAPT_STATUS_NO_CHANGE = "Pas de modification"
+#groups of datas holding the setpoints in the ajaxSetpoints answer, a timer value wins over a select one
+HYDROCAPT_CONSIGN_GROUPS = ("select", "timer")
+
+#max number of threads used by the clients for their parallel reads
+HYDROCAPT_PARALLEL_MAX_WORKERS = 8
+
+#max number of pools refreshed at the same time by a fleet
+HYDROCAPT_FLEET_MAX_CONCURRENCY = 8
+
+#time in seconds a stored session is reused before logging in again
+HYDROCAPT_SESSION_STORE_MAX_AGE = 12 * 3600
+
+
+HYDROCAPT_RESOURCE_COMMANDS = "commands"
+HYDROCAPT_RESOURCE_CONSIGNS = "consigns"
+HYDROCAPT_RESOURCE_MEASURES = "measures"
+HYDROCAPT_RESOURCE_ALARMS = "alarms"
+HYDROCAPT_RESOURCE_HISTORY = "history"
+
+#number of deltas kept by a client change feed
+HYDROCAPT_CHANGE_FEED_HISTORY = 64
+
+#background poller: seconds between two reads of the commands and of the consigns
+HYDROCAPT_POLLER_COMMANDS_INTERVAL = 60
+HYDROCAPT_POLLER_CONSIGNS_INTERVAL = 300
+#the measures are read this many seconds after the end of the hour of the next expected sample, plus a random jitter
+HYDROCAPT_POLLER_MEASURES_SETTLE_DELAY = 300
+HYDROCAPT_POLLER_MEASURES_JITTER = 60
+#seconds between two reads of the measures while the expected sample is late, doubled at each miss up to an hour
+HYDROCAPT_POLLER_MEASURES_CATCH_UP = 300
+#seconds before reading a resource again after an error
+HYDROCAPT_POLLER_ERROR_DELAY = 60
+
+#time in seconds a read is answered from the last read values, 0 to always ask the server
+#measures are only updated hourly by the pool, a few minutes is a good value for them
+#the alarms limits are only used to compute the measures status and almost never change
+HYDROCAPT_DEFAULT_CACHE_TTL = {
+    HYDROCAPT_RESOURCE_COMMANDS: 0,
+    HYDROCAPT_RESOURCE_CONSIGNS: 0,
+    HYDROCAPT_RESOURCE_MEASURES: 0,
+    HYDROCAPT_RESOURCE_ALARMS: 24 * 3600,
+}
 
-HYDROCAPT_GET_POOL_CONSIGN_URL = "https://www.hydrocapt.fr/pool/ajaxSetpoints/get"
-HYDROCAPT_SAVE_POOL_CONSIGN_URL = "https://www.hydrocapt.fr/pool/ajaxSetpoints/save"
\ No newline at end of file
+#max number of history days requested at the same time
+HYDROCAPT_HISTORY_MAX_IN_FLIGHT = 4
+
+#delay after the end of a day before its history is considered final
+HYDROCAPT_HISTORY_SETTLE_DELAY = timedelta(hours=2)
+
+#type_date of getJsonValues: a day answers its 25 hourly values, a week (monday to sunday)
+#and a month one value per day
+HYDROCAPT_TYPE_DATE_DAY = "day"
+HYDROCAPT_TYPE_DATE_WEEK = "week"
+HYDROCAPT_TYPE_DATE_MONTH = "month"
+
+#resolutions of the history records
+HYDROCAPT_RESOLUTION_HOUR = "hour"
+HYDROCAPT_RESOLUTION_DAY = "day"
+
+#confirmation of the saves: first read after this many seconds, then back off up to the max delay until the deadline
+HYDROCAPT_CONFIRMATION_FIRST_DELAY = 0.5
+HYDROCAPT_CONFIRMATION_BACKOFF = 2.0
+HYDROCAPT_CONFIRMATION_MAX_DELAY = 4.0
+HYDROCAPT_CONFIRMATION_DEADLINE = 10.0
+
+#failed requests: an expired session is renewed by at most this many logins per request
+HYDROCAPT_RETRY_MAX_RELOGINS = 1
+#a transport or server error is retried this many times, waiting first delay then backing off up to the max delay
+HYDROCAPT_RETRY_TRANSPORT_RETRIES = 2
+HYDROCAPT_RETRY_FIRST_DELAY = 0.5
+HYDROCAPT_RETRY_BACKOFF = 2.0
+HYDROCAPT_RETRY_MAX_DELAY = 5.0
+#random part of the retry delays, as a fraction of the delay
+HYDROCAPT_RETRY_JITTER = 0.2
+
+#answers of an expired session: these HTTP status, a redirect to the login page, or the not authenticated error at the start of the body (in XML or JSON)
+HYDROCAPT_SESSION_EXPIRED_STATUS = (401, 403, 440)
+HYDROCAPT_SESSION_EXPIRED_PATH = "/pool/poolLogin"
+HYDROCAPT_SESSION_EXPIRED_MARKERS = (HYDROCAPT_STATUS_NOT_AUTHENTICATED.encode("ascii"),)
+#answers retried as transport errors, the server is overloaded or failing
+HYDROCAPT_RETRY_STATUS = (429, 500, 502, 503, 504)
+
+#rate limiter: requests per second and burst size, for all the sessions toward a host, and per account on it
+HYDROCAPT_RATE_LIMIT_HOST_RATE = 10.0
+HYDROCAPT_RATE_LIMIT_HOST_BURST = 20
+HYDROCAPT_RATE_LIMIT_ACCOUNT_RATE = 2.0
+HYDROCAPT_RATE_LIMIT_ACCOUNT_BURST = 10
+
+#circuit breaker: opened after this many failed requests in a row toward a host, a probe request is let through after the timeout
+HYDROCAPT_CIRCUIT_FAILURE_THRESHOLD = 5
+HYDROCAPT_CIRCUIT_RESET_TIMEOUT = 30.0
+HYDROCAPT_CIRCUIT_HALF_OPEN_PROBES = 1
+
+#http connections: socket timeout in seconds when the call has no deadline, pooled connections per host,
+#idle time in seconds a kept alive connection is reused, and the answers compression
+HYDROCAPT_HTTP_TIMEOUT = 30.0
+HYDROCAPT_HTTP_POOL_MAXSIZE = 10
+HYDROCAPT_HTTP_KEEPALIVE_TIMEOUT = 15.0
+HYDROCAPT_HTTP_ACCEPT_ENCODING = "gzip, deflate"
+
+#upper bounds in seconds of the metrics histograms buckets, for the requests and the decoding of their answers
+HYDROCAPT_METRICS_LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+HYDROCAPT_METRICS_PARSE_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05)
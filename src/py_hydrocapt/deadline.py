@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Deadline budgets of the public calls.
+
+Each public network method of the clients accepts deadline=seconds. The deadline is kept in a
+context variable, so it follows the call through the logins, the reads, the retries and the
+confirmation polls, in threads started by the call (see get_remaining) and in asyncio tasks.
+Each socket operation gets the remaining budget as timeout, and a wait that would not end
+before the deadline (backoff, rate limiter, confirmation delay) fails at once instead.
+"""
+import functools
+import inspect
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+from typing import Optional
+
+from .exceptions import HydrocaptDeadlineExceeded
+
+# time.monotonic() at which the current call must be finished, None when unbounded
+_deadline: ContextVar[Optional[float]] = ContextVar("hydrocapt_deadline", default=None)
+
+
+def get_remaining() -> Optional[float]:
+    """Seconds left to the current call, None if it has no deadline."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def check_remaining(what: str = "call") -> Optional[float]:
+    """Seconds left to the current call, raise HydrocaptDeadlineExceeded if there are none."""
+    remaining = get_remaining()
+    if remaining is not None and remaining <= 0:
+        raise HydrocaptDeadlineExceeded(f"Deadline exceeded before {what}")
+    return remaining
+
+
+def get_timeout(default: Optional[float], what: str = "request") -> Optional[float]:
+    """Timeout of a socket operation: default, reduced to the remaining budget."""
+    remaining = check_remaining(what)
+    if remaining is None:
+        return default
+    if default is None:
+        return remaining
+    return min(default, remaining)
+
+
+def check_wait(delay: float, what: str = "waiting") -> float:
+    """Return delay if the current call can wait that long, raise HydrocaptDeadlineExceeded otherwise."""
+    remaining = get_remaining()
+    if remaining is not None and delay >= remaining:
+        raise HydrocaptDeadlineExceeded(f"Deadline exceeded while {what}")
+    return delay
+
+
+@contextmanager
+def deadline_scope(seconds: Optional[float]) -> Iterator[None]:
+    """Bound the calls made in the block to seconds, or to the deadline of an enclosing call if sooner."""
+    if seconds is None:
+        yield
+        return
+
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    if current is not None:
+        deadline = min(deadline, current)
+
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def with_deadline(func):
+    """Give a function, or a coroutine function, an optional deadline= keyword argument in seconds."""
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, deadline: Optional[float] = None, **kwargs):
+            with deadline_scope(deadline):
+                return await func(*args, **kwargs)
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, deadline: Optional[float] = None, **kwargs):
+        with deadline_scope(deadline):
+            return func(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+"""Decoding of the XML answers of the ajax endpoints (commands, setpoints, alarms and saves).
+
+The answers are parsed from the raw bytes of the response, the XML declaration gives their
+encoding, and read in a single pass over the children of datas instead of one XPath per value.
+"""
+from typing import Any
+from typing import Dict
+from typing import Union
+
+from lxml import etree
+
+from .exceptions import HydrocaptError
+
+from .const import HYDROCAPT_INTERNAL_TO_EXTERNAL_COMMANDS
+from .const import HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS
+from .const import HYDROCAPT_STATUS_NOT_AUTHENTICATED
+from .const import HYDROCAPT_STATUS_OK
+from .const import HYDROCAPT_STATUS_NO_CHANGE
+from .const import HYDROCAPT_CONSIGN_GROUPS
+
+
+_XML_PARSER = etree.XMLParser(resolve_entities=False, no_network=True, remove_comments=True)
+
+
+def parse_xml(content: Union[bytes, str]):
+    """Parse an ajax answer, preferably given as the raw bytes of the response."""
+    if isinstance(content, str):
+        content = content.encode("utf-8")
+    try:
+        return etree.fromstring(content, _XML_PARSER)
+    except etree.XMLSyntaxError as e:
+        raise HydrocaptError(f"Invalid XML answer: {e}") from e
+
+
+def get_status(root) -> Union[str, None]:
+    """The text of /root/status, None if the answer has no status."""
+    status = root.find("status")
+    if status is None:
+        return None
+    return status.text or ""
+
+
+def check_status(root) -> None:
+    """Raise if the answer status is not OK, the session expired included."""
+    status = get_status(root)
+    if status is None:
+        return
+    if HYDROCAPT_STATUS_NOT_AUTHENTICATED in status:
+        raise HydrocaptError(HYDROCAPT_STATUS_NOT_AUTHENTICATED)
+    if HYDROCAPT_STATUS_OK not in status:
+        raise HydrocaptError(f"Bad status {status}")
+
+
+def decode_save_status(content: Union[bytes, str]) -> bool:
+    """Check the answer of a save request.
+
+    Returns:
+        False if the server reported that nothing changed, True otherwise
+    """
+    status = get_status(parse_xml(content))
+    if status is not None:
+        if HYDROCAPT_STATUS_NO_CHANGE in status:
+            return False
+        if HYDROCAPT_STATUS_NOT_AUTHENTICATED in status:
+            raise HydrocaptError(HYDROCAPT_STATUS_NOT_AUTHENTICATED)
+    return True
+
+
+def decode_commands(content: Union[bytes, str]) -> Dict[str, int]:
+    """Decode an ajaxCommands/get answer into the internal command states."""
+    root = parse_xml(content)
+    check_status(root)
+
+    internal_states = {}
+    datas = root.find("datas")
+    if datas is None:
+        return internal_states
+
+    for c in datas:
+        if c.tag in HYDROCAPT_INTERNAL_TO_EXTERNAL_COMMANDS and c.tag not in internal_states:
+            try:
+                internal_states[c.tag] = int(c.text)
+            except (TypeError, ValueError):
+                pass
+
+    return internal_states
+
+
+def decode_consigns(content: Union[bytes, str]) -> Dict[str, str]:
+    """Decode an ajaxSetpoints/get answer into the internal consign values, timers as "0101..." strings."""
+    root = parse_xml(content)
+    check_status(root)
+
+    internal_consigns = {}
+    datas = root.find("datas")
+    if datas is None:
+        return internal_consigns
+
+    for group_name in HYDROCAPT_CONSIGN_GROUPS:
+        group = datas.find(group_name)
+        if group is None:
+            continue
+        seen = set()
+        for c in group:
+            if c.tag in HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS and c.tag not in seen and c.text is not None:
+                seen.add(c.tag)
+                internal_consigns[c.tag] = c.text
+
+    return internal_consigns
+
+
+def decode_alarms(content: Union[bytes, str]) -> Dict[str, Dict[str, Any]]:
+    """Decode an ajaxAlarms/get answer into the min, max and enable of each alarm, by alarm name."""
+    root = parse_xml(content)
+    check_status(root)
+
+    alarms = {}
+    for alrm in root.iter("alarm"):
+        alarm = {}
+        try:
+            for c in alrm:
+                if c.tag == "max" or c.tag == "min":
+                    alarm[c.tag] = float(c.text)
+                elif c.tag == "enable":
+                    alarm[c.tag] = bool(c.text)
+        except (TypeError, ValueError):
+            continue
+
+        name = alrm.get("name")
+        if name is not None:
+            alarms[name] = alarm
+
+    return alarms
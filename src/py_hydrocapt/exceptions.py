@@ -12,3 +12,19 @@ class HydrocaptError(Exception):
             args: the message or root cause of the error
         """
         Exception.__init__(self, *args)
+
+
+class HydrocaptAuthenticationError(HydrocaptError):
+    """The session is still rejected after logging in again, e.g. wrong credentials."""
+
+
+class HydrocaptTransportError(HydrocaptError):
+    """The server could not be reached, or kept failing, after the transport retries."""
+
+
+class HydrocaptCircuitOpenError(HydrocaptTransportError):
+    """The request was not sent, the server failed too many times recently, see HydrocaptCircuitBreaker."""
+
+
+class HydrocaptDeadlineExceeded(HydrocaptTransportError):
+    """The deadline of the call was reached, see deadline.py."""
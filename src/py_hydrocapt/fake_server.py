@@ -0,0 +1,503 @@
+# -*- coding: utf-8 -*-
+"""Local stand-in of the Hydrocapt server, to benchmark and load test the clients without www.hydrocapt.fr.
+
+It serves the endpoints used by the clients (login, poolEdit/own, getJsonValues, ajaxCommands get/save,
+ajaxSetpoints get/save and ajaxAlarms/get) with answers shaped like the real ones, and can add latency,
+errors and session expiry. Only the standard library is used:
+
+    with HydrocaptFakeServer(latency=0.05) as server:
+        server.add_pool("user", "password", 1234)
+        client = HydrocaptClient("user", "password", base_url=server.base_url)
+        client.fetch_all_data()
+        print(server.get_round_trips())
+
+It can also be run alone: python -m py_hydrocapt.fake_server --port 8080 --pool user:password:1234
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import threading
+import time
+import uuid
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from http.server import BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from urllib.parse import parse_qsl
+from urllib.parse import urlparse
+
+from .const import HYDROCAPT_BASE_URL
+from .const import HYDROCAPT_LOGIN_URL
+from .const import HYDROCAPT_EDIT_POOL_OWN_URL
+from .const import HYDROCAPT_AJAX_VALUES_HISTORY
+from .const import HYDROCAPT_TYPE_DATE_DAY
+from .const import HYDROCAPT_TYPE_DATE_WEEK
+from .const import HYDROCAPT_TYPE_DATE_MONTH
+from .const import HYDROCAPT_GET_POOL_COMMAND_URL
+from .const import HYDROCAPT_SAVE_POOL_COMMAND_URL
+from .const import HYDROCAPT_GET_ALARMS_URL
+from .const import HYDROCAPT_GET_POOL_CONSIGN_URL
+from .const import HYDROCAPT_SAVE_POOL_CONSIGN_URL
+from .const import HYDROCAPT_STATUS_NOT_AUTHENTICATED
+from .const import HYDROCAPT_STATUS_OK
+from .const import HYDROCAPT_STATUS_NO_CHANGE
+from .history import get_period
+from .history import iter_days
+
+
+def _path(url: str) -> str:
+    return url[len(HYDROCAPT_BASE_URL):]
+
+
+_LOGIN_PATH = _path(HYDROCAPT_LOGIN_URL)
+_EDIT_POOL_OWN_PATH = _path(HYDROCAPT_EDIT_POOL_OWN_URL)
+_VALUES_HISTORY_PATH = _path(HYDROCAPT_AJAX_VALUES_HISTORY)
+_GET_COMMAND_PATH = _path(HYDROCAPT_GET_POOL_COMMAND_URL)
+_SAVE_COMMAND_PATH = _path(HYDROCAPT_SAVE_POOL_COMMAND_URL)
+_GET_ALARMS_PATH = _path(HYDROCAPT_GET_ALARMS_URL)
+_GET_CONSIGN_PATH = _path(HYDROCAPT_GET_POOL_CONSIGN_URL)
+_SAVE_CONSIGN_PATH = _path(HYDROCAPT_SAVE_POOL_CONSIGN_URL)
+
+_COOKIE_NAME = "PHPSESSID"
+
+_XML_HEADER = '<?xml version="1.0" encoding="UTF-8"?>\n'
+
+# getJsonValues typeInfo, base value, daily amplitude and decimals of the generated measures
+_MEASURES = (
+    ("WATER_TEMP", 26.5, 1.5, 1),
+    ("AIR_TEMP", 19.0, 4.0, 1),
+    ("PH", 7.25, 0.1, 2),
+    ("ORP", 700.0, 40.0, 0),
+    ("CONDUCTIVITY", 4.2, 0.3, 1),
+)
+
+
+class HydrocaptFakePool(object):
+    """State of one pool of the fake server, internal command and setpoint names as in the real answers."""
+
+    def __init__(self, username: str, password: str, serial: int) -> None:
+        self.username = username
+        self.password = password
+        self.serial = serial
+        self.commands: Dict[str, int] = {
+            "filtration": 3,
+            "lighting": 2,
+            "heating_regulation": 0,
+            "ph_regulation": 0,
+            "orp_regulation": 0,
+            "aux1": 0,
+            "aux2": 0,
+            "type_aux1": 0,
+            "type_aux2": 0,
+        }
+        self.selects: Dict[str, str] = {
+            "setpoint_heating": "28",
+            "setpoint_ph": "72",
+            "setpoint_orp": "700",
+        }
+        self.timers: Dict[str, str] = {
+            "timer_filtration": "000000001111111111110000",
+            "timer_lighting": "000000000000000000001111",
+            "timer_aux1": "0" * 24,
+            "timer_aux2": "0" * 24,
+        }
+        self.alarms: Dict[str, Tuple[float, float, int]] = {
+            "PH": (7.0, 7.6, 1),
+            "ORP": (650, 750, 1),
+            "CONDUCTIVITY": (3.5, 6, 1),
+            "WATER_TEMP": (10, 32, 0),
+            "AIR_TEMP": (2, 45, 0),
+        }
+        # saves not applied yet by the pool: (apply time, kind, name, value)
+        self.pending: List[Tuple[float, str, str, Any]] = []
+
+    def apply_pending(self, now: float) -> None:
+        still_pending = []
+        for p in self.pending:
+            if p[0] > now:
+                still_pending.append(p)
+            elif p[1] == "commands":
+                self.commands[p[2]] = p[3]
+            elif p[2] in self.timers:
+                self.timers[p[2]] = p[3]
+            else:
+                self.selects[p[2]] = p[3]
+        self.pending = still_pending
+
+    def measure(self, type_info: str, when: datetime) -> str:
+        for name, base, amplitude, decimals in _MEASURES:
+            if name == type_info:
+                # a smooth daily cycle, different for each pool
+                phase = (when.hour + (self.serial % 24)) / 24.0 * 2 * math.pi
+                value = base + amplitude * math.sin(phase)
+                return f"{value:.{decimals}f}"
+        return "--.-"
+
+
+class _HydrocaptFakeHTTPServer(ThreadingHTTPServer):
+
+    def handle_error(self, request, client_address):
+        # a client giving up on a slow answer closes the connection, not worth a traceback
+        if isinstance(sys.exc_info()[1], ConnectionError):
+            return
+        super().handle_error(request, client_address)
+
+
+class HydrocaptFakeServer(object):
+    """Threaded HTTP server answering like www.hydrocapt.fr for the pools added to it."""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, latency: float = 0.0, jitter: float = 0.0,
+                 error_rate: float = 0.0, session_ttl: Optional[float] = None, apply_delay: float = 0.0,
+                 seed: Optional[int] = None) -> None:
+        """Create the server, it is started by start() or when entering its context.
+
+        Args:
+            host: interface to listen on
+            port: port to listen on, 0 for any free port, see base_url
+            latency: seconds added to every answer
+            jitter: max random seconds added to the latency
+            error_rate: probability of an answer to be an HTTP 500
+            session_ttl: seconds after which a login expires, None for never
+            apply_delay: seconds before a save is seen by the reads, like a real pool applying it
+            seed: seed of the jitter and errors, for reproducible runs
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.session_ttl = session_ttl
+        self.apply_delay = apply_delay
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._pools: Dict[int, HydrocaptFakePool] = {}
+        self._sessions: Dict[str, Tuple[str, float]] = {}
+        self._round_trips: Dict[str, int] = {}
+        self._httpd: Optional[ThreadingHTTPServer] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def add_pool(self, username: str, password: str, serial: int) -> HydrocaptFakePool:
+        """Add a pool owned by an account, an account can own several pools."""
+        pool = HydrocaptFakePool(username, password, serial)
+        with self._lock:
+            self._pools[serial] = pool
+        return pool
+
+    def get_pool(self, serial: int) -> HydrocaptFakePool:
+        return self._pools[serial]
+
+    @property
+    def base_url(self) -> str:
+        """The base url to give to the clients."""
+        if self._httpd is None:
+            raise RuntimeError("The fake server is not started")
+        return f"http://{self.host}:{self._httpd.server_port}"
+
+    def start(self) -> "HydrocaptFakeServer":
+        if self._httpd is None:
+            self._httpd = _HydrocaptFakeHTTPServer((self.host, self.port), _make_handler(self))
+            self._httpd.daemon_threads = True
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name="hydrocapt-fake-server", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._thread.join()
+            self._httpd = None
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def get_round_trips(self) -> Dict[str, int]:
+        """Number of requests received per endpoint path since the start or the last reset."""
+        with self._lock:
+            return dict(self._round_trips)
+
+    def reset_round_trips(self) -> None:
+        with self._lock:
+            self._round_trips.clear()
+
+    def expire_sessions(self) -> None:
+        """Forget all the logins, the next requests of the clients are not authenticated."""
+        with self._lock:
+            self._sessions.clear()
+
+    # everything below runs on the server threads
+
+    def _count(self, path: str) -> None:
+        with self._lock:
+            self._round_trips[path] = self._round_trips.get(path, 0) + 1
+
+    def _sleep_and_fail(self) -> bool:
+        with self._lock:
+            delay = self.latency + (self._random.uniform(0, self.jitter) if self.jitter > 0 else 0.0)
+            fail = self.error_rate > 0 and self._random.random() < self.error_rate
+        if delay > 0:
+            time.sleep(delay)
+        return fail
+
+    def _login(self, username: str, password: str) -> Optional[str]:
+        with self._lock:
+            for pool in self._pools.values():
+                if pool.username == username and pool.password == password:
+                    sid = uuid.uuid4().hex
+                    self._sessions[sid] = (username, time.monotonic())
+                    return sid
+        return None
+
+    def _get_username(self, sid: Optional[str]) -> Optional[str]:
+        if sid is None:
+            return None
+        with self._lock:
+            s = self._sessions.get(sid)
+            if s is None:
+                return None
+            if self.session_ttl is not None and time.monotonic() - s[1] > self.session_ttl:
+                del self._sessions[sid]
+                return None
+            return s[0]
+
+    def _get_owned_pool(self, username: Optional[str], serial) -> Optional[HydrocaptFakePool]:
+        try:
+            serial = int(serial)
+        except (TypeError, ValueError):
+            return None
+        pool = self._pools.get(serial)
+        if pool is None or username is None or pool.username != username:
+            return None
+        with self._lock:
+            pool.apply_pending(time.monotonic())
+        return pool
+
+    def _pools_of(self, username: str) -> List[HydrocaptFakePool]:
+        return [p for p in self._pools.values() if p.username == username]
+
+    def _values_answer(self, pool: HydrocaptFakePool, day_str: str) -> Dict[str, Any]:
+        try:
+            day = date.fromisoformat(day_str)
+        except (TypeError, ValueError):
+            return {"errors": ["Bad date"]}
+
+        now = datetime.now()
+        day_start = datetime(day.year, day.month, day.day)
+        # 25 hourly slots, the last one is the next midnight, the hours not reported yet are --.-
+        reported = max(0, min(25, int((now - day_start).total_seconds() // 3600)))
+
+        records = [{"typeInfo": "DATE", "values": [day_str] * 25}]
+        for type_info, _, _, _ in _MEASURES:
+            values = [pool.measure(type_info, day_start + timedelta(hours=h)) for h in range(reported)]
+            values += ["--.-"] * (25 - reported)
+            records.append({"typeInfo": type_info, "values": values})
+
+        return {"records": records}
+
+    def _period_values_answer(self, pool: HydrocaptFakePool, day_str: str, type_date: str) -> Dict[str, Any]:
+        try:
+            day = date.fromisoformat(day_str)
+        except (TypeError, ValueError):
+            return {"errors": ["Bad date"]}
+
+        # one slot per day of the week or month, the mean of the hours reported so far
+        now = datetime.now()
+        start, end = get_period(type_date, day)
+        days = list(iter_days(start, end))
+        records = [{"typeInfo": "DATE", "values": [d.isoformat() for d in days]}]
+        for type_info, _, _, decimals in _MEASURES:
+            values = []
+            for d in days:
+                day_start = datetime(d.year, d.month, d.day)
+                reported = max(0, min(24, int((now - day_start).total_seconds() // 3600)))
+                if reported == 0:
+                    values.append("--.-")
+                    continue
+                total = sum(float(pool.measure(type_info, day_start + timedelta(hours=h))) for h in range(reported))
+                values.append(f"{total / reported:.{decimals}f}")
+            records.append({"typeInfo": type_info, "values": values})
+
+        return {"records": records}
+
+    def _commands_answer(self, pool: HydrocaptFakePool) -> str:
+        datas = "".join(f"<{k}>{v}</{k}>" for k, v in pool.commands.items())
+        return f"{_XML_HEADER}<root><status>OK</status><datas><serial>{pool.serial}</serial>{datas}</datas></root>"
+
+    def _consigns_answer(self, pool: HydrocaptFakePool) -> str:
+        selects = "".join(f"<{k}>{v}</{k}>" for k, v in pool.selects.items())
+        timers = "".join(f"<{k}>{v}</{k}>" for k, v in pool.timers.items())
+        return f"{_XML_HEADER}<root><status>OK</status><datas><select>{selects}</select><timer>{timers}</timer></datas></root>"
+
+    def _alarms_answer(self, pool: HydrocaptFakePool) -> str:
+        alarms = "".join(
+            f'<alarm name="{name}"><min>{v[0]}</min><max>{v[1]}</max><enable>{v[2]}</enable></alarm>'
+            for name, v in pool.alarms.items()
+        )
+        return f"{_XML_HEADER}<root><status>OK</status><alarms>{alarms}</alarms></root>"
+
+    def _save(self, pool: HydrocaptFakePool, kind: str, form: Dict[str, str]) -> str:
+        if kind == "commands":
+            current = {k: str(v) for k, v in pool.commands.items()}
+        else:
+            current = dict(pool.selects)
+            current.update(pool.timers)
+
+        apply_at = time.monotonic() + self.apply_delay
+        changed = False
+        with self._lock:
+            for name, value in form.items():
+                if name == "serial" or name not in current or current[name] == value:
+                    continue
+                if kind == "commands":
+                    try:
+                        value = int(value)
+                    except ValueError:
+                        continue
+                elif name in pool.timers and (len(value) != 24 or set(value) - {"0", "1"}):
+                    continue
+                pool.pending.append((apply_at, kind, name, value))
+                changed = True
+
+            if self.apply_delay <= 0:
+                pool.apply_pending(time.monotonic())
+
+        status = HYDROCAPT_STATUS_OK if changed else HYDROCAPT_STATUS_NO_CHANGE
+        return f"{_XML_HEADER}<root><status>{status}</status></root>"
+
+
+_NOT_AUTHENTICATED = f"{_XML_HEADER}<root><status>{HYDROCAPT_STATUS_NOT_AUTHENTICATED}</status></root>"
+
+
+def _make_handler(server: HydrocaptFakeServer):
+
+    class HydrocaptFakeHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # headers and body are written separately, don't let them wait for the client ack
+        disable_nagle_algorithm = True
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send(self, code: int, body: str, content_type: str = "text/xml; charset=utf-8", headers: Optional[Dict[str, str]] = None):
+            payload = body.encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(payload)))
+            for k, v in (headers or {}).items():
+                self.send_header(k, v)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _sid(self) -> Optional[str]:
+            for c in self.headers.get("Cookie", "").split(";"):
+                name, _, value = c.strip().partition("=")
+                if name == _COOKIE_NAME:
+                    return value
+            return None
+
+        def _handle(self, method: str) -> None:
+            url = urlparse(self.path)
+            query = dict(parse_qsl(url.query))
+            length = int(self.headers.get("Content-Length") or 0)
+            form = dict(parse_qsl(self.rfile.read(length).decode("utf-8"))) if length > 0 else {}
+
+            server._count(url.path)
+            if server._sleep_and_fail():
+                return self._send(500, "<html><body>Internal Server Error</body></html>", "text/html")
+
+            if url.path == _LOGIN_PATH and method == "POST":
+                sid = server._login(form.get("login"), form.get("pass"))
+                if sid is None:
+                    return self._send(200, "<html><body><form id='login'>Identifiant ou mot de passe incorrect</form></body></html>", "text/html")
+                return self._send(200, "<html><body>Connected</body></html>", "text/html",
+                                  {"Set-Cookie": f"{_COOKIE_NAME}={sid}; Path=/; HttpOnly"})
+
+            username = server._get_username(self._sid())
+
+            if url.path == _EDIT_POOL_OWN_PATH:
+                pools = server._pools_of(username) if username is not None else []
+                if len(pools) == 0:
+                    return self._send(200, "<html><body><form id='login'></form></body></html>", "text/html")
+                return self._send(200, f"<html><body><form><input type='hidden' name='serial' value='{pools[0].serial}'/></form></body></html>", "text/html")
+
+            if url.path == _VALUES_HISTORY_PATH:
+                pool = server._get_owned_pool(username, query.get("serial"))
+                if pool is None:
+                    return self._send(200, json.dumps({"error": HYDROCAPT_STATUS_NOT_AUTHENTICATED}), "application/json")
+                type_date = query.get("type_date", HYDROCAPT_TYPE_DATE_DAY)
+                if type_date == HYDROCAPT_TYPE_DATE_DAY:
+                    return self._send(200, json.dumps(server._values_answer(pool, query.get("date"))), "application/json")
+                if type_date in (HYDROCAPT_TYPE_DATE_WEEK, HYDROCAPT_TYPE_DATE_MONTH):
+                    return self._send(200, json.dumps(server._period_values_answer(pool, query.get("date"), type_date)), "application/json")
+                return self._send(200, json.dumps({"errors": ["Unsupported type_date"]}), "application/json")
+
+            serial = query.get("serial", form.get("serial"))
+            pool = server._get_owned_pool(username, serial)
+
+            if url.path in (_GET_COMMAND_PATH, _SAVE_COMMAND_PATH, _GET_CONSIGN_PATH, _SAVE_CONSIGN_PATH, _GET_ALARMS_PATH):
+                if pool is None:
+                    return self._send(200, _NOT_AUTHENTICATED)
+                if url.path == _GET_COMMAND_PATH:
+                    return self._send(200, server._commands_answer(pool))
+                if url.path == _GET_CONSIGN_PATH:
+                    return self._send(200, server._consigns_answer(pool))
+                if url.path == _GET_ALARMS_PATH:
+                    return self._send(200, server._alarms_answer(pool))
+                if url.path == _SAVE_COMMAND_PATH:
+                    return self._send(200, server._save(pool, "commands", form))
+                return self._send(200, server._save(pool, "consigns", form))
+
+            self._send(404, "<html><body>Not Found</body></html>", "text/html")
+
+        def do_GET(self):
+            self._handle("GET")
+
+        def do_POST(self):
+            self._handle("POST")
+
+    return HydrocaptFakeHandler
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Local stand-in of the Hydrocapt server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--pool", action="append", default=[], help="username:password:serial, can be repeated")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--session-ttl", type=float, default=None)
+    parser.add_argument("--apply-delay", type=float, default=0.0)
+    args = parser.parse_args()
+
+    server = HydrocaptFakeServer(args.host, args.port, latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                                 session_ttl=args.session_ttl, apply_delay=args.apply_delay)
+    for p in args.pool or ["user:password:1234"]:
+        username, password, serial = p.rsplit(":", 2)
+        server.add_pool(username, password, int(serial))
+
+    server.start()
+    print(f"Hydrocapt fake server on {server.base_url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+"""Refresh many Hydrocapt pools, possibly from several accounts, with a bounded concurrency."""
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import wait
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+
+from requests.adapters import HTTPAdapter
+
+from .client import HydrocaptClient
+from .session import HydrocaptClientSession
+from .session_store import HydrocaptSessionStore
+from .exceptions import HydrocaptError
+from .metrics import HydrocaptMetrics
+from .retry import HydrocaptRetryPolicy
+from .throttle import HydrocaptRateLimiter
+from .throttle import HydrocaptCircuitBreaker
+from .transport import HydrocaptHttpSettings
+
+from .const import HYDROCAPT_FLEET_MAX_CONCURRENCY
+
+
+class HydrocaptFleetResult(NamedTuple):
+    """Outcome of the refresh of one pool of the fleet."""
+
+    username: str
+    pool_internal_id: int
+    data: Optional[Dict[str, Any]]
+    error: Optional[BaseException]
+    duration: float
+
+
+class HydrocaptFleet(object):
+    """Poll a fleet of pools with a global limit on the number of pools refreshed at the same time.
+
+    All the sessions share the same connection pools to the Hydrocapt server and pools of
+    the same account, when their id is known, share one login.
+    """
+
+    def __init__(self, entries: Iterable[Tuple[str, str, int]], max_concurrency: int = HYDROCAPT_FLEET_MAX_CONCURRENCY,
+                 session_store: Optional[HydrocaptSessionStore] = None, base_url: Optional[str] = None,
+                 metrics: Optional[HydrocaptMetrics] = None, retry_policy: Optional[HydrocaptRetryPolicy] = None,
+                 rate_limiter: Optional[HydrocaptRateLimiter] = None, circuit_breaker: Optional[HydrocaptCircuitBreaker] = None,
+                 serve_stale: bool = False, http_settings: Optional[HydrocaptHttpSettings] = None) -> None:
+        """Create the clients of the fleet, no request is made here.
+
+        Args:
+            entries: (username, password, pool_internal_id) for each pool, use -1 as id to discover it at login
+            max_concurrency: max number of pools refreshed at the same time
+            session_store: an optional store to reuse the sessions of a previous process
+            base_url: an optional server to use instead of www.hydrocapt.fr, e.g. a local HydrocaptFakeServer
+            metrics: an optional HydrocaptMetrics shared by all the sessions and clients of the fleet
+            retry_policy: caps and backoff of the retries of all the sessions, see HydrocaptRetryPolicy
+            rate_limiter: an optional HydrocaptRateLimiter shared by all the sessions, limiting the fleet per host and account
+            circuit_breaker: an optional HydrocaptCircuitBreaker shared by all the sessions, failing fast when the server is down
+            serve_stale: the clients return their last read values while the circuit breaker is open
+            http_settings: timeout, keep alive and compression of all the sessions, their connection pool is
+                the one of the fleet, sized by max_concurrency
+        """
+        self.max_concurrency = max_concurrency
+        self.metrics = metrics
+        self._http_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="hydrocapt-fleet")
+        self._lock = threading.Lock()
+        self._in_flight: Dict[int, Future] = {}
+        self._next_start = 0
+
+        sessions: Dict[Tuple[str, str], HydrocaptClientSession] = {}
+        self.clients: List[HydrocaptClient] = []
+        for username, password, pool_internal_id in entries:
+            if pool_internal_id is None:
+                pool_internal_id = -1
+
+            if pool_internal_id >= 0:
+                # the login is only bound to a pool when we have to discover its id
+                session = sessions.get((username, password))
+                if session is None:
+                    session = HydrocaptClientSession(username, password, pool_internal_id, http_adapter=self._http_adapter,
+                                                     session_store=session_store, base_url=base_url, metrics=metrics,
+                                                     retry_policy=retry_policy, rate_limiter=rate_limiter,
+                                                     circuit_breaker=circuit_breaker, http_settings=http_settings)
+                    sessions[(username, password)] = session
+            else:
+                session = HydrocaptClientSession(username, password, pool_internal_id, http_adapter=self._http_adapter,
+                                                 session_store=session_store, base_url=base_url, metrics=metrics,
+                                                 retry_policy=retry_policy, rate_limiter=rate_limiter,
+                                                 circuit_breaker=circuit_breaker, http_settings=http_settings)
+
+            self.clients.append(HydrocaptClient(username, password, pool_internal_id, session=session, metrics=metrics,
+                                                serve_stale=serve_stale))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
+        self._http_adapter.close()
+
+    def _refresh_one(self, client: HydrocaptClient, end: Optional[float] = None) -> HydrocaptFleetResult:
+        start = time.monotonic()
+        data = None
+        error = None
+        try:
+            data = client.fetch_all_data(deadline=end - start if end is not None else None)
+        except Exception as err:
+            error = err
+
+        return HydrocaptFleetResult(client.username, client.pool_internal_id, data, error, time.monotonic() - start)
+
+    def refresh_all(self, timeout: Optional[float] = None) -> List[HydrocaptFleetResult]:
+        """Refresh every pool of the fleet once.
+
+        The starting pool rotates at each call so that, with a concurrency lower than the
+        fleet size, the same pools are not always the last ones served. A pool whose previous
+        refresh is still running is not queued again.
+
+        Args:
+            timeout: max time in seconds to wait for the refreshes, it is also the deadline of each
+                refresh, the pools not done by then are reported with an error
+
+        Returns:
+            One result per pool, in the entries order
+        """
+        count = len(self.clients)
+        if count == 0:
+            return []
+
+        end = time.monotonic() + timeout if timeout is not None else None
+
+        with self._lock:
+            start = self._next_start % count
+            self._next_start = start + 1
+
+            futures: Dict[int, Future] = {}
+            busy = set()
+            for k in range(count):
+                idx = (start + k) % count
+                future = self._in_flight.get(idx)
+                if future is not None and not future.done():
+                    busy.add(idx)
+                else:
+                    future = self._executor.submit(self._refresh_one, self.clients[idx], end)
+                    self._in_flight[idx] = future
+                futures[idx] = future
+
+        wait([f for i, f in futures.items() if i not in busy], timeout=timeout)
+
+        results = []
+        for idx, client in enumerate(self.clients):
+            future = futures[idx]
+            if idx not in busy and future.done():
+                results.append(future.result())
+            else:
+                error = HydrocaptError(f"pool {client.pool_internal_id} refresh still running")
+                results.append(HydrocaptFleetResult(client.username, client.pool_internal_id, None, error, 0.0))
+
+        return results
@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""Hourly measures history of a Hydrocapt pool."""
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Tuple
+from typing import Union
+
+from .const import HYDROCAPT_MEASURE_TYPES
+from .const import HYDROCAPT_MEASURE_BAD_VALUES
+from .const import HYDROCAPT_TYPE_DATE_DAY
+from .const import HYDROCAPT_TYPE_DATE_WEEK
+from .const import HYDROCAPT_TYPE_DATE_MONTH
+from .const import HYDROCAPT_RESOLUTION_HOUR
+from .const import HYDROCAPT_RESOLUTION_DAY
+from .exceptions import HydrocaptError
+
+_NAN = float("nan")
+_HOURS = tuple(timedelta(hours=h) for h in range(25))
+
+
+class HydrocaptHistoryRecord(NamedTuple):
+    """Measures of one hour, None when the pool didn't report a value."""
+
+    date_time: datetime
+    water_temperature: Optional[float]
+    technical_room_temperature: Optional[float]
+    ph: Optional[float]
+    redox: Optional[float]
+    conductivity: Optional[float]
+
+
+class HydrocaptDaySeries(NamedTuple):
+    """The hourly slots of a getJsonValues day answer, aligned on times.
+
+    values maps each measure name to one float per slot, NaN when the pool didn't report it.
+    latest holds the latest valid measures, as returned by get_pool_measure_latest.
+    """
+
+    day: date
+    times: List[datetime]
+    values: Dict[str, List[float]]
+    latest: Dict[str, Any]
+
+
+class HydrocaptHistoryRequest(NamedTuple):
+    """One getJsonValues request, covering the days from start to end included."""
+
+    type_date: str
+    start: date
+    end: date
+
+
+def parse_date(value: str) -> datetime:
+    """Parse a date as sent by the server, YYYY-MM-DD, into a datetime at midnight.
+
+    The fixed format is decoded directly, anything else goes through dateutil.
+    """
+    if len(value) == 10 and value[4] == "-" and value[7] == "-":
+        try:
+            return datetime(int(value[0:4]), int(value[5:7]), int(value[8:10]))
+        except ValueError:
+            pass
+
+    from dateutil.parser import parse
+    return parse(value)
+
+
+def to_date(day: Union[date, datetime, str]) -> date:
+    """Accept a date, a datetime or an ISO formatted string."""
+    if isinstance(day, datetime):
+        return day.date()
+    if isinstance(day, date):
+        return day
+    return parse_date(day).date()
+
+
+def iter_days(start: Union[date, datetime, str], end: Union[date, datetime, str]) -> Iterator[date]:
+    """Yield the days from start to end, both included."""
+    day = to_date(start)
+    end = to_date(end)
+    while day <= end:
+        yield day
+        day += timedelta(days=1)
+
+
+def get_period(type_date: str, day: date) -> Tuple[date, date]:
+    """First and last days of the day, week (monday to sunday) or month of type_date containing day."""
+    if type_date == HYDROCAPT_TYPE_DATE_DAY:
+        return day, day
+    if type_date == HYDROCAPT_TYPE_DATE_WEEK:
+        start = day - timedelta(days=day.weekday())
+        return start, start + timedelta(days=6)
+    if type_date == HYDROCAPT_TYPE_DATE_MONTH:
+        start = day.replace(day=1)
+        next_month = (start + timedelta(days=32)).replace(day=1)
+        return start, next_month - timedelta(days=1)
+    raise HydrocaptError(f"Unknown type_date {type_date}")
+
+
+#the request types tried by the daily plans, on a tie the first one is chosen
+_PLAN_TYPE_DATES = (HYDROCAPT_TYPE_DATE_DAY, HYDROCAPT_TYPE_DATE_WEEK, HYDROCAPT_TYPE_DATE_MONTH)
+
+
+def _iter_period_requests(start: date, end: date) -> Iterator[HydrocaptHistoryRequest]:
+    count = (end - start).days + 1
+    # cost[i]: (requests, days downloaded) of the best plan covering the days from start + i to end,
+    # choice[i]: the type_date of its first request
+    cost = [(0, 0)] * (count + 1)
+    choice = [HYDROCAPT_TYPE_DATE_DAY] * count
+    for i in range(count - 1, -1, -1):
+        day = start + timedelta(days=i)
+        best = None
+        for type_date in _PLAN_TYPE_DATES:
+            period_start, period_end = get_period(type_date, day)
+            following = cost[min(count, (period_end - start).days + 1)]
+            candidate = (following[0] + 1, following[1] + (period_end - period_start).days + 1)
+            if best is None or candidate < best:
+                best = candidate
+                choice[i] = type_date
+        cost[i] = best
+
+    i = 0
+    while i < count:
+        period_start, period_end = get_period(choice[i], start + timedelta(days=i))
+        yield HydrocaptHistoryRequest(choice[i], period_start, period_end)
+        i = (period_end - start).days + 1
+
+
+def plan_history_requests(start: Union[date, datetime, str], end: Union[date, datetime, str],
+                          resolution: str = HYDROCAPT_RESOLUTION_HOUR) -> Iterator[HydrocaptHistoryRequest]:
+    """Iterate over the fewest requests covering the days from start to end included, in chronological order.
+
+    Only the day requests have hourly values; at a daily resolution a month or a week request
+    replaces up to 31 or 7 of them. Between plans of the same number of requests, the one
+    downloading the fewest days is chosen. The requests may cover days outside the range, and
+    overlap by a few days when a week is across two months.
+
+    The hourly requests are made one at a time. The daily plan is computed on the first
+    iteration and keeps two small entries per day of the range, about 1 MB for 30 years.
+    """
+    start = to_date(start)
+    end = to_date(end)
+    if resolution == HYDROCAPT_RESOLUTION_HOUR:
+        return (HydrocaptHistoryRequest(HYDROCAPT_TYPE_DATE_DAY, day, day) for day in iter_days(start, end))
+    if resolution != HYDROCAPT_RESOLUTION_DAY:
+        raise HydrocaptError(f"Unknown resolution {resolution}")
+    return _iter_period_requests(start, end)
+
+
+def _to_float(value) -> Optional[float]:
+    if value is None or value in HYDROCAPT_MEASURE_BAD_VALUES:
+        return None
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def parse_history_day(content: Dict[str, Any], day: date) -> List[HydrocaptHistoryRecord]:
+    """Decode a getJsonValues type_date=day answer into its hourly records.
+
+    The hours where no measure at all was reported (the end of the current day) are skipped.
+    The 25th slot of the day is the next midnight, it is left to the next day.
+
+    Args:
+        content: the decoded JSON answer
+        day: the requested day, used when the answer has no DATE record
+    """
+    columns = {}
+    dates = None
+    for r in content.get("records", []):
+        cur_c = r.get("typeInfo")
+        if cur_c in HYDROCAPT_MEASURE_TYPES:
+            columns[HYDROCAPT_MEASURE_TYPES[cur_c]] = r.get("values", [])
+        elif cur_c == "DATE":
+            dates = r.get("values")
+
+    parsed_dates = {}
+    records = []
+    for hour in range(24):
+        vals = {}
+        for name, values in columns.items():
+            vals[name] = _to_float(values[hour]) if hour < len(values) else None
+
+        if all(v is None for v in vals.values()):
+            continue
+
+        day_str = dates[hour] if dates is not None and hour < len(dates) else None
+        if day_str is None:
+            day_start = datetime(day.year, day.month, day.day)
+        else:
+            day_start = parsed_dates.get(day_str)
+            if day_start is None:
+                day_start = parse_date(day_str)
+                parsed_dates[day_str] = day_start
+
+        records.append(HydrocaptHistoryRecord(
+            day_start + timedelta(hours=hour),
+            vals.get("water_temperature"),
+            vals.get("technical_room_temperature"),
+            vals.get("ph"),
+            vals.get("redox"),
+            vals.get("conductivity"),
+        ))
+
+    return records
+
+
+def parse_day_series(content: Dict[str, Any], day: date) -> HydrocaptDaySeries:
+    """Decode a getJsonValues type_date=day answer into its hourly series and latest measures, in one pass.
+
+    All the slots are kept, the 25th being the next midnight, the series shorter than the
+    others are padded with NaN.
+
+    Args:
+        content: the decoded JSON answer
+        day: the requested day, used when the answer has no DATE record
+
+    Raises:
+        HydrocaptError: when the answer has no records
+    """
+    records = content.get("records", [])
+    if len(records) == 0:
+        raise HydrocaptError("No data records from pool")
+
+    values = {}
+    latest = {}
+    # the time of the measures is the one of the latest pH
+    latest_slot = 0
+    dates = None
+    for r in records:
+        cur_c = r.get("typeInfo")
+        if cur_c in HYDROCAPT_MEASURE_TYPES:
+            try:
+                column = [_NAN if v in HYDROCAPT_MEASURE_BAD_VALUES else float(v) for v in r.get("values", [])]
+            except (TypeError, ValueError):
+                column = [_NAN if f is None else f for f in map(_to_float, r.get("values", []))]
+            last = len(column) - 1
+            while last >= 0 and column[last] != column[last]:
+                last -= 1
+            values[HYDROCAPT_MEASURE_TYPES[cur_c]] = column
+            # -1 when the measure has no valid value at all
+            latest[HYDROCAPT_MEASURE_TYPES[cur_c]] = column[last] if last >= 0 else -1.0
+            if cur_c == "PH" and last >= 0:
+                latest_slot = last
+        elif cur_c == "DATE":
+            dates = r.get("values")
+
+    count = max([len(c) for c in values.values()] + [len(dates) if dates is not None else 0])
+    for column in values.values():
+        if len(column) < count:
+            column.extend([_NAN] * (count - len(column)))
+
+    day_start = datetime(day.year, day.month, day.day)
+    parsed_dates = {}
+    times = []
+    for slot in range(count):
+        day_str = dates[slot] if dates is not None and slot < len(dates) else None
+        slot_day = day_start
+        if day_str is not None:
+            slot_day = parsed_dates.get(day_str)
+            if slot_day is None:
+                slot_day = parse_date(day_str)
+                parsed_dates[day_str] = slot_day
+        times.append(slot_day + _HOURS[slot] if slot < len(_HOURS) else slot_day + timedelta(hours=slot))
+
+    latest["date_time"] = times[latest_slot] if count > 0 else day_start
+
+    return HydrocaptDaySeries(day, times, values, latest)
+
+
+def _mean(values: Iterable[Optional[float]]) -> Optional[float]:
+    valid = [v for v in values if v is not None]
+    if len(valid) == 0:
+        return None
+    return sum(valid) / len(valid)
+
+
+def parse_history_period(content: Dict[str, Any], request: HydrocaptHistoryRequest) -> List[HydrocaptHistoryRecord]:
+    """Decode a getJsonValues answer into one record per day, at midnight.
+
+    The week and month answers have one value per day. The hourly values of a day answer are
+    averaged, its 25th slot (the next midnight) left out. The days without any measure are skipped.
+    """
+    if request.type_date == HYDROCAPT_TYPE_DATE_DAY:
+        hours = parse_history_day(content, request.start)
+        if len(hours) == 0:
+            return []
+        day_start = datetime(request.start.year, request.start.month, request.start.day)
+        return [HydrocaptHistoryRecord(day_start, *(_mean(values) for values in list(zip(*hours))[1:]))]
+
+    columns = {}
+    dates = None
+    for r in content.get("records", []):
+        cur_c = r.get("typeInfo")
+        if cur_c in HYDROCAPT_MEASURE_TYPES:
+            columns[HYDROCAPT_MEASURE_TYPES[cur_c]] = r.get("values", [])
+        elif cur_c == "DATE":
+            dates = r.get("values")
+
+    count = max([len(c) for c in columns.values()] + [len(dates) if dates is not None else 0])
+    records = []
+    for slot in range(count):
+        vals = {name: _to_float(values[slot]) if slot < len(values) else None for name, values in columns.items()}
+        if all(v is None for v in vals.values()):
+            continue
+
+        day_str = dates[slot] if dates is not None and slot < len(dates) else None
+        if day_str is None:
+            day_start = datetime(request.start.year, request.start.month, request.start.day) + timedelta(days=slot)
+        else:
+            day_start = parse_date(day_str)
+
+        records.append(HydrocaptHistoryRecord(
+            day_start,
+            vals.get("water_temperature"),
+            vals.get("technical_room_temperature"),
+            vals.get("ph"),
+            vals.get("redox"),
+            vals.get("conductivity"),
+        ))
+
+    return records
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+"""On disk cache of the getJsonValues day answers, a finished day never changes and is only fetched once."""
+import json
+import os
+import tempfile
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+
+from .history import get_period
+from .history import iter_days
+
+from .const import HYDROCAPT_HISTORY_SETTLE_DELAY
+from .const import HYDROCAPT_TYPE_DATE_DAY
+from .const import HYDROCAPT_MEASURE_TYPES
+from .const import HYDROCAPT_MEASURE_BAD_VALUES
+
+
+def _has_measures(content: Dict[str, Any]) -> bool:
+    for r in content.get("records", []):
+        if r.get("typeInfo") in HYDROCAPT_MEASURE_TYPES:
+            if any(v not in HYDROCAPT_MEASURE_BAD_VALUES for v in r.get("values", [])):
+                return True
+    return False
+
+
+class HydrocaptHistoryCache(object):
+    """Keep the history answers in one JSON file per pool serial and day.
+
+    Only a day fetched once it is over (plus a settle delay for the last hour to be uploaded by
+    the pool) is stored, and then always answered from the cache, so an interrupted backfill
+    resumes where it stopped. An answer without any measure is not stored: the cloud may fill
+    the day later. The week and month answers are kept the same way, under the first day of
+    their period.
+    """
+
+    def __init__(self, directory: str, settle_delay: timedelta = HYDROCAPT_HISTORY_SETTLE_DELAY) -> None:
+        """Initialize the cache.
+
+        Args:
+            directory: where to store the days, created if needed
+            settle_delay: time after the end of a day before its values are considered final
+        """
+        self.directory = directory
+        self.settle_delay = settle_delay
+
+    def _day_path(self, serial: int, day: date, type_date: str = HYDROCAPT_TYPE_DATE_DAY) -> str:
+        if type_date == HYDROCAPT_TYPE_DATE_DAY:
+            return os.path.join(self.directory, str(serial), f"{day.isoformat()}.json")
+        return os.path.join(self.directory, str(serial), f"{day.isoformat()}.{type_date}.json")
+
+    def _read(self, serial: int, day: date, type_date: str = HYDROCAPT_TYPE_DATE_DAY) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._day_path(serial, day, type_date), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(entry, dict) or not isinstance(entry.get("content"), dict):
+            return None
+        return entry
+
+    def get(self, serial: int, day: date, type_date: str = HYDROCAPT_TYPE_DATE_DAY) -> Optional[Dict[str, Any]]:
+        """Return the stored answer of a complete day, or week or month starting on day, None if it has to be fetched."""
+        entry = self._read(serial, day, type_date)
+        if entry is None or entry.get("complete") is not True:
+            return None
+        return entry["content"]
+
+    def is_complete(self, serial: int, day: date) -> bool:
+        return self.get(serial, day) is not None
+
+    def put(self, serial: int, day: date, content: Dict[str, Any], fetched_at: Optional[datetime] = None,
+            type_date: str = HYDROCAPT_TYPE_DATE_DAY) -> bool:
+        """Store the answer of a day.
+
+        Args:
+            serial: the pool serial
+            day: the day of the answer, the first day of its period for a week or a month
+            content: the decoded getJsonValues answer
+            fetched_at: pool local time of the request, defaults to now
+            type_date: the period of the answer
+
+        Returns:
+            True if the day is complete and was stored, it won't be fetched again
+        """
+        if fetched_at is None:
+            fetched_at = datetime.now()
+        last_day = get_period(type_date, day)[1]
+        end_of_day = datetime(last_day.year, last_day.month, last_day.day) + timedelta(days=1)
+        if fetched_at < end_of_day + self.settle_delay or not _has_measures(content):
+            return False
+
+        path = self._day_path(serial, day, type_date)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(prefix=".hydrocapt-", dir=directory)
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"complete": True, "content": content}, f)
+            os.replace(tmp_path, path)
+        except:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        return True
+
+    def missing_days(self, serial: int, start, end) -> List[date]:
+        """The days between start and end (included) that still have to be fetched."""
+        return [day for day in iter_days(start, end) if not self.is_complete(serial, day)]
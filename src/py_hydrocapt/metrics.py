@@ -0,0 +1,295 @@
+# -*- coding: utf-8 -*-
+"""Request level metrics and hooks of the Hydrocapt clients.
+
+A HydrocaptMetrics given to the clients (or their sessions, or a fleet) records for each endpoint
+the latency histogram, the bytes transferred and the errors, plus the logins, the retries, the
+confirmation polls of the saves and the time spent decoding the answers. It can be read as a dict
+with snapshot() or as Prometheus text with to_prometheus(), and callbacks can follow each request.
+"""
+import threading
+import time
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+from typing import Sequence
+from urllib.parse import urlparse
+
+from .const import HYDROCAPT_METRICS_LATENCY_BUCKETS
+from .const import HYDROCAPT_METRICS_PARSE_BUCKETS
+
+
+class HydrocaptRequestEvent(NamedTuple):
+    """One HTTP request, duration and status are None in the start events, started is a time.perf_counter()."""
+
+    method: str
+    endpoint: str
+    url: str
+    started: float
+    duration: Optional[float]
+    status: Optional[int]
+    bytes_sent: int
+    bytes_received: int
+    error: Optional[BaseException]
+
+
+def get_endpoint(url: str) -> str:
+    """Short name of an endpoint, e.g. ajaxCommands/get."""
+    path = urlparse(url).path
+    if path.startswith("/pool/"):
+        return path[len("/pool/"):]
+    return path.lstrip("/")
+
+
+class _Histogram(object):
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]:
+            i += 1
+        self.counts[i] += 1
+        self.total += value
+        self.count += 1
+
+    def cumulative(self) -> List[int]:
+        res = []
+        acc = 0
+        for c in self.counts:
+            acc += c
+            res.append(acc)
+        return res
+
+
+class _EndpointStats(object):
+
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.requests = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.retries = 0
+        self.latency = _Histogram(buckets)
+
+
+class HydrocaptMetrics(object):
+    """Thread safe counters and histograms, shared by all the sessions and clients it is given to."""
+
+    def __init__(self, latency_buckets: Sequence[float] = HYDROCAPT_METRICS_LATENCY_BUCKETS,
+                 parse_buckets: Sequence[float] = HYDROCAPT_METRICS_PARSE_BUCKETS) -> None:
+        """Initialize the metrics.
+
+        Args:
+            latency_buckets: upper bounds in seconds of the requests latency histograms buckets
+            parse_buckets: upper bounds in seconds of the decoding time histograms buckets
+        """
+        self.latency_buckets = tuple(sorted(latency_buckets))
+        self.parse_buckets = tuple(sorted(parse_buckets))
+        self._lock = threading.Lock()
+        self._on_start: List[Callable[[HydrocaptRequestEvent], None]] = []
+        self._on_end: List[Callable[[HydrocaptRequestEvent], None]] = []
+        self.reset()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._endpoints: Dict[str, _EndpointStats] = {}
+            self._logins = 0
+            self._relogins = 0
+            self._confirmations = 0
+            self._confirmations_failed = 0
+            self._confirmation_polls = 0
+            self._confirmation_seconds = 0.0
+            self._parse: Dict[str, _Histogram] = {}
+            self._coalesced: Dict[str, int] = {}
+            self._rate_limited = 0
+            self._rate_limited_seconds = 0.0
+            self._circuit_rejections = 0
+
+    def subscribe(self, on_request_start: Optional[Callable[[HydrocaptRequestEvent], None]] = None,
+                  on_request_end: Optional[Callable[[HydrocaptRequestEvent], None]] = None) -> Callable[[], None]:
+        """Call on_request_start before and on_request_end after each HTTP request.
+
+        The callbacks run on the requesting thread or event loop and must be quick, their exceptions are ignored.
+
+        Returns:
+            a function removing the callbacks
+        """
+        with self._lock:
+            if on_request_start is not None:
+                self._on_start = self._on_start + [on_request_start]
+            if on_request_end is not None:
+                self._on_end = self._on_end + [on_request_end]
+
+        def unsubscribe():
+            with self._lock:
+                self._on_start = [c for c in self._on_start if c is not on_request_start]
+                self._on_end = [c for c in self._on_end if c is not on_request_end]
+
+        return unsubscribe
+
+    def _notify(self, callbacks, event: HydrocaptRequestEvent) -> None:
+        for c in callbacks:
+            try:
+                c(event)
+            except Exception:
+                # a broken hook must not break the requests
+                pass
+
+    def _get_endpoint_stats(self, endpoint: str) -> _EndpointStats:
+        stats = self._endpoints.get(endpoint)
+        if stats is None:
+            stats = _EndpointStats(self.latency_buckets)
+            self._endpoints[endpoint] = stats
+        return stats
+
+    def request_started(self, method: str, url: str, bytes_sent: int = 0) -> HydrocaptRequestEvent:
+        """Called by the sessions before a request, returns the event to give to request_ended."""
+        event = HydrocaptRequestEvent(method, get_endpoint(url), url, time.perf_counter(), None, None, bytes_sent, 0, None)
+        self._notify(self._on_start, event)
+        return event
+
+    def request_ended(self, event: HydrocaptRequestEvent, status: Optional[int] = None, bytes_received: int = 0,
+                      error: Optional[BaseException] = None, bytes_sent: Optional[int] = None) -> None:
+        """Called by the sessions after a request, successful or not."""
+        duration = time.perf_counter() - event.started
+        if bytes_sent is None:
+            bytes_sent = event.bytes_sent
+        event = event._replace(duration=duration, status=status, bytes_sent=bytes_sent, bytes_received=bytes_received, error=error)
+
+        with self._lock:
+            stats = self._get_endpoint_stats(event.endpoint)
+            stats.requests += 1
+            if error is not None or (status is not None and status >= 400):
+                stats.errors += 1
+            stats.bytes_sent += bytes_sent
+            stats.bytes_received += bytes_received
+            stats.latency.observe(duration)
+
+        self._notify(self._on_end, event)
+
+    def record_retry(self, url: str) -> None:
+        """A request is sent again after a failure."""
+        with self._lock:
+            self._get_endpoint_stats(get_endpoint(url)).retries += 1
+
+    def record_login(self, relogin: bool) -> None:
+        """A login was done, relogin when it replaced a session that stopped working."""
+        with self._lock:
+            self._logins += 1
+            if relogin:
+                self._relogins += 1
+
+    def record_confirmation(self, confirmed: bool, polls: int, elapsed: float) -> None:
+        """A save was confirmed, or not, after polls reads of the pool state."""
+        with self._lock:
+            self._confirmations += 1
+            if not confirmed:
+                self._confirmations_failed += 1
+            self._confirmation_polls += polls
+            self._confirmation_seconds += elapsed
+
+    def record_coalesced(self, resource: str) -> None:
+        """A read of resource waited for the same read already running instead of sending its own request."""
+        with self._lock:
+            self._coalesced[resource] = self._coalesced.get(resource, 0) + 1
+
+    def record_rate_limited(self, delay: float) -> None:
+        """A request waited delay seconds for the rate limiter."""
+        with self._lock:
+            self._rate_limited += 1
+            self._rate_limited_seconds += delay
+
+    def record_circuit_rejection(self) -> None:
+        """A request was not sent because the circuit breaker was open."""
+        with self._lock:
+            self._circuit_rejections += 1
+
+    def record_parse(self, kind: str, duration: float) -> None:
+        """Time spent decoding an answer of a kind (commands, consigns, measures, alarms, history)."""
+        with self._lock:
+            h = self._parse.get(kind)
+            if h is None:
+                h = _Histogram(self.parse_buckets)
+                self._parse[kind] = h
+            h.observe(duration)
+
+    def snapshot(self) -> Dict[str, Any]:
+        """A copy of all the metrics, as plain dicts, lists and numbers."""
+        with self._lock:
+            endpoints = {}
+            for name, s in self._endpoints.items():
+                endpoints[name] = {
+                    "requests": s.requests,
+                    "errors": s.errors,
+                    "retries": s.retries,
+                    "bytes_sent": s.bytes_sent,
+                    "bytes_received": s.bytes_received,
+                    "latency_seconds_total": s.latency.total,
+                    "latency_buckets": dict(zip(list(self.latency_buckets) + [float("inf")], s.latency.cumulative())),
+                }
+            return {
+                "endpoints": endpoints,
+                "logins": self._logins,
+                "relogins": self._relogins,
+                "confirmations": self._confirmations,
+                "confirmations_failed": self._confirmations_failed,
+                "confirmation_polls": self._confirmation_polls,
+                "confirmation_seconds_total": self._confirmation_seconds,
+                "coalesced": dict(self._coalesced),
+                "rate_limited": self._rate_limited,
+                "rate_limited_seconds_total": self._rate_limited_seconds,
+                "circuit_rejections": self._circuit_rejections,
+                "parse": {k: {"count": h.count, "seconds_total": h.total} for k, h in self._parse.items()},
+            }
+
+    def to_prometheus(self, prefix: str = "hydrocapt") -> str:
+        """The metrics in the Prometheus text exposition format."""
+        with self._lock:
+            lines = []
+
+            def add_histogram(name, help_text, label, histograms):
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} histogram")
+                for key, h in histograms:
+                    for le, c in zip(list(h.buckets) + ["+Inf"], h.cumulative()):
+                        lines.append(f'{prefix}_{name}_bucket{{{label}="{key}",le="{le}"}} {c}')
+                    lines.append(f'{prefix}_{name}_sum{{{label}="{key}"}} {h.total}')
+                    lines.append(f'{prefix}_{name}_count{{{label}="{key}"}} {h.count}')
+
+            def add_counter(name, help_text, values):
+                lines.append(f"# HELP {prefix}_{name} {help_text}")
+                lines.append(f"# TYPE {prefix}_{name} counter")
+                for labels, v in values:
+                    lines.append(f"{prefix}_{name}{labels} {v}")
+
+            endpoints = sorted(self._endpoints.items())
+            add_histogram("request_duration_seconds", "HTTP request latency.", "endpoint", [(k, s.latency) for k, s in endpoints])
+            add_counter("request_errors_total", "HTTP requests failed or answered with an error status.",
+                        [(f'{{endpoint="{k}"}}', s.errors) for k, s in endpoints])
+            add_counter("request_retries_total", "HTTP requests sent again after a failure.",
+                        [(f'{{endpoint="{k}"}}', s.retries) for k, s in endpoints])
+            add_counter("sent_bytes_total", "Bytes of the request bodies.",
+                        [(f'{{endpoint="{k}"}}', s.bytes_sent) for k, s in endpoints])
+            add_counter("received_bytes_total", "Bytes of the answer bodies.",
+                        [(f'{{endpoint="{k}"}}', s.bytes_received) for k, s in endpoints])
+            add_counter("logins_total", "Logins, first ones and re-logins.", [("", self._logins)])
+            add_counter("relogins_total", "Logins replacing a session that stopped working.", [("", self._relogins)])
+            add_counter("confirmations_total", "Saves waiting for the pool to apply them.", [("", self._confirmations)])
+            add_counter("confirmations_failed_total", "Saves not confirmed before the deadline.", [("", self._confirmations_failed)])
+            add_counter("confirmation_polls_total", "Reads of the pool state done to confirm the saves.", [("", self._confirmation_polls)])
+            add_counter("confirmation_seconds_total", "Time spent confirming the saves.", [("", self._confirmation_seconds)])
+            add_counter("coalesced_reads_total", "Reads served by the same read already running.",
+                        [(f'{{resource="{k}"}}', v) for k, v in sorted(self._coalesced.items())])
+            add_counter("rate_limited_total", "Requests delayed by the rate limiter.", [("", self._rate_limited)])
+            add_counter("rate_limited_seconds_total", "Time the requests waited for the rate limiter.", [("", self._rate_limited_seconds)])
+            add_counter("circuit_rejections_total", "Requests not sent because the circuit breaker was open.", [("", self._circuit_rejections)])
+            add_histogram("parse_duration_seconds", "Time spent decoding the answers.", "kind", sorted(self._parse.items()))
+
+            return "\n".join(lines) + "\n"
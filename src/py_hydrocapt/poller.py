@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Background refresh of a client, following the hourly cadence of the measures.
+
+The commands and consigns are read at fixed intervals. The pool only uploads its measures once
+an hour, so they are read a little after the next hourly sample is expected, and more often
+only while it is late, instead of at a fixed interval in between. Register on client.changes
+to be told about the new values.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from .const import HYDROCAPT_RESOURCE_COMMANDS
+from .const import HYDROCAPT_RESOURCE_CONSIGNS
+from .const import HYDROCAPT_RESOURCE_MEASURES
+from .const import HYDROCAPT_POLLER_COMMANDS_INTERVAL
+from .const import HYDROCAPT_POLLER_CONSIGNS_INTERVAL
+from .const import HYDROCAPT_POLLER_MEASURES_SETTLE_DELAY
+from .const import HYDROCAPT_POLLER_MEASURES_JITTER
+from .const import HYDROCAPT_POLLER_MEASURES_CATCH_UP
+from .const import HYDROCAPT_POLLER_ERROR_DELAY
+
+_LOGGER = logging.getLogger(__name__)
+
+#never wait more than this between two reads of the measures, in case the pool and our clocks disagree
+_MEASURES_MAX_DELAY = 3600.0
+
+
+class _HydrocaptPollSchedule(object):
+    """When to read each resource next, shared by the thread and asyncio pollers."""
+
+    def __init__(self, commands_interval: Optional[float], consigns_interval: Optional[float], measures: bool,
+                 settle_delay: float, jitter: float, catch_up: float, error_delay: float,
+                 clock: Callable[[], float] = time.monotonic) -> None:
+        self.intervals = {
+            HYDROCAPT_RESOURCE_COMMANDS: commands_interval,
+            HYDROCAPT_RESOURCE_CONSIGNS: consigns_interval,
+        }
+        self.settle_delay = settle_delay
+        self.jitter = jitter
+        self.catch_up = catch_up
+        self.error_delay = error_delay
+        self.clock = clock
+        self.last_sample: Optional[datetime] = None
+        self._late_polls = 0
+        self._random = random.Random()
+
+        now = clock()
+        self.next_poll: Dict[str, float] = {r: now for r, i in self.intervals.items() if i is not None}
+        if measures:
+            self.next_poll[HYDROCAPT_RESOURCE_MEASURES] = now
+
+    def get_next(self) -> Tuple[Optional[str], float]:
+        """The next resource to read and the seconds to wait before, None if nothing is polled."""
+        if len(self.next_poll) == 0:
+            return None, 0.0
+        resource = min(self.next_poll, key=self.next_poll.get)
+        return resource, max(0.0, self.next_poll[resource] - self.clock())
+
+    def measures_delay(self, sample: Optional[datetime], now: datetime) -> float:
+        """Seconds to wait before reading the measures again, after a read that returned sample."""
+        if sample is not None and (self.last_sample is None or sample > self.last_sample):
+            self.last_sample = sample
+            self._late_polls = 0
+            expected = sample + timedelta(hours=1, seconds=self.settle_delay)
+            delay = (expected - now).total_seconds() + self._random.uniform(0, self.jitter)
+            if delay > 0:
+                return min(delay, _MEASURES_MAX_DELAY)
+
+        # the next sample is late: catch up, backing off if it stays late (pool offline)
+        delay = min(self.catch_up * (2 ** self._late_polls), _MEASURES_MAX_DELAY)
+        self._late_polls += 1
+        return delay + self._random.uniform(0, self.jitter)
+
+    def done(self, resource: str, values: Dict[str, Any]) -> None:
+        if resource == HYDROCAPT_RESOURCE_MEASURES:
+            delay = self.measures_delay(values.get("date_time"), datetime.now())
+        else:
+            delay = self.intervals[resource]
+        self.next_poll[resource] = self.clock() + delay
+
+    def failed(self, resource: str) -> None:
+        self.next_poll[resource] = self.clock() + self.error_delay
+
+
+def _get_read(client, resource: str):
+    if resource == HYDROCAPT_RESOURCE_COMMANDS:
+        return client.get_commands_current_states
+    if resource == HYDROCAPT_RESOURCE_CONSIGNS:
+        return client.get_current_consigns
+    return client.get_pool_measure_latest
+
+
+def _report_error(on_error, resource: str, error: Exception) -> None:
+    if on_error is None:
+        return
+    try:
+        on_error(resource, error)
+    except Exception:
+        # a broken handler must not stop the polling
+        _LOGGER.exception("on_error handler of the poller failed for %s", resource)
+
+
+class HydrocaptPoller(object):
+    """Refresh a HydrocaptClient from a background thread."""
+
+    def __init__(self, client, commands_interval: Optional[float] = HYDROCAPT_POLLER_COMMANDS_INTERVAL,
+                 consigns_interval: Optional[float] = HYDROCAPT_POLLER_CONSIGNS_INTERVAL, measures: bool = True,
+                 measures_settle_delay: float = HYDROCAPT_POLLER_MEASURES_SETTLE_DELAY,
+                 measures_jitter: float = HYDROCAPT_POLLER_MEASURES_JITTER,
+                 measures_catch_up: float = HYDROCAPT_POLLER_MEASURES_CATCH_UP,
+                 error_delay: float = HYDROCAPT_POLLER_ERROR_DELAY,
+                 on_error: Optional[Callable[[str, BaseException], None]] = None) -> None:
+        """Initialize the poller, start() runs it.
+
+        Args:
+            client: the HydrocaptClient to refresh
+            commands_interval: seconds between two reads of the commands, None to not read them
+            consigns_interval: seconds between two reads of the consigns, None to not read them
+            measures: read the measures around each expected hourly sample
+            measures_settle_delay: seconds after the end of an hour before its sample is expected on the server
+            measures_jitter: max random seconds added to the measures reads, to spread a fleet of pollers
+            measures_catch_up: seconds between reads while an expected sample is late, doubled at each miss
+            error_delay: seconds before reading a resource again after an error
+            on_error: called with the resource and the exception when a read fails, its own exceptions are logged and ignored
+        """
+        self.client = client
+        self.on_error = on_error
+        self._schedule = _HydrocaptPollSchedule(commands_interval, consigns_interval, measures, measures_settle_delay,
+                                                measures_jitter, measures_catch_up, error_delay)
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def last_sample(self) -> Optional[datetime]:
+        """Time of the latest hourly measures read."""
+        return self._schedule.last_sample
+
+    def start(self) -> "HydrocaptPoller":
+        if self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="hydrocapt-poller", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None) -> None:
+        """Stop polling, a read in progress is finished first."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            resource, delay = self._schedule.get_next()
+            if resource is None or self._stop.wait(delay):
+                return
+            try:
+                values = _get_read(self.client, resource)(force_refresh=True)
+            except Exception as e:
+                self._schedule.failed(resource)
+                _report_error(self.on_error, resource, e)
+                continue
+            self._schedule.done(resource, values)
+
+
+class AsyncHydrocaptPoller(object):
+    """Refresh an AsyncHydrocaptClient from an asyncio task, see HydrocaptPoller for the arguments."""
+
+    def __init__(self, client, commands_interval: Optional[float] = HYDROCAPT_POLLER_COMMANDS_INTERVAL,
+                 consigns_interval: Optional[float] = HYDROCAPT_POLLER_CONSIGNS_INTERVAL, measures: bool = True,
+                 measures_settle_delay: float = HYDROCAPT_POLLER_MEASURES_SETTLE_DELAY,
+                 measures_jitter: float = HYDROCAPT_POLLER_MEASURES_JITTER,
+                 measures_catch_up: float = HYDROCAPT_POLLER_MEASURES_CATCH_UP,
+                 error_delay: float = HYDROCAPT_POLLER_ERROR_DELAY,
+                 on_error: Optional[Callable[[str, BaseException], None]] = None) -> None:
+        self.client = client
+        self.on_error = on_error
+        self._schedule = _HydrocaptPollSchedule(commands_interval, consigns_interval, measures, measures_settle_delay,
+                                                measures_jitter, measures_catch_up, error_delay)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def last_sample(self) -> Optional[datetime]:
+        """Time of the latest hourly measures read."""
+        return self._schedule.last_sample
+
+    def start(self) -> "AsyncHydrocaptPoller":
+        """Start polling, must be called from the event loop of the client."""
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
+        return self
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def __aenter__(self):
+        return self.start()
+
+    async def __aexit__(self, *args):
+        await self.stop()
+
+    async def _run(self) -> None:
+        while True:
+            resource, delay = self._schedule.get_next()
+            if resource is None:
+                return
+            await asyncio.sleep(delay)
+            try:
+                values = await _get_read(self.client, resource)(force_refresh=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._schedule.failed(resource)
+                _report_error(self.on_error, resource, e)
+                continue
+            self._schedule.done(resource, values)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""How the sessions handle the failed requests.
+
+An expired session is detected explicitly (see is_session_expired) and only then renewed by a new
+login. The transport errors (connection, timeout) and the server errors (5xx, 429) are sent again
+after a backoff, without logging in again, since a new session would not fix them.
+"""
+import random
+from typing import Optional
+from urllib.parse import urlparse
+
+from .const import HYDROCAPT_RETRY_MAX_RELOGINS
+from .const import HYDROCAPT_RETRY_TRANSPORT_RETRIES
+from .const import HYDROCAPT_RETRY_FIRST_DELAY
+from .const import HYDROCAPT_RETRY_BACKOFF
+from .const import HYDROCAPT_RETRY_MAX_DELAY
+from .const import HYDROCAPT_RETRY_JITTER
+from .const import HYDROCAPT_SESSION_EXPIRED_STATUS
+from .const import HYDROCAPT_SESSION_EXPIRED_PATH
+from .const import HYDROCAPT_SESSION_EXPIRED_MARKERS
+
+#the markers are only looked for at the start of the answers, the expired session answers are short
+_MARKERS_PREFIX_LENGTH = 256
+
+
+def is_session_expired(status: int, url: str, content: bytes) -> bool:
+    """Tell if an answer means that the session is not authenticated anymore.
+
+    Args:
+        status: the HTTP status
+        url: the final url, after the redirects
+        content: the body
+    """
+    if status in HYDROCAPT_SESSION_EXPIRED_STATUS:
+        return True
+    if urlparse(url).path.startswith(HYDROCAPT_SESSION_EXPIRED_PATH):
+        return True
+    head = content[:_MARKERS_PREFIX_LENGTH].lstrip()
+    return any(m in head for m in HYDROCAPT_SESSION_EXPIRED_MARKERS)
+
+
+class HydrocaptRetryPolicy(object):
+    """Caps and backoff of the retries of a request."""
+
+    def __init__(self, max_relogins: int = HYDROCAPT_RETRY_MAX_RELOGINS, transport_retries: int = HYDROCAPT_RETRY_TRANSPORT_RETRIES,
+                 first_delay: float = HYDROCAPT_RETRY_FIRST_DELAY, backoff: float = HYDROCAPT_RETRY_BACKOFF,
+                 max_delay: float = HYDROCAPT_RETRY_MAX_DELAY, jitter: float = HYDROCAPT_RETRY_JITTER) -> None:
+        """Initialize the policy.
+
+        Args:
+            max_relogins: max logins done for one request whose session expired
+            transport_retries: max times a request is sent again after a transport or server error
+            first_delay: seconds to wait before the first retry
+            backoff: factor applied to the wait between two retries
+            max_delay: max seconds between two retries
+            jitter: random part of the waits, as a fraction of them
+        """
+        self.max_relogins = max_relogins
+        self.transport_retries = transport_retries
+        self.first_delay = first_delay
+        self.backoff = backoff
+        self.max_delay = max_delay
+        self.jitter = jitter
+
+    def get_transport_delay(self, failures: int) -> Optional[float]:
+        """Seconds to wait before sending again a request that failed failures times, None to give up."""
+        if failures > self.transport_retries:
+            return None
+        delay = min(self.first_delay * self.backoff ** (failures - 1), self.max_delay)
+        return delay * (1.0 + random.uniform(-self.jitter, self.jitter))
+
+
+HYDROCAPT_DEFAULT_RETRY_POLICY = HydrocaptRetryPolicy()
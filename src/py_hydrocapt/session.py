@@ -3,47 +3,223 @@
 #from urllib.parse import quote_plus
 
 
-import requests
-from requests import Session
+import threading
+import time
+from urllib.parse import urlparse
 
 from typing import Any
 from typing import Dict
 from typing import List
 from typing import Optional
+from typing import TYPE_CHECKING
 
-from .exceptions import HydrocaptError
-
-from lxml import html
+if TYPE_CHECKING:
+    from requests import Session
+    from requests.adapters import HTTPAdapter
 
+from .exceptions import HydrocaptError
+from .exceptions import HydrocaptAuthenticationError
+from .exceptions import HydrocaptTransportError
+from .exceptions import HydrocaptCircuitOpenError
+from .session_store import HydrocaptSessionStore
+from .metrics import HydrocaptMetrics
+from .metrics import get_endpoint
+from .retry import HydrocaptRetryPolicy
+from .retry import HYDROCAPT_DEFAULT_RETRY_POLICY
+from .retry import is_session_expired
+from .throttle import HydrocaptRateLimiter
+from .throttle import HydrocaptCircuitBreaker
+from .transport import HydrocaptHttpSettings
+from .transport import HYDROCAPT_DEFAULT_HTTP_SETTINGS
+from .deadline import check_wait
+from .deadline import get_timeout
+
+from .const import HYDROCAPT_BASE_URL
 from .const import HYDROCAPT_LOGIN_URL
 from .const import HYDROCAPT_DISCONNECT_URL
 from .const import HYDROCAPT_EDIT_POOL_OWN_URL
+from .const import HYDROCAPT_RETRY_STATUS
 
 class HydrocaptClientSession(object):
     """HTTP session manager for Hydrocapt api.
-    This session object allows to manage the authentication and re-authentication
+    This session object allows to manage the authentication and re-authentication,
+    it can be shared between threads: only one of them will log in again when needed.
+    A new login is only done when an answer shows that the session expired, the
+    transport errors are retried with a backoff, see HydrocaptRetryPolicy.
     """
 
 
-    def __init__(self, username: str, password: str, pool_internal_id :int = -1) -> None:
+    def __init__(self, username: str, password: str, pool_internal_id :int = -1, http_adapter: Optional["HTTPAdapter"] = None,
+                 session_store: Optional[HydrocaptSessionStore] = None, base_url: Optional[str] = None,
+                 metrics: Optional[HydrocaptMetrics] = None, retry_policy: Optional[HydrocaptRetryPolicy] = None,
+                 rate_limiter: Optional[HydrocaptRateLimiter] = None, circuit_breaker: Optional[HydrocaptCircuitBreaker] = None,
+                 http_settings: Optional[HydrocaptHttpSettings] = None) -> None:
         """Initialize and authenticate.
 
         Args:
             username: the hydrocapt registered user
             password: the hydrocapt user's password
+            pool_internal_id: the pool serial if already known, -1 to discover it at login
+            http_adapter: an optional requests adapter, to share its connection pools between sessions
+            session_store: an optional store to reuse the session of a previous process instead of logging in
+            base_url: an optional server to use instead of www.hydrocapt.fr, e.g. a local HydrocaptFakeServer
+            metrics: an optional HydrocaptMetrics recording the requests and logins of this session
+            retry_policy: caps and backoff of the retries, defaults to HydrocaptRetryPolicy()
+            rate_limiter: an optional HydrocaptRateLimiter, shared by the sessions toward the same host
+            circuit_breaker: an optional HydrocaptCircuitBreaker, shared by the sessions toward the same host
+            http_settings: timeout, connection pool, keep alive and compression, see HydrocaptHttpSettings
         """
 
         self.username = username
         self.password = password
-        self._session : Optional[Session] = None
+        self._session : Optional["Session"] = None
         self._pool_internal_id = pool_internal_id
+        self._http_adapter = http_adapter
+        self._session_store = session_store
+        self._generation = 0
+        # login generation of a session restored from the session store, None if not restored
+        self._restored_generation: Optional[int] = None
+        self._login_lock = threading.Lock()
+        self.base_url = base_url.rstrip("/") if base_url is not None else None
+        self.metrics = metrics
+        self.retry_policy = retry_policy if retry_policy is not None else HYDROCAPT_DEFAULT_RETRY_POLICY
+        self.rate_limiter = rate_limiter
+        self.circuit_breaker = circuit_breaker
+        self.http_settings = http_settings if http_settings is not None else HYDROCAPT_DEFAULT_HTTP_SETTINGS
+        # time.monotonic() of the last request sent, see _close_idle_connections
+        self._last_request: Optional[float] = None
+
+    def _url(self, url: str) -> str:
+        if self.base_url is None or not url.startswith(HYDROCAPT_BASE_URL):
+            return url
+        return self.base_url + url[len(HYDROCAPT_BASE_URL):]
+
+    def _send(self, session: "Session", method: str, url: str, **kwargs):
+        if self.metrics is None:
+            return session.request(method, url, **kwargs)
+
+        event = self.metrics.request_started(method, url)
+        try:
+            ret = session.request(method, url, **kwargs)
+        except BaseException as e:
+            self.metrics.request_ended(event, error=e)
+            raise
+        body = ret.request.body
+        self.metrics.request_ended(event, status=ret.status_code, bytes_received=len(ret.content),
+                                   bytes_sent=len(body) if body is not None else 0)
+        return ret
+
+    def _throttle(self, host: str) -> None:
+        """Check the circuit breaker then wait for the rate limiter, before sending a request to host.
 
+        A half open breaker lets this request through as its probe: it is given back if the wait fails,
+        like the rate limiter reservation.
+        """
+        if self.circuit_breaker is not None:
+            try:
+                self.circuit_breaker.before_request(host)
+            except HydrocaptCircuitOpenError:
+                if self.metrics is not None:
+                    self.metrics.record_circuit_rejection()
+                raise
+
+        if self.rate_limiter is not None:
+            delay = self.rate_limiter.reserve(host, self.username)
+            if delay > 0:
+                if self.metrics is not None:
+                    self.metrics.record_rate_limited(delay)
+                try:
+                    time.sleep(check_wait(delay, "rate limited"))
+                except BaseException:
+                    self.rate_limiter.cancel(host, self.username)
+                    if self.circuit_breaker is not None:
+                        self.circuit_breaker.record_cancelled(host)
+                    raise
+
+    def _close_idle_connections(self, session: "Session") -> None:
+        """Close the kept alive connections unused for keepalive_timeout, requests keeps them until the server does.
+
+        A connection the server already closed would fail the next request and cost a retry.
+        """
+        now = time.monotonic()
+        last, self._last_request = self._last_request, now
+        if last is not None and self.http_settings.keep_alive and now - last > self.http_settings.keepalive_timeout:
+            # the adapters stay mounted, the next request opens a new connection
+            session.close()
+
+    def _send_retrying(self, session: "Session", method: str, url: str, **kwargs):
+        """Send a request, again after a transport or server error, following the retry policy."""
+        from requests.exceptions import ConnectionError, Timeout
+
+        host = urlparse(url).netloc
+        breaker = self.circuit_breaker
+        failures = 0
+        while True:
+            self._throttle(host)
+            self._close_idle_connections(session)
+            try:
+                kwargs["timeout"] = get_timeout(self.http_settings.timeout, get_endpoint(url))
+                ret = self._send(session, method, url, **kwargs)
+            except (ConnectionError, Timeout) as e:
+                error = e
+            except BaseException:
+                if breaker is not None:
+                    breaker.record_cancelled(host)
+                raise
+            else:
+                if ret.status_code not in HYDROCAPT_RETRY_STATUS:
+                    if breaker is not None:
+                        breaker.record_success(host)
+                    return ret
+                error = HydrocaptTransportError(f"{get_endpoint(url)} answered {ret.status_code}")
+
+            if breaker is not None:
+                breaker.record_failure(host)
+            failures += 1
+            delay = self.retry_policy.get_transport_delay(failures)
+            if delay is None:
+                raise HydrocaptTransportError(f"{get_endpoint(url)} failed {failures} times") from error
+            if self.metrics is not None:
+                self.metrics.record_retry(url)
+            time.sleep(check_wait(delay, f"retrying {get_endpoint(url)}"))
+
+    def _create_requests_session(self) -> "Session":
+
+        # imported with the first session, the package itself loads faster without it
+        import requests
+        session_requests = requests.session()
+        session_requests.headers.update(self.http_settings.get_headers())
 
-    def _new_session(self) -> Session:
+        http_adapter = self._http_adapter
+        if http_adapter is None:
+            # the retries are done by the session, with its own policy
+            http_adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.http_settings.pool_maxsize, max_retries=0)
+        session_requests.mount("https://", http_adapter)
+        session_requests.mount("http://", http_adapter)
 
+        return session_requests
 
-        session_requests = requests.session()
+    def _restore_session(self) -> Optional["Session"]:
 
+        stored = self._session_store.load(self.username, self.base_url)
+        if stored is None:
+            return None
+
+        cookies, pool_id = stored
+        if self._pool_internal_id < 0:
+            if pool_id < 0:
+                return None
+            self._pool_internal_id = pool_id
+
+        session_requests = self._create_requests_session()
+        session_requests.cookies.update(cookies)
+
+        return session_requests
+
+    def _new_session(self) -> "Session":
+
+
+        session_requests = self._create_requests_session()
 
         #use quote, from urllib.parse import quote, or quote_plus here for the strings?
         payload = {
@@ -51,8 +227,10 @@ class HydrocaptClientSession(object):
             "pass": self.password,
         }
 
-        result = session_requests.post(
-            HYDROCAPT_LOGIN_URL,
+        result = self._send_retrying(
+            session_requests,
+            "POST",
+            self._url(HYDROCAPT_LOGIN_URL),
             data=payload,
             headers=dict(referer=HYDROCAPT_DISCONNECT_URL)
         )
@@ -62,13 +240,17 @@ class HydrocaptClientSession(object):
         if self._pool_internal_id < 0:
 
 
-            result_edit_pool = session_requests.get(
-                HYDROCAPT_EDIT_POOL_OWN_URL,
+            result_edit_pool = self._send_retrying(
+                session_requests,
+                "GET",
+                self._url(HYDROCAPT_EDIT_POOL_OWN_URL),
             )
 
             result_edit_pool.raise_for_status()
 
-            tree = html.fromstring(result_edit_pool.text)
+            # only needed to discover the pool id, not imported with the package
+            from lxml import html
+            tree = html.fromstring(result_edit_pool.content)
 
             try:
                 pool_id = int(list(set(tree.xpath("//input[@name='serial']/@value")))[0])
@@ -78,20 +260,95 @@ class HydrocaptClientSession(object):
 
             self._pool_internal_id = pool_id
 
+        if self._session_store is not None:
+            self._session_store.save(self.username, session_requests.cookies, self._pool_internal_id, self.base_url)
+
         return session_requests
 
+    def _login(self, failed_generation: Optional[int] = None) -> "Session":
+        """Log in once even if several threads ask for it at the same time.
+
+        Args:
+            failed_generation: the login generation a request failed with, None for a first login
+        """
+
+        with self._login_lock:
+            # an other thread may have already renewed the session while we were waiting
+            session = self._session
+            if session is not None and (failed_generation is None or failed_generation != self._generation):
+                return session
+
+            if session is None and self._session_store is not None:
+                # reuse the session of a previous run, we will log in again if the server rejects it
+                self._session = self._restore_session()
+                if self._session is not None:
+                    self._generation += 1
+                    self._restored_generation = self._generation
+                    return self._session
+
+            if failed_generation is not None and failed_generation == self._restored_generation:
+                # the server rejected the session of the previous run, don't restore it again
+                self._session_store.invalidate(self.username, self.base_url)
+                self._restored_generation = None
+
+            self._session = self._new_session()
+            self._generation += 1
+            if self.metrics is not None:
+                self.metrics.record_login(relogin=failed_generation is not None)
+            return self._session
+
+    @property
+    def generation(self) -> int:
+        """Counter incremented on each login, used to detect an already renewed session."""
+        return self._generation
+
+    def get_login_generation(self) -> int:
+        """Log in if not done yet and return the current login generation."""
+        if self._session is None:
+            self._login()
+        return self._generation
+
+    def reconnect(self, failed_generation: Optional[int] = None) -> None:
+        """Force a new login, unless the session was renewed since failed_generation."""
+        if failed_generation is None:
+            failed_generation = self._generation
+        self._login(failed_generation=failed_generation)
+
     def get_internal_pool_id(self):
 
         if self._pool_internal_id < 0 or self._session is None:
-            self._session = self._new_session()
+            self._login()
 
         return self._pool_internal_id
 
-    def post(self, url, data, headers=None):
-
-        if self._session is None:
-            self._session = self._new_session()
+    def _request(self, method, url, **kwargs):
+        """Send a request, logging in again only if its answer shows an expired session."""
+
+        url = self._url(url)
+        relogins = 0
+        while True:
+            generation = self._generation
+            session = self._session
+            if session is None:
+                session = self._login()
+                generation = self._generation
+
+            ret = self._send_retrying(session, method, url, **kwargs)
+            if not is_session_expired(ret.status_code, ret.url, ret.content):
+                ret.raise_for_status()
+                return ret
+
+            relogins += 1
+            if relogins > self.retry_policy.max_relogins:
+                if self._session_store is not None:
+                    # the session saved by the last login is rejected too
+                    self._session_store.invalidate(self.username, self.base_url)
+                raise HydrocaptAuthenticationError(f"Session still expired after {relogins - 1} login(s) for {get_endpoint(url)}")
+            if self.metrics is not None:
+                self.metrics.record_retry(url)
+            self._login(failed_generation=generation)
 
+    def post(self, url, data, headers=None):
 
         if headers is None:
             headers = {}
@@ -99,31 +356,7 @@ class HydrocaptClientSession(object):
         if headers.get("referer") is None:
             headers["referer"] = url
 
-        try:
-            ret = self._session.post(url, data=data, headers=headers)
-            ret.raise_for_status()
-        except:
-            self._session = self._new_session()
-            ret = self._session.post(url, data=data, headers=headers)
-
-        ret.raise_for_status()
-
-
-        return ret
+        return self._request("POST", url, data=data, headers=headers)
 
     def get(self, url):
-
-        if self._session is None:
-            self._session = self._new_session()
-
-        ret = None
-        try:
-            ret = self._session.get(url)
-            ret.raise_for_status()
-        except:
-            self._session = self._new_session()
-            ret = self._session.get(url)
-
-        ret.raise_for_status()
-
-        return ret
+        return self._request("GET", url)
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+"""On disk store of the authenticated Hydrocapt sessions, to reuse them across process restarts."""
+import json
+import os
+import stat
+import tempfile
+import threading
+import time
+
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Tuple
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from requests.cookies import RequestsCookieJar
+
+from .const import HYDROCAPT_BASE_URL
+from .const import HYDROCAPT_SESSION_STORE_MAX_AGE
+
+
+class HydrocaptSessionStore(object):
+    """Keep the session cookies and the resolved pool id of each account of each server in a JSON file.
+
+    The file is written atomically and only readable by its owner, a file readable by
+    others or owned by someone else is ignored. Passwords are never stored.
+    """
+
+    def __init__(self, path: str, max_age: float = HYDROCAPT_SESSION_STORE_MAX_AGE) -> None:
+        """Initialize the store, the file is only read when a session is needed.
+
+        Args:
+            path: the JSON file holding the sessions
+            max_age: time in seconds after which a stored session is not reused anymore
+        """
+        self.path = path
+        self.max_age = max_age
+        self._lock = threading.Lock()
+
+    def _is_file_safe(self, st) -> bool:
+        if os.name != "posix":
+            return True
+        if st.st_uid != os.getuid():
+            return False
+        return (st.st_mode & (stat.S_IRWXG | stat.S_IRWXO)) == 0
+
+    def _read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                if self._is_file_safe(os.fstat(f.fileno())) is False:
+                    return {}
+                content = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        if not isinstance(content, dict) or not isinstance(content.get("sessions"), dict):
+            return {}
+
+        return content["sessions"]
+
+    def _write(self, sessions: Dict[str, Any]) -> None:
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(prefix=".hydrocapt-", dir=directory)
+        try:
+            # mkstemp creates the file with 0600 permissions
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                json.dump({"sessions": sessions}, f)
+            os.replace(tmp_path, self.path)
+        except:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _get_key(username: str, base_url: Optional[str]) -> str:
+        return f"{username}@{base_url if base_url is not None else HYDROCAPT_BASE_URL}"
+
+    def load_cookies(self, username: str, base_url: Optional[str] = None) -> Optional[Tuple[List[Dict[str, Any]], int]]:
+        """Return the stored cookies, as dicts with name, value, domain, path, expires and secure, and pool id of an account.
+
+        None if there is no valid session, load returns the cookies in a requests cookie jar.
+
+        Args:
+            username: the account
+            base_url: the server of the account, None for www.hydrocapt.fr
+        """
+
+        with self._lock:
+            entry = self._read().get(self._get_key(username, base_url))
+
+        if entry is None or entry.get("expires", 0) <= time.time():
+            return None
+
+        try:
+            cookies = [{"name": c["name"], "value": c["value"], "domain": c.get("domain", ""), "path": c.get("path", "/"),
+                        "expires": c.get("expires"), "secure": c.get("secure", False)} for c in entry["cookies"]]
+            pool_id = int(entry.get("pool_internal_id", -1))
+        except (KeyError, TypeError, ValueError):
+            return None
+
+        return cookies, pool_id
+
+    def load(self, username: str, base_url: Optional[str] = None) -> Optional[Tuple["RequestsCookieJar", int]]:
+        """Return the stored cookies and pool id of an account, None if there is no valid session.
+
+        Args:
+            username: the account
+            base_url: the server of the account, None for www.hydrocapt.fr
+        """
+
+        stored = self.load_cookies(username, base_url)
+        if stored is None:
+            return None
+
+        from requests.cookies import RequestsCookieJar
+        jar = RequestsCookieJar()
+        cookies, pool_id = stored
+        for c in cookies:
+            jar.set(c["name"], c["value"], domain=c["domain"], path=c["path"], expires=c["expires"], secure=c["secure"])
+
+        return jar, pool_id
+
+    def save_cookies(self, username: str, cookies: List[Dict[str, Any]], pool_internal_id: int, base_url: Optional[str] = None) -> None:
+        """Store the cookies, as dicts like the ones of load_cookies, of a freshly authenticated session."""
+
+        expires = time.time() + self.max_age
+        for c in cookies:
+            if c.get("expires") is not None:
+                expires = min(expires, c["expires"])
+
+        with self._lock:
+            sessions = self._read()
+            sessions[self._get_key(username, base_url)] = {"cookies": cookies, "pool_internal_id": pool_internal_id, "expires": expires}
+            self._write(sessions)
+
+    def save(self, username: str, cookies: "RequestsCookieJar", pool_internal_id: int, base_url: Optional[str] = None) -> None:
+        """Store the cookies of a freshly authenticated session."""
+
+        self.save_cookies(username, [{"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+                                      "expires": c.expires, "secure": c.secure} for c in cookies], pool_internal_id, base_url)
+
+    def invalidate(self, username: str, base_url: Optional[str] = None) -> None:
+        """Forget the stored session of an account, after the server rejected it."""
+
+        with self._lock:
+            sessions = self._read()
+            if sessions.pop(self._get_key(username, base_url), None) is not None:
+                self._write(sessions)
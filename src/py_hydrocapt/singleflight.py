@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Coalescing of identical concurrent calls: the first caller runs it, the others wait for its result."""
+import asyncio
+import functools
+import threading
+from typing import Any
+from typing import Awaitable
+from typing import Callable
+from typing import Dict
+from typing import Hashable
+from typing import Optional
+
+from .deadline import get_remaining
+from .exceptions import HydrocaptDeadlineExceeded
+
+
+class _HydrocaptCall(object):
+
+    def __init__(self) -> None:
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class HydrocaptSingleFlight(object):
+    """Thread safe coalescing of the calls of the same key, e.g. the reads of a resource shared by threads."""
+
+    def __init__(self, on_shared: Optional[Callable[[Hashable], None]] = None) -> None:
+        """Initialize the coalescing.
+
+        Args:
+            on_shared: called with the key each time a call waits for the result of an other one
+        """
+        self._lock = threading.Lock()
+        self._calls: Dict[Hashable, _HydrocaptCall] = {}
+        self.on_shared = on_shared
+
+    def do(self, key: Hashable, func: Callable[[], Any], join: bool = True) -> Any:
+        """Return func(), or the result of the call of the same key already running, its exception is raised to all.
+
+        A caller waits for the other call only until its own deadline. When the other call ran out of
+        its deadline, the caller makes the call itself.
+
+        Args:
+            join: False to always make the call, e.g. for a result newer than the running call,
+                the next callers join this one
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                leader = call is None or join is False
+                if leader:
+                    call = _HydrocaptCall()
+                    self._calls[key] = call
+
+            if leader:
+                break
+
+            if self.on_shared is not None:
+                self.on_shared(key)
+            remaining = get_remaining()
+            if not call.done.wait(max(0.0, remaining) if remaining is not None else None):
+                raise HydrocaptDeadlineExceeded(f"Deadline exceeded while waiting for {key}")
+            if isinstance(call.error, HydrocaptDeadlineExceeded):
+                continue
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = func()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+        return call.result
+
+
+class AsyncHydrocaptSingleFlight(object):
+    """Coalescing of the coroutines of the same key, within one event loop.
+
+    The call runs in its own task: a caller cancelled while waiting doesn't cancel it for the others.
+    The deadlines are handled like HydrocaptSingleFlight.
+    """
+
+    def __init__(self, on_shared: Optional[Callable[[Hashable], None]] = None) -> None:
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.on_shared = on_shared
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]], join: bool = True) -> Any:
+        while True:
+            task = self._calls.get(key)
+            leader = task is None or task.done() or join is False
+            if leader:
+                task = asyncio.ensure_future(func())
+                self._calls[key] = task
+                task.add_done_callback(functools.partial(self._done, key))
+                return await asyncio.shield(task)
+
+            if self.on_shared is not None:
+                self.on_shared(key)
+            remaining = get_remaining()
+            try:
+                return await asyncio.wait_for(asyncio.shield(task), max(0.0, remaining) if remaining is not None else None)
+            except asyncio.TimeoutError:
+                if not task.done():
+                    raise HydrocaptDeadlineExceeded(f"Deadline exceeded while waiting for {key}") from None
+                raise
+            except HydrocaptDeadlineExceeded:
+                # the deadline of the caller that started it, not ours
+                continue
+
+    def _done(self, key: Hashable, task: asyncio.Future) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        if not task.cancelled():
+            # retrieved here so that an error no caller waited for is not logged
+            task.exception()
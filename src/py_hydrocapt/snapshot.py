@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+"""Typed and compact snapshots of the state of a pool.
+
+The clients return plain dicts keyed by the external names; these immutable records hold the
+same values with the command states as enums and the timers as a 24 bits mask, a few times
+smaller when many snapshots are kept. as_dict() and from_dict() convert from and to the dicts.
+"""
+from datetime import datetime
+from enum import IntEnum
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import NamedTuple
+from typing import Optional
+
+from .const import HYDROCAPT_EXTERNAL_TO_INTERNAL_COMMANDS
+from .const import HYDROCAPT_INTERNAL_TO_EXTERNAL_COMMANDS
+from .const import HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS
+from .const import HYDROCAPT_TIMER
+from .exceptions import HydrocaptError
+
+_ALL_HOURS = (1 << 24) - 1
+
+
+class HydrocaptTimer(int):
+    """A day timer as a 24 bits mask, bit h set when the timer is on during hour h.
+
+    The changes return a new timer; the ranges are like set_consign_timer_range, end excluded
+    and wrapping around midnight when end < start.
+    """
+
+    __slots__ = ()
+
+    def __new__(cls, mask: int = 0) -> "HydrocaptTimer":
+        if mask < 0 or mask > _ALL_HOURS:
+            raise HydrocaptError(f"Invalid timer mask {mask}")
+        return super().__new__(cls, mask)
+
+    @classmethod
+    def from_hours(cls, hours: Iterable[Any]) -> "HydrocaptTimer":
+        """From the 24 values of the client consigns, true when on."""
+        mask = 0
+        count = 0
+        for h, v in enumerate(hours):
+            if v:
+                mask |= 1 << h
+            count += 1
+        if count != 24:
+            raise HydrocaptError("A timer needs 24 values")
+        return cls(mask)
+
+    @classmethod
+    def from_internal(cls, value: str) -> "HydrocaptTimer":
+        """From the server "0101..." string, first character for hour 0, anything but 0 is on."""
+        if len(value) != 24:
+            raise HydrocaptError("A timer needs 24 values")
+        try:
+            return cls(int(value[::-1], 2))
+        except ValueError:
+            return cls.from_hours(c != "0" for c in value)
+
+    @staticmethod
+    def _check_hour(hour: int) -> int:
+        if hour < 0 or hour >= 24:
+            raise HydrocaptError(f"Invalid hour {hour}")
+        return hour
+
+    @classmethod
+    def range_mask(cls, start_hour: int, end_hour: int) -> int:
+        """Mask of the hours from start_hour to end_hour excluded."""
+        cls._check_hour(start_hour)
+        if end_hour != 24:
+            cls._check_hour(end_hour)
+        if end_hour >= start_hour:
+            return ((1 << end_hour) - 1) & ~((1 << start_hour) - 1)
+        return _ALL_HOURS & ~(((1 << start_hour) - 1) & ~((1 << end_hour) - 1))
+
+    def __getitem__(self, hour: int) -> bool:
+        return bool(self >> self._check_hour(hour) & 1)
+
+    def __iter__(self) -> Iterator[bool]:
+        return iter(self.to_hours())
+
+    def __len__(self) -> int:
+        return 24
+
+    def __repr__(self) -> str:
+        return f"HydrocaptTimer({self.to_internal()!r})"
+
+    def set(self, hour: int) -> "HydrocaptTimer":
+        return HydrocaptTimer(self | 1 << self._check_hour(hour))
+
+    def clear(self, hour: int) -> "HydrocaptTimer":
+        return HydrocaptTimer(self & ~(1 << self._check_hour(hour)))
+
+    def set_range(self, start_hour: int, end_hour: int) -> "HydrocaptTimer":
+        return HydrocaptTimer(self | self.range_mask(start_hour, end_hour))
+
+    def clear_range(self, start_hour: int, end_hour: int) -> "HydrocaptTimer":
+        return HydrocaptTimer(self & ~self.range_mask(start_hour, end_hour))
+
+    def on_hours(self) -> List[int]:
+        """The hours when the timer is on."""
+        return [h for h in range(24) if self >> h & 1]
+
+    def to_hours(self) -> List[bool]:
+        """The 24 values of the client consigns."""
+        return [bool(self >> h & 1) for h in range(24)]
+
+    def to_internal(self) -> str:
+        """The server "0101..." string."""
+        return format(self, "024b")[::-1]
+
+
+class FiltrationState(IntEnum):
+    AUTO = 0
+    ON = 1
+    OFF = 2
+    TIMER = 3
+    CHOC = 4
+
+
+class LightState(IntEnum):
+    ON = 0
+    TIMER = 1
+    OFF = 2
+
+
+class RegulationState(IntEnum):
+    """Heating, pH and redox regulations."""
+
+    AUTO = 0
+    OFF = 1
+
+
+#internal command name to the enum of its states, the enum values are the internal states
+_COMMAND_ENUMS = {
+    "filtration": FiltrationState,
+    "lighting": LightState,
+    "heating_regulation": RegulationState,
+    "ph_regulation": RegulationState,
+    "orp_regulation": RegulationState,
+}
+
+
+class CommandStates(NamedTuple):
+    """Current state of each command, None when unknown."""
+
+    filtration: Optional[FiltrationState] = None
+    lighting: Optional[LightState] = None
+    heating_regulation: Optional[RegulationState] = None
+    ph_regulation: Optional[RegulationState] = None
+    orp_regulation: Optional[RegulationState] = None
+
+    @classmethod
+    def from_dict(cls, commands: Dict[str, Any]) -> "CommandStates":
+        """From the client commands, e.g. {"Filtration": "Filtration AUTO"}, other keys are ignored."""
+        values = {}
+        for k_ext, v_ext in commands.items():
+            k_int_trad = HYDROCAPT_EXTERNAL_TO_INTERNAL_COMMANDS.get(k_ext)
+            if k_int_trad is not None and v_ext is not None:
+                state = k_int_trad[1].get(v_ext)
+                if state is None:
+                    raise HydrocaptError(f"Unknown state {v_ext} of {k_ext}")
+                values[k_int_trad[0]] = _COMMAND_ENUMS[k_int_trad[0]](state)
+        return cls(**values)
+
+    def as_dict(self) -> Dict[str, str]:
+        """The client commands, the unknown ones are left out."""
+        res = {}
+        for k_int, state in zip(self._fields, self):
+            if state is not None:
+                k_ext_trad = HYDROCAPT_INTERNAL_TO_EXTERNAL_COMMANDS[k_int]
+                res[k_ext_trad[0]] = k_ext_trad[1][int(state)]
+        return res
+
+
+class Consigns(NamedTuple):
+    """Current consigns, None when unknown."""
+
+    setpoint_heating: Optional[int] = None
+    timer_filtration: Optional[HydrocaptTimer] = None
+    timer_lighting: Optional[HydrocaptTimer] = None
+
+    @classmethod
+    def from_dict(cls, consigns: Dict[str, Any]) -> "Consigns":
+        """From the client consigns, e.g. {"Filtration Timer": [False, ...]}, other keys are ignored."""
+        values = {}
+        for k_int in cls._fields:
+            k_ext, kind = HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS[k_int][0:2]
+            v = consigns.get(k_ext)
+            if v is None:
+                continue
+            if kind == HYDROCAPT_TIMER:
+                values[k_int] = v if isinstance(v, HydrocaptTimer) else HydrocaptTimer.from_hours(v)
+            else:
+                values[k_int] = int(v)
+        return cls(**values)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The client consigns, the unknown ones are left out."""
+        res = {}
+        for k_int, v in zip(self._fields, self):
+            if v is not None:
+                res[HYDROCAPT_INTERNAL_TO_EXTERNAL_CONSIGNS[k_int][0]] = v.to_hours() if isinstance(v, HydrocaptTimer) else v
+        return res
+
+
+class Measurements(NamedTuple):
+    """Latest hourly measures, the status are OK, TooLow or TooHigh compared to the alarms thresholds."""
+
+    date_time: Optional[datetime] = None
+    water_temperature: Optional[float] = None
+    technical_room_temperature: Optional[float] = None
+    ph: Optional[float] = None
+    redox: Optional[float] = None
+    conductivity: Optional[float] = None
+    ph_status: Optional[str] = None
+    redox_status: Optional[str] = None
+    conductivity_status: Optional[str] = None
+
+    @classmethod
+    def from_dict(cls, measures: Dict[str, Any]) -> "Measurements":
+        """From the client measures, other keys are ignored."""
+        return cls(*(measures.get(f) for f in cls._fields))
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The client measures, the unknown ones are left out."""
+        return {f: v for f, v in zip(self._fields, self) if v is not None}
+
+
+class PoolSnapshot(NamedTuple):
+    """Commands, consigns and measures of a pool, as returned by fetch_all_data."""
+
+    commands: CommandStates = CommandStates()
+    consigns: Consigns = Consigns()
+    measurements: Measurements = Measurements()
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "PoolSnapshot":
+        """From the flat dict of fetch_all_data or get_packaged_data."""
+        return cls(CommandStates.from_dict(data), Consigns.from_dict(data), Measurements.from_dict(data))
+
+    def as_dict(self) -> Dict[str, Any]:
+        """The flat dict of fetch_all_data."""
+        res = self.commands.as_dict()
+        res.update(self.measurements.as_dict())
+        res.update(self.consigns.as_dict())
+        return res
+
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Compact on disk store of the hourly measures of a pool, with vectorized aggregates.
+
+Requires numpy (py-hydrocapt[store]).
+"""
+import os
+from datetime import date
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import Iterable
+from typing import Optional
+from typing import Sequence
+from typing import Union
+
+import numpy as np
+
+from .exceptions import HydrocaptError
+from .history import HydrocaptHistoryRecord
+
+
+HYDROCAPT_STORE_COLUMNS = ("water_temperature", "technical_room_temperature", "ph", "redox", "conductivity")
+
+HYDROCAPT_STORE_DTYPE = np.dtype([("timestamp", "<i8")] + [(c, "<f4") for c in HYDROCAPT_STORE_COLUMNS])
+
+HYDROCAPT_STORE_PERIODS = ("day", "week", "month")
+
+# free rows are at the end of the file and keep the timestamps sorted
+_EMPTY_TIMESTAMP = np.iinfo(np.int64).max
+
+
+def _to_timestamp(value: Union[datetime, date, str, None]) -> Optional[int]:
+    """Seconds since 1970-01-01 of a naive, pool local, date time."""
+    if value is None:
+        return None
+    return int(np.datetime64(value, "s").astype(np.int64))
+
+
+class HydrocaptMeasureStore(object):
+    """Hourly measures of one pool stored as fixed size rows in a memory mapped .npy file.
+
+    Rows are kept sorted by time, a measure missing for an hour is NaN. Appending the same
+    hour again replaces its values, so today's partial day can be stored at each poll.
+    """
+
+    def __init__(self, path: str, initial_capacity: int = 24 * 366) -> None:
+        """Open the store, creating its file if needed.
+
+        Args:
+            path: the .npy file of the store
+            initial_capacity: number of rows allocated when creating the file
+        """
+        self.path = path
+        if os.path.exists(path):
+            self._data = np.load(path, mmap_mode="r+")
+            if self._data.dtype != HYDROCAPT_STORE_DTYPE:
+                raise HydrocaptError(f"{path} is not a measure store")
+        else:
+            self._data = self._allocate(path, max(initial_capacity, 1))
+        self._count = int(np.searchsorted(self._data["timestamp"], _EMPTY_TIMESTAMP))
+
+    def _allocate(self, path, capacity):
+        data = np.lib.format.open_memmap(path, mode="w+", dtype=HYDROCAPT_STORE_DTYPE, shape=(capacity,))
+        data["timestamp"] = _EMPTY_TIMESTAMP
+        for c in HYDROCAPT_STORE_COLUMNS:
+            data[c] = np.nan
+        return data
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _rows_from_records(self, records: Iterable[Union[HydrocaptHistoryRecord, Dict[str, Any]]]) -> np.ndarray:
+        records = list(records)
+        rows = np.empty(len(records), dtype=HYDROCAPT_STORE_DTYPE)
+        for i, r in enumerate(records):
+            if isinstance(r, dict):
+                values = [r.get(c) for c in HYDROCAPT_STORE_COLUMNS]
+                date_time = r["date_time"]
+            else:
+                values = [getattr(r, c) for c in HYDROCAPT_STORE_COLUMNS]
+                date_time = r.date_time
+            rows[i] = (_to_timestamp(date_time),) + tuple(np.nan if v is None else v for v in values)
+        return rows
+
+    def _replace_data(self, rows: np.ndarray) -> None:
+        capacity = len(self._data)
+        if len(rows) > capacity:
+            while capacity < len(rows):
+                capacity *= 2
+            self._data.flush()
+            del self._data
+            tmp_path = self.path + ".tmp"
+            data = self._allocate(tmp_path, capacity)
+            data[:len(rows)] = rows
+            data.flush()
+            del data
+            os.replace(tmp_path, self.path)
+            self._data = np.load(self.path, mmap_mode="r+")
+        else:
+            self._data[:len(rows)] = rows
+        self._count = len(rows)
+
+    def append(self, records: Iterable[Union[HydrocaptHistoryRecord, Dict[str, Any]]]) -> int:
+        """Add hourly records, HydrocaptHistoryRecord or dicts with date_time and the measures keys.
+
+        Returns:
+            the number of rows added or replaced
+        """
+        rows = self._rows_from_records(records)
+        if len(rows) == 0:
+            return 0
+
+        rows = rows[np.argsort(rows["timestamp"], kind="stable")]
+
+        current = self._data[:self._count]
+        if self._count == 0 or rows["timestamp"][0] > current["timestamp"][-1]:
+            # usual case, newer hours: only write the new rows
+            _, last = np.unique(rows["timestamp"][::-1], return_index=True)
+            rows = rows[::-1][last]
+            if self._count + len(rows) <= len(self._data):
+                self._data[self._count:self._count + len(rows)] = rows
+                self._count += len(rows)
+            else:
+                self._replace_data(np.concatenate([current, rows]))
+            return len(rows)
+
+        # merge, the last value given for an hour wins
+        merged = np.concatenate([current, rows])
+        _, last = np.unique(merged["timestamp"][::-1], return_index=True)
+        merged = merged[::-1][last]
+        self._replace_data(merged)
+        return len(rows)
+
+    def _slice(self, start=None, end=None) -> np.ndarray:
+        ts = self._data["timestamp"][:self._count]
+        lo = 0 if start is None else int(np.searchsorted(ts, _to_timestamp(start), side="left"))
+        if end is None:
+            hi = self._count
+        else:
+            end_ts = _to_timestamp(end)
+            if isinstance(end, date) and not isinstance(end, datetime):
+                # a day as end includes all its hours
+                end_ts += 86400 - 1
+            hi = int(np.searchsorted(ts, end_ts, side="right"))
+        return self._data[lo:hi]
+
+    def timestamps(self, start=None, end=None) -> np.ndarray:
+        """The hours of the stored rows between start and end (included), as datetime64[s]."""
+        return self._slice(start, end)["timestamp"].astype("datetime64[s]")
+
+    def column(self, name: str, start=None, end=None) -> np.ndarray:
+        """A read only view of a measure column between start and end (included)."""
+        if name not in HYDROCAPT_STORE_COLUMNS:
+            raise HydrocaptError(f"Unknown measure {name}")
+        values = self._slice(start, end)[name]
+        values.flags.writeable = False
+        return values
+
+    def aggregate(self, name: str, period: str = "day", percentiles: Sequence[float] = (), start=None, end=None) -> Dict[str, np.ndarray]:
+        """Compute min, max, mean and percentiles of a measure per day, week (starting on monday) or month.
+
+        NaN values are ignored, a period without any value gives NaN.
+
+        Returns:
+            A dict of arrays with one entry per period: period_start (datetime64[D]), count, min, max,
+            mean and one pXX key per requested percentile
+        """
+        if name not in HYDROCAPT_STORE_COLUMNS:
+            raise HydrocaptError(f"Unknown measure {name}")
+        if period not in HYDROCAPT_STORE_PERIODS:
+            raise HydrocaptError(f"Unknown period {period}")
+
+        rows = self._slice(start, end)
+        values = rows[name].astype(np.float64)
+        days = (rows["timestamp"] // 86400).astype(np.int64)
+
+        if period == "day":
+            keys = days
+        elif period == "week":
+            # 1970-01-01 was a thursday
+            keys = days - (days + 3) % 7
+        else:
+            keys = days.astype("datetime64[D]").astype("datetime64[M]").astype(np.int64)
+
+        if len(keys) == 0:
+            res = {"period_start": np.empty(0, dtype="datetime64[D]"), "count": np.empty(0, dtype=np.int64)}
+            for k in ["min", "max", "mean"] + [f"p{q:g}" for q in percentiles]:
+                res[k] = np.empty(0)
+            return res
+
+        starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+        valid = ~np.isnan(values)
+        count = np.add.reduceat(valid.astype(np.int64), starts)
+        total = np.add.reduceat(np.where(valid, values, 0.0), starts)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            res = {
+                "count": count,
+                "min": np.where(count > 0, np.fmin.reduceat(values, starts), np.nan),
+                "max": np.where(count > 0, np.fmax.reduceat(values, starts), np.nan),
+                "mean": np.where(count > 0, total / count, np.nan),
+            }
+
+        if period == "month":
+            res["period_start"] = keys[starts].astype("datetime64[M]").astype("datetime64[D]")
+        else:
+            res["period_start"] = keys[starts].astype("datetime64[D]")
+
+        if len(percentiles) > 0:
+            # sort by group then value, NaN go to the end of each group
+            group_ids = np.repeat(np.arange(len(starts)), np.diff(np.append(starts, len(values))))
+            sorted_values = values[np.lexsort((values, group_ids))]
+            for q in percentiles:
+                pos = (count - 1) * (q / 100.0)
+                lo = np.floor(pos).astype(np.int64)
+                hi = np.ceil(pos).astype(np.int64)
+                lo_v = sorted_values[starts + np.clip(lo, 0, None)]
+                hi_v = sorted_values[starts + np.clip(hi, 0, None)]
+                res[f"p{q:g}"] = np.where(count > 0, lo_v + (hi_v - lo_v) * (pos - lo), np.nan)
+
+        return res
+
+    def flush(self) -> None:
+        self._data.flush()
+
+    def close(self) -> None:
+        self._data.flush()
+        del self._data
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""Protection of the Hydrocapt cloud from our own load: rate limiter and circuit breaker.
+
+Both are thread safe and meant to be shared by all the sessions of a process (e.g. given to a
+HydrocaptFleet), they are keyed by host and by account so one object covers several servers.
+"""
+import threading
+import time
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+from .exceptions import HydrocaptCircuitOpenError
+from .const import HYDROCAPT_RATE_LIMIT_HOST_RATE
+from .const import HYDROCAPT_RATE_LIMIT_HOST_BURST
+from .const import HYDROCAPT_RATE_LIMIT_ACCOUNT_RATE
+from .const import HYDROCAPT_RATE_LIMIT_ACCOUNT_BURST
+from .const import HYDROCAPT_CIRCUIT_FAILURE_THRESHOLD
+from .const import HYDROCAPT_CIRCUIT_RESET_TIMEOUT
+from .const import HYDROCAPT_CIRCUIT_HALF_OPEN_PROBES
+
+HYDROCAPT_CIRCUIT_CLOSED = "closed"
+HYDROCAPT_CIRCUIT_OPEN = "open"
+HYDROCAPT_CIRCUIT_HALF_OPEN = "half_open"
+
+
+class _TokenBucket(object):
+
+    def __init__(self, rate: float, burst: int) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def reserve(self, now: float) -> float:
+        """Take a token, possibly ahead of time, and return the seconds to wait before using it."""
+        # now is read before the lock, another caller may have updated the bucket later
+        if now > self.updated:
+            self.tokens = min(float(self.burst), self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+        self.tokens -= 1.0
+        if self.tokens >= 0:
+            return 0.0
+        return -self.tokens / self.rate
+
+    def cancel(self) -> None:
+        """Give back a reserved token that was not used."""
+        self.tokens = min(float(self.burst), self.tokens + 1.0)
+
+
+class HydrocaptRateLimiter(object):
+    """Token buckets limiting the requests rate toward each host, and of each account on a host.
+
+    The callers wait instead of failing: reserve() returns how long. A rate of None disables a level.
+    A caller giving up on the wait, e.g. at its deadline, must cancel() its reservation.
+    """
+
+    def __init__(self, host_rate: Optional[float] = HYDROCAPT_RATE_LIMIT_HOST_RATE, host_burst: int = HYDROCAPT_RATE_LIMIT_HOST_BURST,
+                 account_rate: Optional[float] = HYDROCAPT_RATE_LIMIT_ACCOUNT_RATE,
+                 account_burst: int = HYDROCAPT_RATE_LIMIT_ACCOUNT_BURST) -> None:
+        """Initialize the limiter.
+
+        Args:
+            host_rate: requests per second toward a host, all accounts included
+            host_burst: requests allowed at once toward a host after an idle period
+            account_rate: requests per second of one account toward a host
+            account_burst: requests allowed at once for one account after an idle period
+        """
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.account_rate = account_rate
+        self.account_burst = account_burst
+        self._lock = threading.Lock()
+        self._buckets: Dict[Tuple[str, Optional[str]], _TokenBucket] = {}
+
+    def _get_bucket(self, key, rate, burst) -> _TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = _TokenBucket(rate, burst)
+            self._buckets[key] = bucket
+        return bucket
+
+    def reserve(self, host: str, account: Optional[str] = None) -> float:
+        """Reserve a request of account toward host, returns the seconds to wait before sending it."""
+        now = time.monotonic()
+        delay = 0.0
+        with self._lock:
+            if self.host_rate is not None:
+                delay = self._get_bucket((host, None), self.host_rate, self.host_burst).reserve(now)
+            if self.account_rate is not None and account is not None:
+                delay = max(delay, self._get_bucket((host, account), self.account_rate, self.account_burst).reserve(now))
+        return delay
+
+    def cancel(self, host: str, account: Optional[str] = None) -> None:
+        """Give back a reservation whose request was not sent, so the next ones don't wait for it."""
+        with self._lock:
+            if self.host_rate is not None:
+                self._get_bucket((host, None), self.host_rate, self.host_burst).cancel()
+            if self.account_rate is not None and account is not None:
+                self._get_bucket((host, account), self.account_rate, self.account_burst).cancel()
+
+
+class _CircuitState(object):
+
+    def __init__(self) -> None:
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.probes = 0
+
+
+class HydrocaptCircuitBreaker(object):
+    """Stop sending requests to a host failing repeatedly, then let a few probes through to test it.
+
+    Closed: the requests are sent. After failure_threshold failures in a row the circuit opens and the
+    requests fail fast with HydrocaptCircuitOpenError. After reset_timeout it is half open: up to
+    half_open_probes requests are sent, a success closes it, a failure opens it again.
+    """
+
+    def __init__(self, failure_threshold: int = HYDROCAPT_CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = HYDROCAPT_CIRCUIT_RESET_TIMEOUT,
+                 half_open_probes: int = HYDROCAPT_CIRCUIT_HALF_OPEN_PROBES) -> None:
+        """Initialize the breaker.
+
+        Args:
+            failure_threshold: failed requests in a row opening the circuit
+            reset_timeout: seconds the circuit stays open before letting probes through
+            half_open_probes: max requests sent at the same time while half open
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.half_open_probes = half_open_probes
+        self._lock = threading.Lock()
+        self._hosts: Dict[str, _CircuitState] = {}
+
+    def _get_state(self, host: str) -> _CircuitState:
+        state = self._hosts.get(host)
+        if state is None:
+            state = _CircuitState()
+            self._hosts[host] = state
+        return state
+
+    def get_state(self, host: str) -> str:
+        """HYDROCAPT_CIRCUIT_CLOSED, HYDROCAPT_CIRCUIT_OPEN or HYDROCAPT_CIRCUIT_HALF_OPEN."""
+        with self._lock:
+            state = self._get_state(host)
+            if state.opened_at is None:
+                return HYDROCAPT_CIRCUIT_CLOSED
+            if time.monotonic() - state.opened_at < self.reset_timeout:
+                return HYDROCAPT_CIRCUIT_OPEN
+            return HYDROCAPT_CIRCUIT_HALF_OPEN
+
+    def before_request(self, host: str) -> None:
+        """Called before sending a request, raises HydrocaptCircuitOpenError if it must not be sent."""
+        with self._lock:
+            state = self._get_state(host)
+            if state.opened_at is None:
+                return
+            remaining = self.reset_timeout - (time.monotonic() - state.opened_at)
+            if remaining > 0:
+                raise HydrocaptCircuitOpenError(f"Circuit open toward {host} for {remaining:.1f}s")
+            if state.probes >= self.half_open_probes:
+                raise HydrocaptCircuitOpenError(f"Circuit half open toward {host}, probe in progress")
+            state.probes += 1
+
+    def record_success(self, host: str) -> None:
+        with self._lock:
+            state = self._get_state(host)
+            state.failures = 0
+            state.opened_at = None
+            state.probes = 0
+
+    def record_cancelled(self, host: str) -> None:
+        """A request ended without telling anything about the host, e.g. cancelled, its probe slot is released."""
+        with self._lock:
+            state = self._get_state(host)
+            if state.probes > 0:
+                state.probes -= 1
+
+    def record_failure(self, host: str) -> None:
+        with self._lock:
+            state = self._get_state(host)
+            state.failures += 1
+            if state.opened_at is not None or state.failures >= self.failure_threshold:
+                # a failed probe opens the circuit again for a full timeout
+                state.opened_at = time.monotonic()
+                state.probes = 0
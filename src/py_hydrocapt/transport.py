@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+"""HTTP connection settings of the sessions."""
+from typing import Optional
+
+from .const import HYDROCAPT_HTTP_TIMEOUT
+from .const import HYDROCAPT_HTTP_POOL_MAXSIZE
+from .const import HYDROCAPT_HTTP_KEEPALIVE_TIMEOUT
+from .const import HYDROCAPT_HTTP_ACCEPT_ENCODING
+
+
+class HydrocaptHttpSettings(object):
+    """Timeout, connection pool, keep alive and compression of the HTTP sessions."""
+
+    def __init__(self, timeout: Optional[float] = HYDROCAPT_HTTP_TIMEOUT, pool_maxsize: int = HYDROCAPT_HTTP_POOL_MAXSIZE,
+                 keep_alive: bool = True, keepalive_timeout: float = HYDROCAPT_HTTP_KEEPALIVE_TIMEOUT, gzip: bool = True) -> None:
+        """Initialize the settings.
+
+        Args:
+            timeout: seconds a socket operation may take when the call has no deadline, None to wait forever
+            pool_maxsize: max connections kept open per host
+            keep_alive: reuse the connections between requests, False to close them after each answer
+            keepalive_timeout: seconds an idle connection is kept for reuse, the sync sessions close
+                all their connections before a request sent after such an idle time
+            gzip: ask for compressed answers
+        """
+        self.timeout = timeout
+        self.pool_maxsize = pool_maxsize
+        self.keep_alive = keep_alive
+        self.keepalive_timeout = keepalive_timeout
+        self.gzip = gzip
+
+    def get_headers(self):
+        """Headers sent with each request."""
+        headers = {"Accept-Encoding": HYDROCAPT_HTTP_ACCEPT_ENCODING if self.gzip else "identity"}
+        if self.keep_alive is False:
+            headers["Connection"] = "close"
+        return headers
+
+
+HYDROCAPT_DEFAULT_HTTP_SETTINGS = HydrocaptHttpSettings()
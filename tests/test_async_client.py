@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from py_hydrocapt import AsyncHydrocaptClient
+from py_hydrocapt import HydrocaptConfirmation
+from py_hydrocapt.exceptions import HydrocaptDeadlineExceeded
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+
+_LATENCY = 0.3
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer(latency=_LATENCY) as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+def _client(server, **kwargs):
+    return AsyncHydrocaptClient("user", "password", base_url=server.base_url, **kwargs)
+
+
+def test_fetch_all_data_reads_concurrently(server):
+
+    async def run():
+        async with _client(server) as client:
+            await client.is_connection_ok()
+            server.reset_round_trips()
+
+            start = time.monotonic()
+            data = await client.fetch_all_data()
+            elapsed = time.monotonic() - start
+
+            # commands, consigns, measures and alarms in one round of latency, not four
+            assert elapsed < 2 * _LATENCY
+            assert "Light" in data and "ph" in data and "Filtration Timer" in data
+            assert data["ph_status"] in ("OK", "TooLow", "TooHigh")
+            assert sorted(server.get_round_trips().values()) == [1, 1, 1, 1]
+
+            # concurrent callers share the reads
+            server.reset_round_trips()
+            await asyncio.gather(*(client.fetch_all_data(force_refresh=True) for _ in range(3)))
+            assert max(server.get_round_trips().values()) <= 3
+
+    asyncio.run(run())
+
+
+def test_save_waits_for_the_confirmation(server):
+    server.apply_delay = 1.0
+
+    async def run():
+        async with _client(server, confirmation=HydrocaptConfirmation(first_delay=0.2, backoff=1.0, max_delay=0.2, deadline=5)) as client:
+            before = await client.get_commands_current_states(force_refresh=True)
+            new_state = "Pool Light OFF" if before["Light"] != "Pool Light OFF" else "Pool Light ON"
+            deltas = []
+            client.changes.subscribe(deltas.append)
+
+            prev = await client.set_commands({"Light": new_state, "Filtration": before["Filtration"]})
+
+            assert prev == {"Light": before["Light"], "Filtration": before["Filtration"]}
+            assert client.last_confirmation.confirmed is True
+            assert client.last_confirmation.attempts > 1
+            assert (await client.get_commands_current_states())["Light"] == new_state
+            assert [d.as_dict() for d in deltas] == [{"Light": new_state}]
+
+            # already in this state, nothing is sent
+            server.reset_round_trips()
+            await client.set_commands({"Light": new_state})
+            assert client.last_confirmation.attempts == 0
+            assert all(not path.endswith("/save") for path in server.get_round_trips())
+
+    asyncio.run(run())
+
+
+def test_save_confirmation_cut_by_the_deadline(server):
+    server.apply_delay = 5
+
+    async def run():
+        async with _client(server) as client:
+            before = await client.get_commands_current_states(force_refresh=True)
+            new_state = "Pool Light OFF" if before["Light"] != "Pool Light OFF" else "Pool Light ON"
+            with pytest.raises(HydrocaptDeadlineExceeded):
+                await client.set_command_state("Light", new_state, deadline=1.5)
+            assert client.last_confirmation.confirmed is False
+
+    asyncio.run(run())
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import threading
+
+import pytest
+
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt.changes import HydrocaptChange
+from py_hydrocapt.changes import HydrocaptChangeFeed
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+@pytest.fixture
+def client(server):
+    return HydrocaptClient("user", "password", base_url=server.base_url, cache_ttl={"commands": 60})
+
+
+def test_versions_only_move_on_changes():
+    feed = HydrocaptChangeFeed()
+    assert feed.version == 0
+
+    delta = feed.update("commands", {}, {"Light": "Pool Light ON", "Filtration": "Pool Filtration AUTO"})
+    assert delta.version == 1
+    assert set(delta.changes) == {HydrocaptChange("Light", None, "Pool Light ON"), HydrocaptChange("Filtration", None, "Pool Filtration AUTO")}
+
+    assert feed.update("commands", {"Light": "Pool Light ON"}, {"Light": "Pool Light ON"}) is None
+    assert feed.version == 1
+
+    delta = feed.update("commands", {"Light": "Pool Light ON", "Aux1": "Pool Aux1 OFF"}, {"Light": "Pool Light OFF"})
+    assert delta.version == 2
+    assert delta.changes == (HydrocaptChange("Light", "Pool Light ON", "Pool Light OFF"), HydrocaptChange("Aux1", "Pool Aux1 OFF", None))
+    assert delta.as_dict() == {"Light": "Pool Light OFF", "Aux1": None}
+
+
+def test_since_returns_the_kept_deltas():
+    feed = HydrocaptChangeFeed(history=2)
+    for i in range(3):
+        feed.update("measures", {"ph": i}, {"ph": i + 1})
+
+    assert [d.version for d in feed.since(0)] == [2, 3]
+    assert [d.version for d in feed.since(2)] == [3]
+    assert feed.since(3) == []
+
+
+def test_subscribers_filters():
+    feed = HydrocaptChangeFeed()
+    everything, lights, consigns = [], [], []
+    feed.subscribe(everything.append)
+    feed.subscribe(lights.append, keys=["Light"])
+    unsubscribe = feed.subscribe(consigns.append, resources=["consigns"])
+
+    feed.update("commands", {}, {"Light": "Pool Light ON", "Aux1": "Pool Aux1 OFF"})
+    feed.update("commands", {}, {"Aux2": "Pool Aux2 OFF"})
+    feed.update("consigns", {}, {"Light": "timer"})
+    unsubscribe()
+    feed.update("consigns", {}, {"ph": 7.2})
+
+    assert [d.version for d in everything] == [1, 2, 3, 4]
+    assert [(d.version, d.as_dict()) for d in lights] == [(1, {"Light": "Pool Light ON"}), (3, {"Light": "timer"})]
+    assert [d.version for d in consigns] == [3]
+
+
+def test_a_raising_subscriber_does_not_break_the_others():
+    feed = HydrocaptChangeFeed()
+    received = []
+
+    def broken(delta):
+        raise RuntimeError("broken subscriber")
+
+    feed.subscribe(broken)
+    feed.subscribe(received.append)
+
+    delta = feed.update("commands", {}, {"Light": "Pool Light ON"})
+    assert received == [delta]
+    assert feed.since(0) == [delta]
+
+
+def test_subscribers_run_outside_of_the_client_lock(client):
+    # a subscriber reading the cached values from another thread would dead lock if called under the lock
+    read = []
+
+    def read_from_another_thread(delta):
+        t = threading.Thread(target=lambda: read.append(client.get_commands_current_states()))
+        t.start()
+        t.join(5)
+        assert not t.is_alive()
+
+    client.changes.subscribe(read_from_another_thread, resources=["commands"])
+    client.changes.subscribe(lambda delta: 1 / 0)
+
+    states = client.get_commands_current_states(force_refresh=True)
+    assert read == [states]
+    assert client.changes.version == 1
+    assert client.changes.since(0)[0].as_dict() == states
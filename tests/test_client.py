@@ -0,0 +1,276 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import pytest
+
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt import HydrocaptConfirmation
+from py_hydrocapt.exceptions import HydrocaptDeadlineExceeded
+from py_hydrocapt.exceptions import HydrocaptError
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+def _other_light_state(client):
+    return "Pool Light OFF" if client.get_commands_current_states(force_refresh=True)["Light"] != "Pool Light OFF" else "Pool Light ON"
+
+
+@pytest.fixture
+def client(server):
+    return HydrocaptClient("user", "password", base_url=server.base_url, cache_ttl={"commands": 60})
+
+
+def test_confirmation_does_not_join_a_read_started_before_the_save(client):
+    before = client.get_commands_current_states(force_refresh=True)
+    new_state = "Pool Light OFF" if before["Light"] != "Pool Light OFF" else "Pool Light ON"
+
+    # the first read is held until the save is confirmed, and then returns the old states
+    read_states = client._get_commands_current_states
+    started = threading.Event()
+    release = threading.Event()
+
+    def held_read():
+        if not started.is_set():
+            started.set()
+            release.wait(5)
+            return dict(before)
+        return read_states()
+
+    client._get_commands_current_states = held_read
+    reader = threading.Thread(target=client.get_commands_current_states, kwargs={"force_refresh": True})
+    reader.start()
+    started.wait(5)
+
+    client.set_command_state("Light", new_state)
+    assert client.last_confirmation.confirmed is True
+    assert client.last_confirmation.attempts == 1
+    assert reader.is_alive()
+
+    release.set()
+    reader.join(5)
+    # the old states of the held read are not kept over the confirmed ones
+    assert client.get_commands_current_states()["Light"] == new_state
+
+
+def test_fire_and_forget_save_is_not_published(client, server):
+    server.apply_delay = 5
+    new_state = _other_light_state(client)
+    deltas = []
+    client.changes.subscribe(deltas.append)
+
+    client.set_command_state("Light", new_state, confirmation=HydrocaptConfirmation(enabled=False))
+
+    assert client.last_confirmation.confirmed is False
+    assert deltas == []
+    # the cache was invalidated, the next read asks the pool which didn't apply it yet
+    assert client.get_commands_current_states()["Light"] != new_state
+
+
+def test_confirmation_cut_by_the_deadline(client, server):
+    server.apply_delay = 5
+    new_state = _other_light_state(client)
+
+    with pytest.raises(HydrocaptDeadlineExceeded):
+        client.set_command_state("Light", new_state, deadline=1.0)
+    assert client.last_confirmation.confirmed is False
+
+
+def test_timer_given_as_a_string(client):
+    hours = client._normalize_consigns({"timer_filtration": "1" * 6 + "0" * 12 + "1" * 6})["Filtration Timer"]
+    assert hours == [True] * 6 + [False] * 12 + [True] * 6
+
+    with pytest.raises(HydrocaptError):
+        client._normalize_consigns({"timer_filtration": "2" * 24})
+
+
+def test_set_consign_returns_the_previous_value_by_internal_name(client):
+    prev = client.get_current_consigns(force_refresh=True)["setpoint_heating"]
+    assert client.set_consign("setpoint_heating", prev + 1, get_prev=True) == prev
+
+    prev_timer = client.get_current_consigns(force_refresh=True)["Filtration Timer"]
+    new_timer = [not h for h in prev_timer]
+    assert client.set_consign("timer_filtration", new_timer, get_prev=True) == prev_timer
+    assert client.get_current_consigns(force_refresh=True)["Filtration Timer"] == new_timer
+
+
+def test_parallel_fetch_all_data(server):
+    server.latency = 0.3
+    sequential = HydrocaptClient("user", "password", base_url=server.base_url)
+    sequential.is_connection_ok()
+    start = time.monotonic()
+    expected = sequential.fetch_all_data()
+    sequential_elapsed = time.monotonic() - start
+
+    client = HydrocaptClient("user", "password", base_url=server.base_url, parallel=True)
+    client.is_connection_ok()
+    server.reset_round_trips()
+    start = time.monotonic()
+    data = client.fetch_all_data()
+    parallel_elapsed = time.monotonic() - start
+
+    assert data.keys() == expected.keys()
+    # the measures and their alarms are two round trips, the commands and consigns run alongside
+    assert sequential_elapsed >= 4 * 0.3
+    assert parallel_elapsed < 3 * 0.3
+    assert sorted(server.get_round_trips().values()) == [1, 1, 1, 1]
+
+
+def test_parallel_fetch_all_data_logs_in_again_once(server):
+    client = HydrocaptClient("user", "password", base_url=server.base_url)
+    client.fetch_all_data(parallel=True)
+    server.expire_sessions()
+    server.reset_round_trips()
+
+    client.fetch_all_data(parallel=True, force_refresh=True)
+
+    assert server.get_round_trips()["/pool/poolLogin/login"] == 1
+
+
+def _gets(server, path):
+    return server.get_round_trips().get(path, 0)
+
+
+def test_reads_are_cached_for_their_ttl(server):
+    client = HydrocaptClient("user", "password", base_url=server.base_url, cache_ttl={"commands": 0.5})
+    first = client.get_commands_current_states()
+    first["Light"] = "changed by the caller"
+    server.reset_round_trips()
+
+    # a copy of the cached values is returned
+    assert client.get_commands_current_states()["Light"] != "changed by the caller"
+    assert _gets(server, "/pool/ajaxCommands/get") == 0
+
+    assert client.get_commands_current_states(max_age=0) is not None
+    assert client.get_commands_current_states(force_refresh=True) is not None
+    assert _gets(server, "/pool/ajaxCommands/get") == 2
+
+    time.sleep(0.6)
+    client.get_commands_current_states()
+    assert _gets(server, "/pool/ajaxCommands/get") == 3
+
+    client.invalidate_cache("commands")
+    client.get_commands_current_states()
+    assert _gets(server, "/pool/ajaxCommands/get") == 4
+
+
+def test_resources_without_ttl_are_not_cached(server):
+    client = HydrocaptClient("user", "password", base_url=server.base_url, cache_ttl={"consigns": 0})
+    client.get_current_consigns()
+    client.get_current_consigns()
+    assert _gets(server, "/pool/ajaxSetpoints/get") == 2
+
+
+def test_saves_write_through_the_cache(client, server):
+    new_state = _other_light_state(client)
+    client.set_command_state("Light", new_state)
+    server.reset_round_trips()
+
+    # the confirmed values are cached
+    assert client.get_commands_current_states()["Light"] == new_state
+    # a save of the current value is not confirmed by a read, its value is written through
+    client.set_command_state("Light", new_state)
+    assert client.last_confirmation.attempts == 0
+    assert client.get_commands_current_states()["Light"] == new_state
+    assert _gets(server, "/pool/ajaxCommands/get") == 0
+
+
+def test_read_started_before_a_save_is_not_cached(client):
+    states = client.get_commands_current_states(force_refresh=True)
+    version = client._get_write_version("commands")
+    client._begin_write("commands")
+
+    client._set_read("commands", dict(states, Light="old"), version)
+    assert client.get_commands_current_states()["Light"] == states["Light"]
+
+    client._set_read("commands", dict(states, Light="new"), client._get_write_version("commands"))
+    assert client.get_commands_current_states()["Light"] == "new"
+
+
+def test_alarm_thresholds_are_cached_for_a_day(client, server):
+    client.get_pool_measure_latest()
+    client.get_pool_measure_latest(force_refresh=True)
+    client.get_pool_measure_latest(force_refresh=True)
+    assert _gets(server, "/pool/ajaxHistoric/getJsonValues") == 3
+    assert _gets(server, "/pool/ajaxAlarms/get") == 1
+    assert client.cache_ttl["alarms"] == 24 * 3600
+
+
+def test_refresh_alarm_thresholds(client, server):
+    measures = client.get_pool_measure_latest()
+    assert client.get_alarm_thresholds()["PH"]["min"] == 7.0
+
+    # the new limits are only used once refreshed
+    pool = server.get_pool(1234)
+    pool.alarms["PH"] = (measures["ph"] + 1, measures["ph"] + 2, 1)
+    assert client.get_pool_measure_latest(force_refresh=True)["ph_status"] == measures["ph_status"]
+
+    assert client.refresh_alarm_thresholds()["PH"]["min"] == measures["ph"] + 1
+    assert client.get_pool_measure_latest(force_refresh=True)["ph_status"] == "TooLow"
+    assert _gets(server, "/pool/ajaxAlarms/get") == 2
+
+
+def _record_posts(client):
+    session = client._get_session()
+    post = session.post
+    posts = []
+
+    def recording_post(url, data, headers=None):
+        posts.append(dict(data))
+        return post(url, data, headers)
+
+    session.post = recording_post
+    return posts
+
+
+def test_set_commands_sends_the_changes_in_one_save(client, server):
+    before = client.get_commands_current_states(force_refresh=True)
+    light = _other_light_state(client)
+    posts = _record_posts(client)
+    server.reset_round_trips()
+
+    prev = client.set_commands({"Light": light, "Heating Regulation": before["Heating Regulation"], "Filtration": "Filtration ON"})
+
+    assert prev == {"Light": before["Light"], "Heating Regulation": before["Heating Regulation"], "Filtration": before["Filtration"]}
+    # the command already in the requested state is not sent
+    assert posts == [{"lighting": 0 if light == "Pool Light ON" else 2, "filtration": 1, "serial": 1234}]
+    assert _gets(server, "/pool/ajaxCommands/save") == 1
+    assert client.last_confirmation.confirmed is True and client.last_confirmation.attempts == 1
+    states = client.get_commands_current_states(force_refresh=True)
+    assert states["Light"] == light and states["Filtration"] == "Filtration ON"
+
+
+def test_set_commands_without_change_sends_nothing(client, server):
+    before = client.get_commands_current_states(force_refresh=True)
+    server.reset_round_trips()
+
+    assert client.set_commands({"Light": before["Light"]}) == {"Light": before["Light"]}
+    assert _gets(server, "/pool/ajaxCommands/save") == 0
+    assert client.last_confirmation.confirmed is True and client.last_confirmation.attempts == 0
+
+
+def test_set_commands_unknown_command(client, server):
+    with pytest.raises(HydrocaptError):
+        client.set_commands({"Light": "Pool Light ON", "Sauna": "ON"})
+    assert _gets(server, "/pool/ajaxCommands/save") == 0
+
+
+def test_set_consign_timer_hour(client, server):
+    prev_timer = client.get_current_consigns(force_refresh=True)["Lighting Timer"]
+
+    # by external or internal name, the previous timer is returned like by the batch methods
+    assert client.set_consign_timer_hour("timer_lighting", 3, not prev_timer[3]) == prev_timer
+    timer = client.get_current_consigns(force_refresh=True)["Lighting Timer"]
+    assert timer[3] is not prev_timer[3] and timer[:3] + timer[4:] == prev_timer[:3] + prev_timer[4:]
+
+    server.reset_round_trips()
+    for consign, hour in (("setpoint_heating", 3), ("Lighting Timer", 24), ("Lighting Timer", -1), ("Sauna Timer", 3)):
+        with pytest.raises(HydrocaptError):
+            client.set_consign_timer_hour(consign, hour, True)
+    assert _gets(server, "/pool/ajaxSetpoints/save") == 0
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt import HydrocaptConfirmation
+from py_hydrocapt.deadline import check_remaining
+from py_hydrocapt.deadline import check_wait
+from py_hydrocapt.deadline import deadline_scope
+from py_hydrocapt.deadline import get_remaining
+from py_hydrocapt.deadline import get_timeout
+from py_hydrocapt.deadline import with_deadline
+from py_hydrocapt.exceptions import HydrocaptDeadlineExceeded
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+from py_hydrocapt.transport import HydrocaptHttpSettings
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+def test_scopes_keep_the_soonest_deadline():
+    assert get_remaining() is None
+    with deadline_scope(None):
+        assert get_remaining() is None
+
+    with deadline_scope(10):
+        assert 9 < get_remaining() <= 10
+        with deadline_scope(1):
+            assert 0 < get_remaining() <= 1
+        with deadline_scope(100):
+            assert 9 < get_remaining() <= 10
+        with deadline_scope(None):
+            assert 9 < get_remaining() <= 10
+        assert 9 < get_remaining() <= 10
+
+    assert get_remaining() is None
+
+
+def test_with_deadline():
+
+    @with_deadline
+    def remaining():
+        return get_remaining()
+
+    @with_deadline
+    async def async_remaining():
+        return get_remaining()
+
+    assert remaining() is None
+    assert 0 < remaining(deadline=2) <= 2
+    with deadline_scope(1):
+        assert 0 < remaining(deadline=2) <= 1
+    assert 0 < asyncio.run(async_remaining(deadline=2)) <= 2
+    assert get_remaining() is None
+
+
+def test_timeouts_are_clamped_to_the_deadline():
+    assert get_timeout(30) == 30
+    assert get_timeout(None) is None
+
+    with deadline_scope(5):
+        assert get_timeout(1) == 1
+        assert 4 < get_timeout(30) <= 5
+        assert 4 < get_timeout(None) <= 5
+
+    with deadline_scope(0.01):
+        time.sleep(0.02)
+        with pytest.raises(HydrocaptDeadlineExceeded):
+            get_timeout(30)
+        with pytest.raises(HydrocaptDeadlineExceeded):
+            check_remaining()
+
+
+def test_waits_longer_than_the_deadline_fail_at_once():
+    assert check_wait(100) == 100
+    with deadline_scope(1):
+        assert check_wait(0.5) == 0.5
+        with pytest.raises(HydrocaptDeadlineExceeded):
+            check_wait(1)
+
+
+def test_wait_confirmation_raises_at_the_deadline(server):
+    server.apply_delay = 5
+    client = HydrocaptClient("user", "password", base_url=server.base_url)
+    values = {"Light": "Pool Light OFF" if client.get_commands_current_states()["Light"] != "Pool Light OFF" else "Pool Light ON"}
+    client.set_commands(values, confirmation=HydrocaptConfirmation(enabled=False))
+
+    start = time.monotonic()
+    with deadline_scope(0.5):
+        with pytest.raises(HydrocaptDeadlineExceeded):
+            client._wait_confirmation("commands", values, HydrocaptConfirmation(first_delay=0.2, backoff=2.0, max_delay=1.0, deadline=5))
+    # the wait that would end after the deadline is not started
+    assert time.monotonic() - start < 0.5
+    assert client.last_confirmation.confirmed is False
+
+
+def test_idle_connections_are_closed_after_the_keepalive_timeout(server):
+    client = HydrocaptClient("user", "password", base_url=server.base_url, http_settings=HydrocaptHttpSettings(keepalive_timeout=0.2))
+    client.get_commands_current_states()
+
+    session = client.session._session
+    closes = []
+    close = session.close
+    session.close = lambda: closes.append(close())
+
+    client.get_commands_current_states(force_refresh=True)
+    assert closes == []
+
+    time.sleep(0.3)
+    # the connections are dropped before the request, which opens a new one
+    assert len(client.get_commands_current_states(force_refresh=True)) > 0
+    assert len(closes) == 1
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import time
+
+import pytest
+import requests
+
+from py_hydrocapt.const import HYDROCAPT_STATUS_NOT_AUTHENTICATED
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+
+
+def _login(server, username="user", password="password"):
+    session = requests.Session()
+    session.post(server.base_url + "/pool/poolLogin/login", data={"login": username, "pass": password})
+    return session
+
+
+def _get_commands(server, session, serial=1234):
+    return session.get(server.base_url + "/pool/ajaxCommands/get", params={"serial": serial}).text
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+def test_login_gives_access_to_the_owned_pool_only(server):
+    server.add_pool("other", "secret", 5678)
+    session = _login(server)
+
+    assert "PHPSESSID" in session.cookies
+    assert "<serial>1234</serial>" in _get_commands(server, session)
+    assert HYDROCAPT_STATUS_NOT_AUTHENTICATED in _get_commands(server, session, 5678)
+
+    page = session.get(server.base_url + "/pool/poolEdit/own").text
+    assert "value='1234'" in page
+
+
+def test_wrong_password_is_not_logged_in(server):
+    session = _login(server, password="wrong")
+
+    assert "PHPSESSID" not in session.cookies
+    assert HYDROCAPT_STATUS_NOT_AUTHENTICATED in _get_commands(server, session)
+
+
+def test_sessions_expire(server):
+    session = _login(server)
+    server.expire_sessions()
+    assert HYDROCAPT_STATUS_NOT_AUTHENTICATED in _get_commands(server, session)
+
+    server.session_ttl = 0.1
+    session = _login(server)
+    assert "<status>OK</status>" in _get_commands(server, session)
+    time.sleep(0.2)
+    assert HYDROCAPT_STATUS_NOT_AUTHENTICATED in _get_commands(server, session)
+
+
+def test_history_answers_json_when_not_authenticated(server):
+    answer = requests.get(server.base_url + "/pool/ajaxHistoric/getJsonValues", params={"serial": 1234, "date": "2024-01-01"})
+
+    assert answer.headers["Content-Type"] == "application/json"
+    assert answer.json() == {"error": HYDROCAPT_STATUS_NOT_AUTHENTICATED}
+
+
+def test_saves_are_applied_after_the_delay(server):
+    server.apply_delay = 0.3
+    session = _login(server)
+    save_url = server.base_url + "/pool/ajaxCommands/save"
+
+    assert "<status>OK</status>" in session.post(save_url, data={"serial": 1234, "lighting": 0}).text
+    assert "<lighting>2</lighting>" in _get_commands(server, session)
+    time.sleep(0.4)
+    assert "<lighting>0</lighting>" in _get_commands(server, session)
+    assert server.get_pool(1234).commands["lighting"] == 0
+
+    # saving the current value changes nothing
+    assert "Pas de modification" in session.post(save_url, data={"serial": 1234, "lighting": 0}).text
+
+
+def test_round_trips_are_counted_per_path(server):
+    session = _login(server)
+    _get_commands(server, session)
+    _get_commands(server, session)
+
+    assert server.get_round_trips() == {"/pool/poolLogin/login": 1, "/pool/ajaxCommands/get": 2}
+    server.reset_round_trips()
+    assert server.get_round_trips() == {}
+
+
+def test_error_rate():
+    with HydrocaptFakeServer(error_rate=1.0) as srv:
+        srv.add_pool("user", "password", 1234)
+        assert requests.get(srv.base_url + "/pool/ajaxCommands/get").status_code == 500
+
+    with HydrocaptFakeServer(error_rate=0.5, seed=1) as srv:
+        codes = {requests.get(srv.base_url + "/unknown").status_code for _ in range(20)}
+        assert codes == {404, 500}
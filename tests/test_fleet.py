@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import threading
+from concurrent.futures import wait
+
+import pytest
+
+from py_hydrocapt.exceptions import HydrocaptDeadlineExceeded
+from py_hydrocapt.exceptions import HydrocaptError
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+from py_hydrocapt.fleet import HydrocaptFleet
+
+_POOLS = (1, 2, 3)
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        for serial in _POOLS:
+            srv.add_pool("user", "password", serial)
+        yield srv
+
+
+def _fleet(server, **kwargs):
+    return HydrocaptFleet([("user", "password", serial) for serial in _POOLS], base_url=server.base_url, **kwargs)
+
+
+def _record_order(fleet):
+    order = []
+    for client in fleet.clients:
+        def fetch_all_data(client=client, fetch=client.fetch_all_data, **kwargs):
+            order.append(client.pool_internal_id)
+            return fetch(**kwargs)
+        client.fetch_all_data = fetch_all_data
+    return order
+
+
+def test_refresh_all(server):
+    with _fleet(server) as fleet:
+        results = fleet.refresh_all()
+
+    assert [r.pool_internal_id for r in results] == list(_POOLS)
+    assert all(r.error is None and "Light" in r.data for r in results)
+    # the pools of the same account share one login
+    assert server.get_round_trips()["/pool/poolLogin/login"] == 1
+
+
+def test_starting_pool_rotates(server):
+    with _fleet(server, max_concurrency=1) as fleet:
+        order = _record_order(fleet)
+        for _ in range(3):
+            fleet.refresh_all()
+
+    assert order == [1, 2, 3, 2, 3, 1, 3, 1, 2]
+
+
+def test_pool_still_refreshing_is_not_queued_again(server):
+    with _fleet(server) as fleet:
+        release = threading.Event()
+        slow = fleet.clients[0]
+        fetch = slow.fetch_all_data
+        calls = []
+
+        def held_fetch_all_data(**kwargs):
+            calls.append(kwargs)
+            release.wait(5)
+            return fetch(**kwargs)
+
+        slow.fetch_all_data = held_fetch_all_data
+
+        first = fleet.refresh_all(timeout=0.3)
+        second = fleet.refresh_all(timeout=1.0)
+        release.set()
+        wait(list(fleet._in_flight.values()), timeout=5)
+        third = fleet.refresh_all()
+
+    for results in (first, second):
+        assert isinstance(results[0].error, HydrocaptError) and "still running" in str(results[0].error)
+        assert all(r.error is None for r in results[1:])
+    assert len(calls) == 2
+    assert all(r.error is None for r in third)
+
+
+def test_timeout_is_the_deadline_of_each_refresh(server):
+    server.latency = 0.5
+    with _fleet(server) as fleet:
+        results = fleet.refresh_all(timeout=0.8)
+        # the refreshes end at the same time as the wait, either error can be reported
+        assert all(r.data is None and isinstance(r.error, HydrocaptError) for r in results)
+
+        # the refreshes themselves give up at the deadline instead of running on
+        done, not_done = wait(list(fleet._in_flight.values()), timeout=1.0)
+        assert len(not_done) == 0
+        for future in done:
+            assert isinstance(future.result().error, HydrocaptDeadlineExceeded)
+            assert future.result().duration < 1.0
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from datetime import date
+from datetime import timedelta
+
+import pytest
+
+from py_hydrocapt import AsyncHydrocaptClient
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt.deadline import deadline_scope
+from py_hydrocapt.exceptions import HydrocaptDeadlineExceeded
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+def _last_days(count):
+    end = date.today() - timedelta(days=1)
+    return end - timedelta(days=count - 1), end
+
+
+def test_iter_history_deadline(server):
+    client = HydrocaptClient("user", "password", base_url=server.base_url)
+    client.is_connection_ok()
+    server.latency = 0.3
+    start, end = _last_days(10)
+
+    began = time.monotonic()
+    with pytest.raises(HydrocaptDeadlineExceeded):
+        list(client.iter_history(start, end, max_in_flight=2, deadline=0.5))
+    assert time.monotonic() - began < 1.0
+
+    began = time.monotonic()
+    with deadline_scope(0.5):
+        with pytest.raises(HydrocaptDeadlineExceeded):
+            list(client.iter_history(start, end, max_in_flight=2))
+    assert time.monotonic() - began < 1.0
+
+
+def test_async_iter_history_deadline(server):
+    start, end = _last_days(10)
+
+    async def run():
+        async with AsyncHydrocaptClient("user", "password", base_url=server.base_url) as client:
+            await client.is_connection_ok()
+            server.latency = 0.3
+            with pytest.raises(HydrocaptDeadlineExceeded):
+                async for _ in client.iter_history(start, end, max_in_flight=2, deadline=0.5):
+                    pass
+
+    began = time.monotonic()
+    asyncio.run(run())
+    assert time.monotonic() - began < 1.5
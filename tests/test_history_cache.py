@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+from datetime import datetime
+
+from py_hydrocapt.history_cache import HydrocaptHistoryCache
+
+DAY = date(2026, 10, 17)
+
+
+def _answer(values):
+    return {"records": [{"typeInfo": "DATE", "values": [DAY.isoformat()] * 25},
+                        {"typeInfo": "PH", "values": values}]}
+
+
+def test_only_finished_days_with_measures_are_stored(tmp_path):
+    cache = HydrocaptHistoryCache(str(tmp_path))
+    full = _answer(["7.2"] * 25)
+
+    # not over yet, or within the settle delay of the last hour
+    assert cache.put(1234, DAY, full, fetched_at=datetime(2026, 10, 17, 20)) is False
+    assert cache.put(1234, DAY, full, fetched_at=datetime(2026, 10, 18, 1)) is False
+    # not filled by the cloud yet
+    assert cache.put(1234, DAY, {"records": []}, fetched_at=datetime(2026, 10, 19)) is False
+    assert cache.put(1234, DAY, _answer(["--.-"] * 25), fetched_at=datetime(2026, 10, 19)) is False
+    assert cache.get(1234, DAY) is None
+    assert cache.missing_days(1234, DAY, DAY) == [DAY]
+
+    assert cache.put(1234, DAY, full, fetched_at=datetime(2026, 10, 19)) is True
+    assert cache.get(1234, DAY) == full
+    assert cache.missing_days(1234, DAY, DAY) == []
+
+
+def test_weeks_and_months_are_stored_once_over(tmp_path):
+    cache = HydrocaptHistoryCache(str(tmp_path))
+    month = _answer(["7.2"] * 31)
+
+    assert cache.put(1234, date(2026, 10, 1), month, fetched_at=datetime(2026, 10, 20), type_date="month") is False
+    assert cache.put(1234, date(2026, 10, 1), month, fetched_at=datetime(2026, 11, 2), type_date="month") is True
+    assert cache.get(1234, date(2026, 10, 1), "month") == month
+    # kept apart from the answer of the first day
+    assert cache.get(1234, date(2026, 10, 1)) is None
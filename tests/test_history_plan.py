@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from datetime import date
+from datetime import timedelta
+
+import pytest
+
+from py_hydrocapt.const import HYDROCAPT_RESOLUTION_DAY
+from py_hydrocapt.const import HYDROCAPT_RESOLUTION_HOUR
+from py_hydrocapt.exceptions import HydrocaptError
+from py_hydrocapt.history import HydrocaptHistoryRequest
+from py_hydrocapt.history import iter_days
+from py_hydrocapt.history import plan_history_requests
+
+
+def _plan(start, end):
+    return [(r.type_date, str(r.start), str(r.end)) for r in plan_history_requests(start, end, HYDROCAPT_RESOLUTION_DAY)]
+
+
+def test_full_year_is_one_request_per_month():
+    plan = _plan("2025-01-01", "2025-12-31")
+    assert len(plan) == 12
+    assert all(t == "month" for t, _, _ in plan)
+    assert plan[1] == ("month", "2025-02-01", "2025-02-28")
+    assert plan[-1] == ("month", "2025-12-01", "2025-12-31")
+
+
+def test_across_two_months():
+    assert _plan("2025-01-15", "2025-02-10") == [
+        ("month", "2025-01-01", "2025-01-31"),
+        ("month", "2025-02-01", "2025-02-28"),
+    ]
+
+
+def test_week_across_a_month_edge():
+    assert _plan("2025-01-29", "2025-02-03") == [
+        ("week", "2025-01-27", "2025-02-02"),
+        ("day", "2025-02-03", "2025-02-03"),
+    ]
+
+
+def test_few_days_of_a_week():
+    assert _plan("2025-03-03", "2025-03-05") == [("week", "2025-03-03", "2025-03-09")]
+
+
+def test_single_day():
+    assert _plan("2025-03-04", "2025-03-04") == [("day", "2025-03-04", "2025-03-04")]
+
+
+def test_year_edge():
+    assert _plan("2024-12-29", "2025-01-04") == [
+        ("day", "2024-12-29", "2024-12-29"),
+        ("week", "2024-12-30", "2025-01-05"),
+    ]
+    assert _plan("2024-12-20", "2025-01-10") == [
+        ("month", "2024-12-01", "2024-12-31"),
+        ("month", "2025-01-01", "2025-01-31"),
+    ]
+
+
+def test_empty_range():
+    assert _plan("2025-03-05", "2025-03-03") == []
+
+
+def test_hourly_resolution_is_one_day_per_request():
+    plan = list(plan_history_requests(date(2024, 12, 30), date(2025, 1, 2), HYDROCAPT_RESOLUTION_HOUR))
+    assert plan == [HydrocaptHistoryRequest("day", d, d) for d in iter_days("2024-12-30", "2025-01-02")]
+
+
+def test_unknown_resolution():
+    with pytest.raises(HydrocaptError):
+        plan_history_requests("2025-01-01", "2025-01-02", "minute")
+
+
+@pytest.mark.parametrize("start", [date(2024, 11, 17) + timedelta(days=i * 5) for i in range(12)])
+@pytest.mark.parametrize("length", [1, 4, 9, 20, 45, 80])
+def test_plan_covers_the_range_in_order(start, length):
+    end = start + timedelta(days=length - 1)
+    plan = list(plan_history_requests(start, end, HYDROCAPT_RESOLUTION_DAY))
+    covered = set()
+    for r in plan:
+        covered.update(iter_days(r.start, r.end))
+    assert set(iter_days(start, end)) <= covered
+    assert [r.start for r in plan] == sorted(r.start for r in plan)
+    # never more requests than one per day or one per month touched
+    months = (end.year - start.year) * 12 + end.month - start.month + 1
+    assert len(plan) <= min(length, months)
+
+
+def test_plans_are_iterated():
+    # a thousand years of hourly history, the requests are made as they are consumed
+    plan = plan_history_requests(date(1900, 1, 1), date(2899, 12, 31), HYDROCAPT_RESOLUTION_HOUR)
+    assert next(plan) == HydrocaptHistoryRequest("day", date(1900, 1, 1), date(1900, 1, 1))
+
+    plan = plan_history_requests(date(1995, 1, 1), date(2024, 12, 31), HYDROCAPT_RESOLUTION_DAY)
+    assert next(plan) == HydrocaptHistoryRequest("month", date(1995, 1, 1), date(1995, 1, 31))
+    assert sum(1 for _ in plan) == 30 * 12 - 1
@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+import os
+import subprocess
+import sys
+
+import pytest
+
+_HEAVY = ("requests", "lxml", "aiohttp", "numpy")
+
+
+def _loaded_after(statement, modules=_HEAVY):
+    code = f"import sys\n{statement}\nprint(' '.join(m for m in {tuple(modules)!r} if m in sys.modules))"
+    # the child sees the same paths as the tests, src included
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(p for p in sys.path if p))
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True, env=env).stdout
+    return out.split()
+
+
+@pytest.mark.parametrize("statement", ["import py_hydrocapt", "import py_hydrocapt.const", "from py_hydrocapt import const"])
+def test_import_does_not_load_the_dependencies(statement):
+    assert _loaded_after(statement) == []
+
+
+def test_the_classes_are_imported_on_first_use():
+    modules = ("py_hydrocapt.client", "py_hydrocapt.async_client")
+    assert _loaded_after("import py_hydrocapt; 'HydrocaptClient' in dir(py_hydrocapt)", modules) == []
+    assert _loaded_after("import py_hydrocapt; py_hydrocapt.HydrocaptClient", modules) == ["py_hydrocapt.client"]
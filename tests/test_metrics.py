@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt import HydrocaptMetrics
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+def test_prometheus_format():
+    metrics = HydrocaptMetrics(latency_buckets=(0.5, 0.1), parse_buckets=(0.01,))
+    event = metrics.request_started("GET", "https://www.hydrocapt.fr/pool/ajaxCommands/get?serial=1234")
+    metrics.request_ended(event, status=200, bytes_received=120)
+    event = metrics.request_started("POST", "https://www.hydrocapt.fr/pool/ajaxCommands/save", bytes_sent=30)
+    metrics.request_ended(event, status=500)
+    metrics.record_retry("https://www.hydrocapt.fr/pool/ajaxCommands/save")
+    metrics.record_login(relogin=True)
+    metrics.record_coalesced("commands")
+    metrics.record_parse("commands", 0.5)
+
+    lines = metrics.to_prometheus().splitlines()
+
+    # every metric has its help and type before its samples
+    for i, line in enumerate(lines):
+        if line.startswith("# HELP "):
+            name = line.split()[2]
+            assert lines[i + 1].startswith(f"# TYPE {name} ")
+        elif not line.startswith("#"):
+            assert line.split()[0].split("{")[0].startswith("hydrocapt_")
+            float(line.rsplit(" ", 1)[1])
+
+    # the buckets are sorted and cumulative, up to +Inf
+    assert 'hydrocapt_request_duration_seconds_bucket{endpoint="ajaxCommands/get",le="0.1"}' in lines[2]
+    assert 'hydrocapt_request_duration_seconds_bucket{endpoint="ajaxCommands/get",le="0.5"}' in lines[3]
+    assert lines[4] == 'hydrocapt_request_duration_seconds_bucket{endpoint="ajaxCommands/get",le="+Inf"} 1'
+    assert 'hydrocapt_request_duration_seconds_count{endpoint="ajaxCommands/get"} 1' in lines
+    assert 'hydrocapt_parse_duration_seconds_bucket{kind="commands",le="0.01"} 0' in lines
+    assert 'hydrocapt_parse_duration_seconds_bucket{kind="commands",le="+Inf"} 1' in lines
+
+    assert 'hydrocapt_request_errors_total{endpoint="ajaxCommands/get"} 0' in lines
+    assert 'hydrocapt_request_errors_total{endpoint="ajaxCommands/save"} 1' in lines
+    assert 'hydrocapt_request_retries_total{endpoint="ajaxCommands/save"} 1' in lines
+    assert 'hydrocapt_sent_bytes_total{endpoint="ajaxCommands/save"} 30' in lines
+    assert 'hydrocapt_received_bytes_total{endpoint="ajaxCommands/get"} 120' in lines
+    assert "hydrocapt_logins_total 1" in lines
+    assert "hydrocapt_relogins_total 1" in lines
+    assert 'hydrocapt_coalesced_reads_total{resource="commands"} 1' in lines
+
+    assert metrics.to_prometheus(prefix="pool").startswith("# HELP pool_request_duration_seconds ")
+
+
+def test_a_raising_hook_does_not_break_the_requests(server):
+    metrics = HydrocaptMetrics()
+    ended = []
+
+    def broken(event):
+        raise RuntimeError("broken hook")
+
+    metrics.subscribe(on_request_start=broken, on_request_end=broken)
+    unsubscribe = metrics.subscribe(on_request_end=ended.append)
+    client = HydrocaptClient("user", "password", base_url=server.base_url, metrics=metrics)
+
+    assert client.get_commands_current_states(force_refresh=True)
+    assert [e.endpoint for e in ended] == ["poolLogin/login", "poolEdit/own", "ajaxCommands/get"]
+    assert all(e.status == 200 and e.duration is not None for e in ended)
+    assert metrics.snapshot()["endpoints"]["ajaxCommands/get"]["requests"] == 1
+
+    unsubscribe()
+    client.get_commands_current_states(force_refresh=True)
+    assert len(ended) == 3
+    assert metrics.snapshot()["endpoints"]["ajaxCommands/get"]["requests"] == 2
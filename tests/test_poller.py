@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+from datetime import datetime
+
+from py_hydrocapt import AsyncHydrocaptPoller
+from py_hydrocapt import HydrocaptPoller
+from py_hydrocapt.poller import _HydrocaptPollSchedule
+
+
+class _Clock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def _schedule(clock, jitter=0.0):
+    return _HydrocaptPollSchedule(30, 300, True, settle_delay=120, jitter=jitter, catch_up=60, error_delay=15, clock=clock)
+
+
+def test_everything_is_read_at_start_then_at_its_interval():
+    clock = _Clock()
+    schedule = _schedule(clock)
+    assert set(schedule.next_poll) == {"commands", "consigns", "measures"}
+    assert schedule.get_next()[1] == 0.0
+
+    schedule.done("commands", {})
+    schedule.done("consigns", {})
+    schedule.failed("measures")
+    assert schedule.get_next() == ("measures", 15.0)
+
+    clock.now += 20
+    assert schedule.get_next() == ("measures", 0.0)
+    schedule.done("measures", {"date_time": None})
+    assert schedule.get_next() == ("commands", 10.0)
+
+    schedule = _HydrocaptPollSchedule(None, None, False, 120, 0.0, 60, 15, clock=clock)
+    assert schedule.get_next() == (None, 0.0)
+
+
+def test_measures_are_read_after_the_next_sample():
+    schedule = _schedule(_Clock())
+    now = datetime(2024, 6, 1, 10, 20)
+
+    # the 10:00 sample is expected on the server at 11:02
+    assert schedule.measures_delay(datetime(2024, 6, 1, 10, 0), now) == 42 * 60
+    assert schedule.last_sample == datetime(2024, 6, 1, 10, 0)
+
+    schedule = _schedule(_Clock(), jitter=30)
+    for _ in range(20):
+        schedule.last_sample = None
+        delay = schedule.measures_delay(datetime(2024, 6, 1, 10, 0), now)
+        assert 42 * 60 <= delay <= 42 * 60 + 30
+
+
+def test_late_measures_catch_up_doubling_up_to_an_hour():
+    schedule = _schedule(_Clock())
+    sample = datetime(2024, 6, 1, 10, 0)
+    schedule.measures_delay(sample, datetime(2024, 6, 1, 10, 20))
+
+    # the 11:00 sample is not there at 11:02, nor at the next reads
+    now = datetime(2024, 6, 1, 11, 2)
+    delays = [schedule.measures_delay(sample, now) for _ in range(8)]
+    assert delays == [60, 120, 240, 480, 960, 1920, 3600, 3600]
+
+    # a new sample resets the catch up
+    assert schedule.measures_delay(datetime(2024, 6, 1, 11, 0), datetime(2024, 6, 1, 12, 30)) == 60
+    assert schedule.measures_delay(datetime(2024, 6, 1, 12, 0), datetime(2024, 6, 1, 12, 30)) == 32 * 60
+
+    # a sample far in the past does not make it wait more than an hour
+    schedule = _schedule(_Clock())
+    assert schedule.measures_delay(datetime(2024, 6, 1, 10, 0), datetime(2024, 6, 1, 8, 0)) == 3600
+
+
+class _FailingClient(object):
+
+    def __init__(self):
+        self.reads = 0
+        self.read_twice = threading.Event()
+
+    def get_commands_current_states(self, force_refresh=False):
+        self.reads += 1
+        if self.reads >= 2:
+            self.read_twice.set()
+        raise RuntimeError("read failed")
+
+
+class _AsyncFailingClient(_FailingClient):
+
+    async def get_commands_current_states(self, force_refresh=False):
+        self.reads += 1
+        raise RuntimeError("read failed")
+
+
+def _broken_handler(resource, error):
+    raise ValueError("broken handler")
+
+
+def test_a_raising_error_handler_does_not_stop_the_poller():
+    client = _FailingClient()
+    with HydrocaptPoller(client, consigns_interval=None, measures=False, error_delay=0.01, on_error=_broken_handler) as poller:
+        assert client.read_twice.wait(5)
+        assert poller._thread.is_alive()
+
+
+def test_a_raising_error_handler_does_not_stop_the_async_poller():
+    client = _AsyncFailingClient()
+
+    async def run():
+        poller = AsyncHydrocaptPoller(client, consigns_interval=None, measures=False, error_delay=0.01, on_error=_broken_handler)
+        async with poller:
+            for _ in range(500):
+                if client.reads >= 2:
+                    break
+                await asyncio.sleep(0.01)
+            assert not poller._task.done()
+
+    asyncio.run(run())
+    assert client.reads >= 2
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from py_hydrocapt.retry import is_session_expired
+
+_URL = "https://www.hydrocapt.fr/pool/getCommands"
+
+
+@pytest.mark.parametrize("status", [401, 403, 440])
+def test_expired_status(status):
+    assert is_session_expired(status, _URL, b"")
+
+
+def test_redirect_to_login_page():
+    assert is_session_expired(200, "https://www.hydrocapt.fr/pool/poolLogin?next=x", b"<html></html>")
+
+
+@pytest.mark.parametrize("content", [
+    b'{"error": "You are not authenticated"}',
+    b'<?xml version="1.0" encoding="UTF-8"?><root><status>You are not authenticated</status></root>',
+    b'  \n{"error": "You are not authenticated"}',
+])
+def test_not_authenticated_body(content):
+    assert is_session_expired(200, _URL, content)
+
+
+@pytest.mark.parametrize("content", [
+    b'{"error": "Unknown pool"}',
+    b'{"error": "Bad parameter"}',
+    b'{"commands": {"pump": 1}}',
+    b"",
+])
+def test_other_answers(content):
+    assert not is_session_expired(200, _URL, content)
+
+
+def test_server_error_is_not_expired():
+    assert not is_session_expired(500, _URL, b'{"error": "Internal error"}')
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import pytest
+from requests.cookies import RequestsCookieJar
+
+from py_hydrocapt import AsyncHydrocaptClient
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt.exceptions import HydrocaptError
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+from py_hydrocapt.session_store import HydrocaptSessionStore
+
+
+def _jar(value):
+    jar = RequestsCookieJar()
+    jar.set("JSESSIONID", value, domain="", path="/")
+    return jar
+
+
+def test_sessions_are_kept_per_server(tmp_path):
+    store = HydrocaptSessionStore(str(tmp_path / "sessions.json"))
+    store.save("user", _jar("a"), 1, "http://a.example")
+    store.save("user", _jar("b"), 2, "http://b.example")
+    store.save("user", _jar("c"), 3)
+
+    assert store.load("user", "http://a.example")[1] == 1
+    assert store.load("user", "http://b.example")[1] == 2
+    assert store.load("user")[1] == 3
+
+    store.invalidate("user", "http://a.example")
+    assert store.load("user", "http://a.example") is None
+    assert store.load("user", "http://b.example")[1] == 2
+
+
+def test_rejected_restored_session_is_forgotten(tmp_path):
+    store = HydrocaptSessionStore(str(tmp_path / "sessions.json"))
+    with HydrocaptFakeServer(session_ttl=0.2) as server:
+        pool = server.add_pool("user", "password", 1234)
+        HydrocaptClient("user", "password", base_url=server.base_url, session_store=store).get_commands_current_states()
+        assert store.load("user", server.base_url) is not None
+
+        # the stored session expires and the new login fails
+        time.sleep(0.3)
+        pool.password = "changed"
+        client = HydrocaptClient("user", "password", base_url=server.base_url, session_store=store)
+        with pytest.raises(HydrocaptError):
+            client.get_commands_current_states()
+        assert store.load("user", server.base_url) is None
+
+
+def test_expired_restored_session_is_replaced(tmp_path):
+    invalidated = []
+
+    class Store(HydrocaptSessionStore):
+        def invalidate(self, username, base_url=None):
+            invalidated.append(username)
+            super().invalidate(username, base_url)
+
+    store = Store(str(tmp_path / "sessions.json"))
+    with HydrocaptFakeServer(session_ttl=0.2) as server:
+        server.add_pool("user", "password", 1234)
+        HydrocaptClient("user", "password", base_url=server.base_url, session_store=store).get_commands_current_states()
+        old_cookies = {c.name: c.value for c in store.load("user", server.base_url)[0]}
+
+        time.sleep(0.3)
+        client = HydrocaptClient("user", "password", base_url=server.base_url, session_store=store)
+        assert len(client.get_commands_current_states()) > 0
+        assert invalidated == ["user"]
+        assert {c.name: c.value for c in store.load("user", server.base_url)[0]} != old_cookies
+
+
+def test_async_session_is_restored(tmp_path):
+    store = HydrocaptSessionStore(str(tmp_path / "sessions.json"))
+
+    async def read(server):
+        async with AsyncHydrocaptClient("user", "password", base_url=server.base_url, session_store=store) as client:
+            return await client.get_commands_current_states()
+
+    with HydrocaptFakeServer() as server:
+        server.add_pool("user", "password", 1234)
+        assert len(asyncio.run(read(server))) > 0
+        assert store.load("user", server.base_url)[1] == 1234
+
+        # a new process reuses the stored session, the login and the pool page are not asked again
+        server.reset_round_trips()
+        assert len(asyncio.run(read(server))) > 0
+        assert server.get_round_trips() == {"/pool/ajaxCommands/get": 1}
+
+        # the sessions stored by the sync client are reused too
+        store.invalidate("user", server.base_url)
+        HydrocaptClient("user", "password", base_url=server.base_url, session_store=store).get_commands_current_states()
+        server.reset_round_trips()
+        assert len(asyncio.run(read(server))) > 0
+        assert server.get_round_trips() == {"/pool/ajaxCommands/get": 1}
+
+
+def test_async_rejected_restored_session_is_forgotten(tmp_path):
+    store = HydrocaptSessionStore(str(tmp_path / "sessions.json"))
+
+    async def read(server):
+        async with AsyncHydrocaptClient("user", "password", base_url=server.base_url, session_store=store) as client:
+            return await client.get_commands_current_states()
+
+    with HydrocaptFakeServer(session_ttl=0.2) as server:
+        pool = server.add_pool("user", "password", 1234)
+        asyncio.run(read(server))
+        old_cookies = store.load_cookies("user", server.base_url)[0]
+
+        # the stored session expired, it is replaced by a new login
+        time.sleep(0.3)
+        server.reset_round_trips()
+        assert len(asyncio.run(read(server))) > 0
+        assert server.get_round_trips()["/pool/poolLogin/login"] == 1
+        assert store.load_cookies("user", server.base_url)[0] != old_cookies
+
+        # and forgotten when the new login fails
+        time.sleep(0.3)
+        pool.password = "changed"
+        with pytest.raises(HydrocaptError):
+            asyncio.run(read(server))
+        assert store.load("user", server.base_url) is None
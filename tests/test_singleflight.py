@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import threading
+import time
+
+import pytest
+
+from py_hydrocapt.deadline import check_wait
+from py_hydrocapt.deadline import deadline_scope
+from py_hydrocapt.exceptions import HydrocaptDeadlineExceeded
+from py_hydrocapt.singleflight import AsyncHydrocaptSingleFlight
+from py_hydrocapt.singleflight import HydrocaptSingleFlight
+
+
+def _slow_read(delay, calls):
+    def read():
+        calls.append(threading.current_thread().name)
+        time.sleep(check_wait(delay, "reading"))
+        return "values"
+    return read
+
+
+def test_follower_waits_only_until_its_deadline():
+    flights = HydrocaptSingleFlight()
+    calls = []
+    leader = threading.Thread(target=flights.do, args=("measures", _slow_read(0.45, calls)))
+    leader.start()
+    time.sleep(0.05)
+
+    start = time.monotonic()
+    with deadline_scope(0.1):
+        with pytest.raises(HydrocaptDeadlineExceeded):
+            flights.do("measures", _slow_read(0.45, calls))
+    assert time.monotonic() - start < 0.3
+    leader.join()
+    assert len(calls) == 1
+
+
+def test_follower_calls_again_when_the_leader_ran_out_of_its_deadline():
+    flights = HydrocaptSingleFlight()
+    calls = []
+    errors = []
+
+    def read():
+        time.sleep(0.3)
+        calls.append("leader")
+        raise HydrocaptDeadlineExceeded("Deadline exceeded while reading")
+
+    def lead_expiring():
+        with deadline_scope(0.2):
+            try:
+                flights.do("measures", read)
+            except HydrocaptDeadlineExceeded as e:
+                errors.append(e)
+
+    leader = threading.Thread(target=lead_expiring)
+    leader.start()
+    time.sleep(0.05)
+
+    assert flights.do("measures", lambda: calls.append("follower") or "values") == "values"
+    leader.join()
+    assert calls == ["leader", "follower"]
+    assert len(errors) == 1
+
+
+def test_async_follower_deadlines():
+    flights = AsyncHydrocaptSingleFlight()
+    calls = []
+
+    async def slow(delay, expire=False):
+        calls.append(delay)
+        await asyncio.sleep(delay)
+        if expire:
+            raise HydrocaptDeadlineExceeded("Deadline exceeded while reading")
+        return delay
+
+    async def run():
+        # a follower gives up at its own deadline, the shared call goes on
+        leader = asyncio.ensure_future(flights.do("measures", lambda: slow(0.3)))
+        await asyncio.sleep(0.01)
+        with deadline_scope(0.05):
+            with pytest.raises(HydrocaptDeadlineExceeded):
+                await flights.do("measures", lambda: slow(0.3))
+        assert await leader == 0.3
+
+        # the deadline error of the leader makes the follower call again
+        leader = asyncio.ensure_future(flights.do("alarms", lambda: slow(0.1, expire=True)))
+        await asyncio.sleep(0.01)
+        assert await flights.do("alarms", lambda: slow(0.02)) == 0.02
+        with pytest.raises(HydrocaptDeadlineExceeded):
+            await leader
+
+    asyncio.run(run())
+    assert calls == [0.3, 0.1, 0.02]
@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import random
+
+import pytest
+
+from py_hydrocapt.exceptions import HydrocaptError
+from py_hydrocapt.snapshot import HydrocaptTimer
+
+
+def test_hours_round_trip():
+    rnd = random.Random(4)
+    for _ in range(50):
+        hours = [rnd.random() < 0.5 for _ in range(24)]
+        timer = HydrocaptTimer.from_hours(hours)
+        assert timer.to_hours() == hours
+        assert list(timer) == hours
+        assert timer.on_hours() == [h for h, v in enumerate(hours) if v]
+
+
+def test_internal_round_trip():
+    value = "110000000000000000000011"
+    timer = HydrocaptTimer.from_internal(value)
+    assert timer.to_internal() == value
+    assert timer.on_hours() == [0, 1, 22, 23]
+    assert timer[0] and not timer[2]
+    assert HydrocaptTimer.from_internal(timer.to_internal()) == timer
+
+
+def test_internal_first_character_is_hour_zero():
+    assert HydrocaptTimer.from_internal("1" + "0" * 23) == 1
+    assert HydrocaptTimer.from_internal("0" * 23 + "1") == 1 << 23
+
+
+def test_internal_other_characters_are_on():
+    assert HydrocaptTimer.from_internal("x" + "0" * 23).on_hours() == [0]
+
+
+@pytest.mark.parametrize("value", ["1" * 23, "1" * 25])
+def test_internal_needs_24_values(value):
+    with pytest.raises(HydrocaptError):
+        HydrocaptTimer.from_internal(value)
+
+
+def test_hours_need_24_values():
+    with pytest.raises(HydrocaptError):
+        HydrocaptTimer.from_hours([True] * 23)
+
+
+def test_range_mask():
+    assert HydrocaptTimer(HydrocaptTimer.range_mask(8, 12)).on_hours() == [8, 9, 10, 11]
+    assert HydrocaptTimer(HydrocaptTimer.range_mask(20, 24)).on_hours() == [20, 21, 22, 23]
+    assert HydrocaptTimer.range_mask(5, 5) == 0
+
+
+def test_range_mask_wraps_around_midnight():
+    assert HydrocaptTimer(HydrocaptTimer.range_mask(22, 2)).on_hours() == [0, 1, 22, 23]
+    assert HydrocaptTimer(HydrocaptTimer.range_mask(23, 0)).on_hours() == [23]
+
+
+@pytest.mark.parametrize("start,end", [(-1, 3), (24, 3), (3, 25)])
+def test_range_mask_invalid_hours(start, end):
+    with pytest.raises(HydrocaptError):
+        HydrocaptTimer.range_mask(start, end)
+
+
+def test_set_and_clear():
+    timer = HydrocaptTimer().set(3).set(23)
+    assert timer.on_hours() == [3, 23]
+    assert timer.clear(3).on_hours() == [23]
+    assert timer.clear(4) == timer
+    assert isinstance(timer.clear(3), HydrocaptTimer)
+    with pytest.raises(HydrocaptError):
+        timer.set(24)
+
+
+def test_set_and_clear_ranges():
+    timer = HydrocaptTimer().set_range(22, 3)
+    assert timer.on_hours() == [0, 1, 2, 22, 23]
+    assert timer.clear_range(23, 1).on_hours() == [1, 2, 22]
+
+
+def test_invalid_mask():
+    with pytest.raises(HydrocaptError):
+        HydrocaptTimer(1 << 24)
+    with pytest.raises(HydrocaptError):
+        HydrocaptTimer(-1)
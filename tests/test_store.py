@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+import warnings
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+
+import numpy as np
+import pytest
+
+from py_hydrocapt.exceptions import HydrocaptError
+from py_hydrocapt.history import HydrocaptHistoryRecord
+from py_hydrocapt.store import HydrocaptMeasureStore
+
+_START = datetime(2024, 12, 20)
+_HOURS = 24 * 75
+_EMPTY_DAY = date(2025, 1, 10)
+
+
+def _ph_values():
+    rnd = np.random.default_rng(8)
+    values = rnd.normal(7.2, 0.3, _HOURS)
+    values[rnd.random(_HOURS) < 0.1] = np.nan
+    for h in range(_HOURS):
+        if (_START + timedelta(hours=h)).date() == _EMPTY_DAY:
+            values[h] = np.nan
+    return values
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = HydrocaptMeasureStore(str(tmp_path / "measures.npy"), initial_capacity=24)
+    records = [{"date_time": _START + timedelta(hours=h), "ph": None if np.isnan(v) else float(v)}
+               for h, v in enumerate(_ph_values())]
+    # out of order, to go through the merge
+    store.append(records[1000:])
+    store.append(records[:1000])
+    yield store
+    store.close()
+
+
+def _expected(period, percentiles):
+    # the store keeps float32 values
+    values = _ph_values().astype(np.float32).astype(np.float64)
+    groups = {}
+    for h, v in enumerate(values):
+        day = (_START + timedelta(hours=h)).date()
+        if period == "day":
+            key = day
+        elif period == "week":
+            key = day - timedelta(days=day.weekday())
+        else:
+            key = day.replace(day=1)
+        groups.setdefault(key, []).append(v)
+
+    res = {"period_start": [], "count": [], "min": [], "max": [], "mean": []}
+    res.update({f"p{q:g}": [] for q in percentiles})
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        for key in sorted(groups):
+            group = np.array(groups[key])
+            res["period_start"].append(np.datetime64(key, "D"))
+            res["count"].append(int(np.count_nonzero(~np.isnan(group))))
+            res["min"].append(np.nanmin(group))
+            res["max"].append(np.nanmax(group))
+            res["mean"].append(np.nanmean(group))
+            for q in percentiles:
+                res[f"p{q:g}"].append(np.nanpercentile(group, q))
+    return res
+
+
+@pytest.mark.parametrize("period", ["day", "week", "month"])
+def test_aggregate_matches_numpy(store, period):
+    percentiles = (5, 50, 90, 99.5)
+    res = store.aggregate("ph", period, percentiles)
+    expected = _expected(period, percentiles)
+
+    assert list(res["period_start"]) == expected["period_start"]
+    assert list(res["count"]) == expected["count"]
+    for k in ["min", "max", "mean"] + [f"p{q:g}" for q in percentiles]:
+        np.testing.assert_allclose(res[k], expected[k], rtol=1e-9, equal_nan=True, err_msg=k)
+
+
+def test_period_without_values(store):
+    res = store.aggregate("ph", "day", (50,))
+    i = list(res["period_start"]).index(np.datetime64(_EMPTY_DAY, "D"))
+    assert res["count"][i] == 0
+    assert np.isnan(res["mean"][i]) and np.isnan(res["p50"][i])
+
+
+def test_aggregate_range(store):
+    # a day as end includes all its hours
+    res = store.aggregate("ph", "month", start=date(2025, 1, 1), end=date(2025, 1, 31))
+    assert list(res["period_start"]) == [np.datetime64("2025-01-01")]
+    assert res["count"][0] == np.count_nonzero(~np.isnan(store.column("ph", date(2025, 1, 1), date(2025, 1, 31))))
+    assert len(store.column("ph", date(2025, 1, 1), date(2025, 1, 31))) == 31 * 24
+
+
+def test_aggregate_empty(tmp_path):
+    store = HydrocaptMeasureStore(str(tmp_path / "empty.npy"))
+    res = store.aggregate("redox", "week", (50,))
+    assert len(res["period_start"]) == 0 and len(res["p50"]) == 0
+    store.close()
+
+
+def test_aggregate_unknown_names(store):
+    with pytest.raises(HydrocaptError):
+        store.aggregate("salt")
+    with pytest.raises(HydrocaptError):
+        store.aggregate("ph", "year")
+
+
+def test_append_replaces_hours(tmp_path):
+    store = HydrocaptMeasureStore(str(tmp_path / "measures.npy"))
+    hour = datetime(2025, 3, 1, 10)
+    store.append([HydrocaptHistoryRecord(hour, 27.0, None, 7.1, None, None)])
+    store.append([HydrocaptHistoryRecord(hour, 27.5, None, 7.3, None, None)])
+    assert len(store) == 1
+    assert store.column("water_temperature")[0] == pytest.approx(27.5)
+    store.close()
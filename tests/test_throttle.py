@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+from urllib.parse import urlparse
+
+import pytest
+
+from py_hydrocapt import AsyncHydrocaptClient
+from py_hydrocapt import HydrocaptClient
+from py_hydrocapt.exceptions import HydrocaptDeadlineExceeded
+from py_hydrocapt.fake_server import HydrocaptFakeServer
+from py_hydrocapt.throttle import HYDROCAPT_CIRCUIT_CLOSED
+from py_hydrocapt.throttle import HydrocaptCircuitBreaker
+from py_hydrocapt.throttle import HydrocaptRateLimiter
+
+
+@pytest.fixture
+def server():
+    with HydrocaptFakeServer() as srv:
+        srv.add_pool("user", "password", 1234)
+        yield srv
+
+
+def _half_open(server):
+    """A breaker half open toward the server and a rate limiter making the next request wait about 0.4s."""
+    host = urlparse(server.base_url).netloc
+    breaker = HydrocaptCircuitBreaker(failure_threshold=1, reset_timeout=0.05, half_open_probes=1)
+    limiter = HydrocaptRateLimiter(host_rate=2, host_burst=1, account_rate=None)
+    limiter.reserve(host)
+    breaker.record_failure(host)
+    time.sleep(0.1)
+    return host, breaker, limiter
+
+
+def test_probe_released_when_rate_limit_wait_exceeds_deadline(server):
+    host, breaker, limiter = _half_open(server)
+    client = HydrocaptClient("user", "password", base_url=server.base_url, rate_limiter=limiter, circuit_breaker=breaker)
+
+    with pytest.raises(HydrocaptDeadlineExceeded):
+        client.get_commands_current_states(deadline=0.1)
+
+    # the probe slot was given back: the next request is sent and closes the circuit
+    assert len(client.get_commands_current_states()) > 0
+    assert breaker.get_state(host) == HYDROCAPT_CIRCUIT_CLOSED
+
+
+def test_async_probe_released_when_rate_limit_wait_exceeds_deadline(server):
+    host, breaker, limiter = _half_open(server)
+
+    async def run():
+        async with AsyncHydrocaptClient("user", "password", base_url=server.base_url, rate_limiter=limiter,
+                                        circuit_breaker=breaker) as client:
+            with pytest.raises(HydrocaptDeadlineExceeded):
+                await client.get_commands_current_states(deadline=0.1)
+            return await client.get_commands_current_states()
+
+    assert len(asyncio.run(run())) > 0
+    assert breaker.get_state(host) == HYDROCAPT_CIRCUIT_CLOSED
+
+
+def test_cancelled_reservations_are_given_back():
+    limiter = HydrocaptRateLimiter(host_rate=2, host_burst=1, account_rate=1, account_burst=1)
+    assert limiter.reserve("host", "user") == 0.0
+    assert limiter.reserve("host", "user") == pytest.approx(1.0, abs=0.05)
+
+    limiter.cancel("host", "user")
+    assert limiter.reserve("host", "user") == pytest.approx(1.0, abs=0.05)
+    # another account only waits for the host bucket
+    assert limiter.reserve("host", "other") == pytest.approx(1.0, abs=0.05)
+
+
+def test_rate_limit_wait_exceeding_deadline_gives_back_the_reservation(server):
+    host = urlparse(server.base_url).netloc
+    limiter = HydrocaptRateLimiter(host_rate=2, host_burst=1, account_rate=None)
+    limiter.reserve(host)
+    client = HydrocaptClient("user", "password", base_url=server.base_url, rate_limiter=limiter)
+
+    with pytest.raises(HydrocaptDeadlineExceeded):
+        client.get_commands_current_states(deadline=0.1)
+
+    # the request that was not sent doesn't delay the next ones
+    assert limiter.reserve(host) == pytest.approx(0.5, abs=0.05)